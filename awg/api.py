@@ -0,0 +1,66 @@
+import os
+import inspect
+import logging
+from aiohttp import web
+
+API_PATH = '/v1'
+MAX_BATCH = 1000
+
+logger = logging.getLogger(__name__)
+
+class ApiError(Exception):
+    pass
+
+async def call(operations, request):
+    if not isinstance(request, dict) or not isinstance(request.get('method'), str):
+        return {'error': 'request must be an object with a method'}
+    response = {'id': request['id']} if 'id' in request else {}
+    operation = operations.get(request['method'])
+    params = request.get('params') or {}
+    if operation is None:
+        response['error'] = f"unknown method {request['method']}"
+        return response
+    if not isinstance(params, dict):
+        response['error'] = 'params must be an object'
+        return response
+    try:
+        inspect.signature(operation).bind(**params)
+    except TypeError as e:
+        response['error'] = str(e)
+        return response
+    try:
+        response['result'] = await operation(**params)
+    except ApiError as e:
+        response['error'] = str(e)
+    except Exception:
+        logger.exception("API method %s failed", request['method'])
+        response['error'] = 'internal error'
+    return response
+
+def create_app(operations):
+    async def handle(request):
+        try:
+            body = await request.json()
+        except ValueError:
+            return web.json_response({'error': 'invalid JSON'}, status=400)
+        if isinstance(body, list):
+            if len(body) > MAX_BATCH:
+                return web.json_response({'error': f'batch is limited to {MAX_BATCH} requests'}, status=400)
+            return web.json_response([await call(operations, item) for item in body])
+        return web.json_response(await call(operations, body))
+
+    app = web.Application(client_max_size=16 * 1024 * 1024)
+    app.router.add_post(API_PATH, handle)
+    return app
+
+async def start(path, operations):
+    if os.path.exists(path):
+        os.unlink(path)
+    runner = web.AppRunner(create_app(operations), access_log=None)
+    await runner.setup()
+    umask = os.umask(0o077)
+    try:
+        await web.UnixSite(runner, path).start()
+    finally:
+        os.umask(umask)
+    return runner
@@ -0,0 +1,73 @@
+import os
+import re
+import json
+from datetime import datetime, timedelta
+import pytz
+
+ARCHIVE_FILE = 'files/archive.json'
+
+def load_archive():
+    if not os.path.exists(ARCHIVE_FILE):
+        return {}
+    with open(ARCHIVE_FILE, 'r') as f:
+        try:
+            return json.load(f)
+        except json.JSONDecodeError:
+            return {}
+
+def save_archive(entries):
+    os.makedirs(os.path.dirname(ARCHIVE_FILE), exist_ok=True)
+    temp_path = ARCHIVE_FILE + '.tmp'
+    with open(temp_path, 'w') as f:
+        json.dump(entries, f, separators=(',', ':'))
+    os.replace(temp_path, ARCHIVE_FILE)
+
+def find_cold_peers(peer_index, snapshot, expirations, days, now=None):
+    if now is None:
+        now = datetime.now(pytz.UTC)
+    cutoff = now - timedelta(days=days)
+    cold = {}
+    for username in peer_index:
+        expiration = expirations.get(username)
+        client_stats = snapshot.get(username)
+        latest_handshake = client_stats['latest_handshake'] if client_stats else 0
+        if expiration and expiration <= cutoff:
+            cold[username] = 'expired'
+        elif latest_handshake and latest_handshake <= cutoff.timestamp():
+            cold[username] = 'inactive'
+    return cold
+
+def peer_block_pattern(username):
+    return re.compile(rf'\n*# BEGIN_PEER {re.escape(username)}\n.*?# END_PEER {re.escape(username)}\n?', re.DOTALL)
+
+def extract_blocks(config_text, usernames):
+    blocks = {}
+    for username in usernames:
+        match = peer_block_pattern(username).search(config_text)
+        if not match:
+            continue
+        blocks[username] = match.group(0).strip('\n') + '\n'
+        config_text = config_text[:match.start()] + '\n' + config_text[match.end():]
+    return config_text.rstrip('\n') + '\n', blocks
+
+def reserved_addresses(entries):
+    addresses = set()
+    for entry in entries.values():
+        for match in re.finditer(r'^[#\s]*AllowedIPs\s*=\s*(.+)$', entry['block'], re.MULTILINE):
+            addresses.update(address.strip() for address in match.group(1).split(',') if address.strip())
+    return sorted(addresses)
+
+def append_block(config_text, block):
+    return config_text.rstrip('\n') + '\n\n' + block
+
+def make_entry(block, peer, expiration, traffic, reason, now=None):
+    if now is None:
+        now = datetime.now(pytz.UTC)
+    return {
+        'block': block,
+        'peer': peer,
+        'expiration': expiration.isoformat() if expiration else None,
+        'traffic': traffic,
+        'reason': reason,
+        'archived_at': now.isoformat(),
+    }
@@ -6,6 +6,13 @@ import argparse
 import socket
 import ipaddress
 import re
+import os
+import json
+import time
+from multiprocessing import Pool
+
+DNS_CACHE_TTL = 300
+_dns_cache = {}
 
 def qCompress(data, level=-1):
     compressed = zlib.compress(data, level)
@@ -42,13 +49,18 @@ def is_ip_address(address):
         return False
 
 def resolve_dns_to_ip(dns_name):
+    now = time.monotonic()
+    cached = _dns_cache.get(dns_name)
+    if cached and cached[1] > now:
+        return cached[0]
     try:
         ip_address = socket.gethostbyname(dns_name)
-        return ip_address
     except socket.gaierror:
         return None
+    _dns_cache[dns_name] = (ip_address, now + DNS_CACHE_TTL)
+    return ip_address
 
-def process_conf_data(data):
+def process_conf_data(data, on_resolve=None):
     def replace_endpoint(match):
         full_line = match.group(0)
         prefix = match.group(1)
@@ -58,11 +70,11 @@ def process_conf_data(data):
         if not is_ip_address(address):
             resolved_ip = resolve_dns_to_ip(address)
             if resolved_ip:
-                print(f"Resolved DNS '{address}' to IP '{resolved_ip}'", file=sys.stderr)
+                if on_resolve:
+                    on_resolve(address, resolved_ip)
                 return f"{prefix}{resolved_ip}:{port}{suffix}"
             else:
-                print(f"Error: Could not resolve DNS name '{address}'", file=sys.stderr)
-                sys.exit(1)
+                raise ValueError(f"Could not resolve DNS name '{address}'")
         else:
             return full_line
     pattern = r'^(.*Endpoint\s*=\s*)([^\s:]+)(?::(\d+))(.*)$'
@@ -86,16 +98,101 @@ def decode(s):
         result = compressed
     return result.decode('utf-8')
 
+def iter_batch_items(source, encode_mode):
+    if source == '-':
+        lines = (line.strip() for line in sys.stdin)
+    elif os.path.isdir(source):
+        for name in sorted(os.listdir(source)):
+            path = os.path.join(source, name)
+            if os.path.isfile(path) and (not encode_mode or name.endswith('.conf')):
+                yield path
+        return
+    else:
+        with open(source, 'r', encoding='utf-8') as f:
+            lines = [line.strip() for line in f]
+    for line in lines:
+        if line and not line.startswith('#'):
+            yield line
+
+def init_batch_worker(dns_ttl):
+    global DNS_CACHE_TTL
+    DNS_CACHE_TTL = dns_ttl
+
+def process_batch_item(task):
+    index, item, encode_mode = task
+    if item.startswith('vpn://'):
+        name = f'item_{index}'
+        data = item
+    else:
+        name = os.path.splitext(os.path.basename(item))[0]
+        try:
+            with open(item, 'r', encoding='utf-8') as f:
+                data = f.read()
+        except Exception as e:
+            return {'source': item, 'name': name, 'error': str(e)}
+    try:
+        if encode_mode:
+            result = encode(process_conf_data(data))
+        else:
+            result = decode(data.strip())
+    except Exception as e:
+        return {'source': item, 'name': name, 'error': str(e)}
+    return {'source': item, 'name': name, 'result': result}
+
+def unique_name(name, used):
+    candidate = name
+    number = 1
+    while candidate in used:
+        number += 1
+        candidate = f'{name}_{number}'
+    used.add(candidate)
+    return candidate
+
+def write_batch_result(result, output_dir, encode_mode, used):
+    extension = '.vpn' if encode_mode else '.conf'
+    path = os.path.join(output_dir, unique_name(result['name'], used) + extension)
+    temp_path = path + '.tmp'
+    with open(temp_path, 'w', encoding='utf-8') as f:
+        f.write(result['result'])
+    os.replace(temp_path, path)
+    return path
+
+def run_batch(args):
+    encode_mode = args.encode
+    if args.output:
+        os.makedirs(args.output, exist_ok=True)
+    tasks = ((index, item, encode_mode) for index, item in enumerate(iter_batch_items(args.input, encode_mode)))
+    failed = 0
+    used = set()
+    with Pool(args.jobs, initializer=init_batch_worker, initargs=(args.dns_ttl,)) as pool:
+        for result in pool.imap(process_batch_item, tasks, chunksize=16):
+            if 'error' in result:
+                failed += 1
+                print(json.dumps({'source': result['source'], 'error': result['error']}, ensure_ascii=False), file=sys.stderr, flush=True)
+                continue
+            if args.output:
+                path = write_batch_result(result, args.output, encode_mode, used)
+                print(json.dumps({'source': result['source'], 'output': path}, ensure_ascii=False), flush=True)
+            else:
+                print(json.dumps({'source': result['source'], 'result': result['result']}, ensure_ascii=False), flush=True)
+    return 1 if failed else 0
+
 def main():
     parser = argparse.ArgumentParser(description='Encode and decode VPN configuration files to/from vpn:// format.')
     group = parser.add_mutually_exclusive_group(required=True)
     group.add_argument('-e', '--encode', action='store_true', help='Encode a .conf file to vpn:// format.')
     group.add_argument('-d', '--decode', action='store_true', help='Decode a vpn:// string to configuration data.')
-    parser.add_argument('input', help='Input file for encoding or vpn:// string for decoding.')
-    parser.add_argument('-o', '--output', help='Output file. If not specified, output will be printed to console.')
+    parser.add_argument('input', help='Input file for encoding or vpn:// string for decoding. In batch mode: a directory, a manifest file or - for stdin.')
+    parser.add_argument('-o', '--output', help='Output file. If not specified, output will be printed to console. In batch mode: output directory.')
+    parser.add_argument('-b', '--batch', action='store_true', help='Process many configs or vpn:// strings and stream results as JSON lines.')
+    parser.add_argument('-j', '--jobs', type=int, default=os.cpu_count() or 1, help='Number of worker processes in batch mode.')
+    parser.add_argument('--dns-ttl', type=int, default=DNS_CACHE_TTL, help='Seconds to cache resolved Endpoint names.')
 
     args = parser.parse_args()
 
+    if args.batch:
+        sys.exit(run_batch(args))
+
     if args.encode:
         try:
             with open(args.input, 'r', encoding='utf-8') as f:
@@ -107,7 +204,13 @@ def main():
             print(f'Error reading file {args.input}: {e}')
             sys.exit(1)
 
-        processed_data = process_conf_data(data)
+        try:
+            processed_data = process_conf_data(
+                data, lambda address, ip: print(f"Resolved DNS '{address}' to IP '{ip}'", file=sys.stderr)
+            )
+        except ValueError as e:
+            print(f'Error: {e}', file=sys.stderr)
+            sys.exit(1)
 
         encoded_string = encode(processed_data)
 
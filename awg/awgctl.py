@@ -0,0 +1,84 @@
+import sys
+import json
+import socket
+import argparse
+import http.client
+import settings
+
+class UnixHTTPConnection(http.client.HTTPConnection):
+    def __init__(self, path, timeout=300):
+        super().__init__('localhost', timeout=timeout)
+        self.path = path
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.settimeout(self.timeout)
+        self.sock.connect(self.path)
+
+def post(connection, payload):
+    body = json.dumps(payload).encode()
+    connection.request('POST', '/v1', body=body, headers={'Content-Type': 'application/json'})
+    response = connection.getresponse()
+    return json.loads(response.read())
+
+def default_socket():
+    try:
+        return settings.load().api_socket
+    except (OSError, ValueError):
+        return ''
+
+def main():
+    parser = argparse.ArgumentParser(description='Manage clients through the bot\'s local JSON API.')
+    parser.add_argument('--socket', help='API socket path (api_socket from setting.ini by default).')
+    commands = parser.add_subparsers(dest='command', required=True)
+    commands.add_parser('list', help='List clients.')
+    stats_parser = commands.add_parser('stats', help='Show transfer counters and rates.')
+    stats_parser.add_argument('names', nargs='*')
+    add_parser = commands.add_parser('add', help='Add a client and print its config.')
+    add_parser.add_argument('name')
+    add_parser.add_argument('--ipv6', action='store_true')
+    add_parser.add_argument('--days', type=float)
+    add_parser.add_argument('--limit-gb', type=float)
+    for command in ('block', 'unblock', 'delete'):
+        commands.add_parser(command, help=f'{command.capitalize()} clients.').add_argument('names', nargs='+')
+    quota_parser = commands.add_parser('set-quota', help='Set a traffic limit and reset usage.')
+    quota_parser.add_argument('name')
+    quota_parser.add_argument('--limit-gb', type=float, help='Omit for unlimited.')
+    expiry_parser = commands.add_parser('set-expiry', help='Set the expiry counted from now.')
+    expiry_parser.add_argument('name')
+    expiry_parser.add_argument('--days', type=float, help='Omit for no expiry.')
+    commands.add_parser('batch', help='Send JSON requests read line by line from stdin in one batch.')
+    args = parser.parse_args()
+
+    path = args.socket or default_socket()
+    if not path:
+        parser.error('api_socket is not set in setting.ini, pass --socket')
+    if args.command == 'batch':
+        payload = [json.loads(line) for line in sys.stdin if line.strip()]
+    else:
+        params = {
+            'list': lambda: {},
+            'stats': lambda: {'names': args.names} if args.names else {},
+            'add': lambda: {'name': args.name, 'ipv6': args.ipv6, 'days': args.days, 'limit_gb': args.limit_gb},
+            'block': lambda: {'names': args.names},
+            'unblock': lambda: {'names': args.names},
+            'delete': lambda: {'names': args.names},
+            'set-quota': lambda: {'name': args.name, 'limit_gb': args.limit_gb},
+            'set-expiry': lambda: {'name': args.name, 'days': args.days},
+        }[args.command]()
+        payload = {'method': args.command.replace('-', '_'), 'params': params}
+    connection = UnixHTTPConnection(path)
+    try:
+        response = post(connection, payload)
+    except OSError as e:
+        print(f"{path}: {e}", file=sys.stderr)
+        sys.exit(2)
+    finally:
+        connection.close()
+    json.dump(response, sys.stdout, ensure_ascii=False, indent=2)
+    print()
+    failed = any('error' in item for item in response) if isinstance(response, list) else 'error' in response
+    sys.exit(1 if failed else 0)
+
+if __name__ == '__main__':
+    main()
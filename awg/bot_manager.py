@@ -1,22 +1,58 @@
 import db
+import reconcile
+import clients
+import sessions
+import stats
+import history
+import reports
+import keypool
+import file_cache
+import collector
+import dashboard
+import archive
+import bulk
+import groups
+import ha
+import api
+import profiling
+import cProfile
+import tracing
+import settings
 import aiohttp
 import asyncio
 import aiofiles
 import os
 import re
 import tempfile
+import io
 import json
 import pytz
 import ipaddress
 import zipfile
 import humanize
 import logging
+import hmac
+import time
+import secrets
+import sys
+import signal
+import atexit
+import subprocess
+import functools
+import contextvars
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from aiohttp import web
 from aiogram import Bot, types
+from aiogram.bot.api import TelegramAPIServer
 from aiogram.dispatcher import Dispatcher
 from aiogram.dispatcher.middlewares import BaseMiddleware
+from aiogram.dispatcher.handler import CancelHandler, current_handler
 from aiogram.utils import executor
+from aiogram.utils.exceptions import MessageNotModified
 from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, date
 from apscheduler.schedulers.asyncio import AsyncIOScheduler
 from apscheduler.triggers.date import DateTrigger
 
@@ -25,16 +61,75 @@ logger = logging.getLogger(__name__)
 
 humanize.i18n.activate('ru')
 
-setting = db.get_config()
-bot = Bot(setting['bot_token'])
-admin = int(setting['admin_id'])
-WG_CONFIG_FILE = setting['wg_config_file']
-WG_CMD = 'awg' if 'amnezia' in WG_CONFIG_FILE.lower() else 'wg'
-WG_QUICK_CMD = 'awg-quick' if 'amnezia' in WG_CONFIG_FILE.lower() else 'wg-quick'
+# Rollout workers are forked now, while the process has no threads yet: a
+# spawned worker would re-import this module and start polling.
+rollout_pool = ProcessPoolExecutor(mp_context=multiprocessing.get_context('fork'))
+rollout_pool.submit(int).result()
+
+try:
+    db.get_config()
+    config = settings.get()
+except ValueError as e:
+    print(f"Ошибка в {settings.SETTINGS_FILE}: {e}")
+    sys.exit(1)
+class TracedBot(Bot):
+    async def request(self, method, data=None, files=None, **kwargs):
+        with tracing.span(f"bot.{method}"):
+            return await super().request(method, data, files, **kwargs)
+
+API_SERVER = config.api_server
+bot = TracedBot(config.bot_token, server=TelegramAPIServer.from_base(API_SERVER)) if API_SERVER else TracedBot(config.bot_token)
+RECONCILE_INTERVAL = config.reconcile_interval
+BOT_MODE = config.mode
+WEBHOOK_URL = config.webhook_url
+WEBHOOK_PATH = config.webhook_path
+WEBHOOK_HOST = config.webhook_host
+WEBHOOK_PORT = config.webhook_port
+WEBHOOK_SECRET = config.webhook_secret or (secrets.token_urlsafe(32) if WEBHOOK_URL else '')
+KEY_POOL_REFILL_INTERVAL = config.key_pool_refill_interval
+KEY_POOL_REFILL_BATCH = config.key_pool_refill_batch
+STATS_COLLECTOR = config.stats_collector
+STATS_COLLECTOR_INTERVAL = config.stats_collector_interval
+STATS_COLLECTOR_CAPACITY = config.stats_collector_capacity
+DASHBOARD_INTERVAL = config.dashboard_interval
+DASHBOARD_MIN_EDIT_GAP = 3
+SETTINGS_WATCH_INTERVAL = 30
+HA = config.ha
+HA_LISTEN = config.ha_listen
+HA_PEER = config.ha_peer
+HA_SECRET = config.ha_secret
+HA_REPLICATE_INTERVAL = 2
+API_SOCKET = config.api_socket
+HA_FULL_SYNC_INTERVAL = 60
+ha_lease = ha.FileLease(config.ha_lock_file) if HA else None
+
+def apply_settings(config):
+    global admins, WG_CONFIG_FILE, WG_CMD, WG_QUICK_CMD, ENDPOINT, RECONCILE_AUTOFIX, SESSION_TTL
+    global SELF_SERVICE, SELF_SERVICE_RATE, KEY_POOL_SIZE, BILLING_DAY, TOP_USERS_COUNT, DASHBOARD, ARCHIVE_AFTER_DAYS
+    admins = set(config.admin_ids)
+    WG_CONFIG_FILE = config.wg_config_file
+    WG_CMD = config.wg_cmd
+    WG_QUICK_CMD = config.wg_quick_cmd
+    ENDPOINT = config.endpoint
+    RECONCILE_AUTOFIX = config.reconcile_autofix
+    SESSION_TTL = timedelta(hours=config.session_ttl)
+    SELF_SERVICE = config.self_service
+    SELF_SERVICE_RATE = config.self_service_rate
+    KEY_POOL_SIZE = config.key_pool_size
+    BILLING_DAY = config.billing_day
+    TOP_USERS_COUNT = config.top_users_count
+    DASHBOARD = config.dashboard
+    ARCHIVE_AFTER_DAYS = config.archive_after_days
+    tracing.sample_rate = config.trace_sample_rate
+
+apply_settings(config)
+
+def is_admin(user_id):
+    return user_id in admins
 
 class AdminMessageDeletionMiddleware(BaseMiddleware):
     async def on_process_message(self, message: types.Message, data: dict):
-        if message.from_user.id == admin:
+        if is_admin(message.from_user.id):
             asyncio.create_task(delete_message_after_delay(message.chat.id, message.message_id, delay=2))
 
 dp = Dispatcher(bot)
@@ -42,26 +137,105 @@ logger = logging.getLogger(__name__)
 scheduler = AsyncIOScheduler(timezone=pytz.UTC)
 scheduler.start()
 
+class TracingMiddleware(BaseMiddleware):
+    async def on_pre_process_update(self, update: types.Update, data: dict):
+        root = tracing.start_trace('update')
+        data['trace'] = root.__enter__()
+
+    def name_trace(self, kind):
+        root = tracing.current.get()
+        handler = current_handler.get()
+        if root is not None and root.parent is None and handler is not None:
+            root.name = f"{kind}.{handler.__name__}"
+
+    async def on_process_message(self, message: types.Message, data: dict):
+        self.name_trace('message')
+
+    async def on_process_callback_query(self, callback_query: types.CallbackQuery, data: dict):
+        self.name_trace('callback')
+
+    async def on_post_process_update(self, update: types.Update, results, data: dict):
+        root = data.get('trace')
+        if root is not None:
+            root.__exit__(None, None, None)
+
+class DashboardMiddleware(BaseMiddleware):
+    async def on_process_callback_query(self, callback_query: types.CallbackQuery, data: dict):
+        if is_admin(callback_query.from_user.id) and callback_query.message:
+            sessions_store.get(callback_query.message.chat.id).dashboard = False
+
+CLIENT_CALLBACKS = (
+    'block_user_', 'unblock_user_', 'delete_user_', 'traffic_', 'unblock_duration_', 'reset_traffic_', 'archive_restore_',
+)
+HEAVY_SCREENS = {'list_users', 'archive', 'groups', 'bulk'}
+HEAVY_SCREEN_PREFIXES = ('top_users', 'client_', 'bulk_filter_')
+DEBOUNCE_INTERVAL = 1.5
+DEBOUNCE_MAX_ENTRIES = 1000
+
+class SingleFlightMiddleware(BaseMiddleware):
+    def __init__(self):
+        super().__init__()
+        self.in_flight = {}
+        self.finished = {}
+
+    def key(self, callback_query):
+        if callback_query.data.startswith(CLIENT_CALLBACKS):
+            return callback_query.data
+        return (callback_query.message.chat.id if callback_query.message else callback_query.from_user.id, callback_query.data)
+
+    async def on_pre_process_callback_query(self, callback_query: types.CallbackQuery, data: dict):
+        if not callback_query.data:
+            return
+        key = self.key(callback_query)
+        running = self.in_flight.get(key)
+        if running is not None:
+            await asyncio.shield(running)
+            await callback_query.answer()
+            raise CancelHandler()
+        if callback_query.data in HEAVY_SCREENS or callback_query.data.startswith(HEAVY_SCREEN_PREFIXES):
+            if time.monotonic() - self.finished.get(key, 0) < DEBOUNCE_INTERVAL:
+                await callback_query.answer()
+                raise CancelHandler()
+        self.in_flight[key] = asyncio.get_running_loop().create_future()
+        data['single_flight'] = key
+
+    async def on_post_process_callback_query(self, callback_query: types.CallbackQuery, results, data: dict):
+        key = data.get('single_flight')
+        if key is None:
+            return
+        self.in_flight.pop(key).set_result(results)
+        now = time.monotonic()
+        if len(self.finished) >= DEBOUNCE_MAX_ENTRIES:
+            self.finished = {k: t for k, t in self.finished.items() if now - t < DEBOUNCE_INTERVAL}
+        self.finished[key] = now
+
+dp.middleware.setup(TracingMiddleware())
 dp.middleware.setup(AdminMessageDeletionMiddleware())
+dp.middleware.setup(DashboardMiddleware())
+dp.middleware.setup(SingleFlightMiddleware())
 
 main_menu_markup = InlineKeyboardMarkup(row_width=1).add(
     InlineKeyboardButton("Добавить пользователя", callback_data="add_user"),
     InlineKeyboardButton("Получить файлы пользователя", callback_data="get_config"),
     InlineKeyboardButton("Список клиентов", callback_data="list_users"),
+    InlineKeyboardButton("Топ пользователей", callback_data="top_users"),
+    InlineKeyboardButton("Группы", callback_data="groups"),
+    InlineKeyboardButton("Архив", callback_data="archive"),
     InlineKeyboardButton("Создать бекап", callback_data="create_backup"),
     InlineKeyboardButton("Перезагрузить протокол", callback_data="reload_config")
 )
 
-user_main_messages = {}
+sessions_store = sessions.SessionStore(SESSION_TTL.total_seconds())
 isp_cache = {}
 ISP_CACHE_FILE = 'files/isp_cache.json'
 CACHE_TTL = timedelta(hours=24)
 TRAFFIC_LIMITS_FILE = 'files/traffic_limits.json'
-previous_traffic = {}
+USER_LINKS_FILE = 'files/user_links.json'
+last_drift_summary = None
 
 def load_traffic_limits():
     if os.path.exists(TRAFFIC_LIMITS_FILE):
-        with open(TRAFFIC_LIMITS_FILE, 'r') as f:
+        with tracing.span('read traffic limits'), open(TRAFFIC_LIMITS_FILE, 'r') as f:
             limits = json.load(f)
             for username, data in limits.items():
                 if 'limit' in data and isinstance(data['limit'], str):
@@ -76,9 +250,42 @@ def load_traffic_limits():
 
 def save_traffic_limits(limits):
     os.makedirs(os.path.dirname(TRAFFIC_LIMITS_FILE), exist_ok=True)
-    with open(TRAFFIC_LIMITS_FILE, 'w') as f:
+    with tracing.span('write traffic limits'), open(TRAFFIC_LIMITS_FILE, 'w') as f:
         json.dump(limits, f)
 
+def load_user_links():
+    if os.path.exists(USER_LINKS_FILE):
+        with open(USER_LINKS_FILE, 'r') as f:
+            try:
+                return {int(user_id): username for user_id, username in json.load(f).items()}
+            except (json.JSONDecodeError, ValueError):
+                return {}
+    return {}
+
+def save_user_links(links):
+    os.makedirs(os.path.dirname(USER_LINKS_FILE), exist_ok=True)
+    with open(USER_LINKS_FILE, 'w') as f:
+        json.dump({str(user_id): username for user_id, username in links.items()}, f)
+
+class RateLimiter:
+    def __init__(self, rate, period=60):
+        self.rate = rate
+        self.period = period
+        self.buckets = {}
+
+    def allow(self, key):
+        now = time.monotonic()
+        tokens, last = self.buckets.get(key, (self.rate, now))
+        tokens = min(self.rate, tokens + (now - last) * self.rate / self.period)
+        if tokens < 1:
+            self.buckets[key] = (tokens, now)
+            return False
+        self.buckets[key] = (tokens - 1, now)
+        return True
+
+user_links = {}
+self_service_limiter = RateLimiter(SELF_SERVICE_RATE)
+
 async def load_isp_cache():
     global isp_cache
     if os.path.exists(ISP_CACHE_FILE):
@@ -188,78 +395,105 @@ def is_user_blocked(username):
     except:
         return False
 
-async def block_user(username):
+def comment_peer_block(config, username):
+    pattern = rf'(# BEGIN_PEER {username}\n)(.*?)(# END_PEER {username})'
+    match = re.search(pattern, config, re.DOTALL)
+    if not match:
+        return None
+    start = match.group(1)
+    peer_block = match.group(2)
+    end = match.group(3)
+    lines = peer_block.splitlines(keepends=True)
+    commented_lines = [f'# {line}' if not line.strip().startswith('#') else line for line in lines]
+    commented_block = ''.join(commented_lines)
+    new_block = f'{start}{commented_block}{end}'
+    return config.replace(match.group(0), new_block)
+
+def uncomment_peer_block(config, username):
+    pattern = rf'(# BEGIN_PEER {username}\n)(.*?)(# END_PEER {username})'
+    match = re.search(pattern, config, re.DOTALL)
+    if not match:
+        return None
+    start = match.group(1)
+    peer_block = match.group(2)
+    end = match.group(3)
+    lines = peer_block.splitlines(keepends=True)
+    uncommented_lines = [line.lstrip('# ').rstrip('\n') + '\n' for line in lines]
+    uncommented_block = ''.join(uncommented_lines)
+    new_block = f'{start}{uncommented_block}{end}'
+    return config.replace(match.group(0), new_block)
+
+def edit_peer_blocks(config, usernames, edit):
+    edited = []
+    for username in usernames:
+        new_config = edit(config, username)
+        if new_config is not None:
+            config = new_config
+            edited.append(username)
+    return config, edited
+
+config_lock = asyncio.Lock()
+
+async def rewrite_config(transform):
+    async with config_lock:
+        with tracing.span('read wg config'):
+            async with aiofiles.open(WG_CONFIG_FILE, 'r') as f:
+                original_config = await f.read()
+        config, edited = transform(original_config)
+        if not edited:
+            return []
+        if config != original_config:
+            with tracing.span('write wg config'):
+                async with aiofiles.open(WG_CONFIG_FILE, 'w') as f:
+                    await f.write(config)
+            if not await restart_wireguard():
+                async with aiofiles.open(WG_CONFIG_FILE, 'w') as f:
+                    await f.write(original_config)
+                return []
+        return list(edited)
+
+async def block_users(usernames):
     try:
-        async with aiofiles.open(WG_CONFIG_FILE, 'r') as f:
-            config = await f.read()
-        pattern = rf'(# BEGIN_PEER {username}\n)(.*?)(# END_PEER {username})'
-        match = re.search(pattern, config, re.DOTALL)
-        if match:
-            start = match.group(1)
-            peer_block = match.group(2)
-            end = match.group(3)
-            lines = peer_block.splitlines(keepends=True)
-            commented_lines = [f'# {line}' if not line.strip().startswith('#') else line for line in lines]
-            commented_block = ''.join(commented_lines)
-            new_block = f'{start}{commented_block}{end}'
-            config = config.replace(match.group(0), new_block)
-        else:
-            return False
-        async with aiofiles.open(WG_CONFIG_FILE, 'w') as f:
-            await f.write(config)
-        success = await restart_wireguard()
-        if not success:
-            return False
-        return True
+        return await rewrite_config(lambda config: edit_peer_blocks(config, usernames, comment_peer_block))
     except:
-        return False
+        return []
 
-async def unblock_user(username):
+async def block_user(username):
+    return username in await block_users([username])
+
+async def unblock_users(usernames):
     try:
-        async with aiofiles.open(WG_CONFIG_FILE, 'r') as f:
-            config = await f.read()
-        pattern = rf'(# BEGIN_PEER {username}\n)(.*?)(# END_PEER {username})'
-        match = re.search(pattern, config, re.DOTALL)
-        if match:
-            start = match.group(1)
-            peer_block = match.group(2)
-            end = match.group(3)
-            lines = peer_block.splitlines(keepends=True)
-            uncommented_lines = [line.lstrip('# ').rstrip('\n') + '\n' for line in lines]
-            uncommented_block = ''.join(uncommented_lines)
-            new_block = f'{start}{uncommented_block}{end}'
-            config = config.replace(match.group(0), new_block)
-        else:
-            return False
-        async with aiofiles.open(WG_CONFIG_FILE, 'w') as f:
-            await f.write(config)
-        success = await restart_wireguard()
-        if not success:
-            return False
-        return True
+        return await rewrite_config(lambda config: edit_peer_blocks(config, usernames, uncomment_peer_block))
     except:
-        return False
+        return []
+
+async def unblock_user(username):
+    return username in await unblock_users([username])
 
 async def restart_wireguard():
+    if HA and not ha_lease.held:
+        return False
     try:
         interface_name = os.path.basename(WG_CONFIG_FILE).split('.')[0]
-        process_strip = await asyncio.create_subprocess_shell(
-            f'{WG_QUICK_CMD} strip {interface_name}',
-            stdout=asyncio.subprocess.PIPE,
-            stderr=asyncio.subprocess.PIPE
-        )
-        stdout_strip, stderr_strip = await process_strip.communicate()
+        with tracing.span('subprocess wg-quick strip'):
+            process_strip = await asyncio.create_subprocess_shell(
+                f'{WG_QUICK_CMD} strip {interface_name}',
+                stdout=asyncio.subprocess.PIPE,
+                stderr=asyncio.subprocess.PIPE
+            )
+            stdout_strip, stderr_strip = await process_strip.communicate()
         if process_strip.returncode != 0:
             return False
         with tempfile.NamedTemporaryFile(delete=False) as temp_config:
             temp_config.write(stdout_strip)
             temp_config_path = temp_config.name
-        process_syncconf = await asyncio.create_subprocess_shell(
-            f'{WG_CMD} syncconf {interface_name} {temp_config_path}',
-            stdout=asyncio.subprocess.PIPE,
-            stderr=asyncio.subprocess.PIPE
-        )
-        stdout_syncconf, stderr_syncconf = await process_syncconf.communicate()
+        with tracing.span('subprocess wg syncconf'):
+            process_syncconf = await asyncio.create_subprocess_shell(
+                f'{WG_CMD} syncconf {interface_name} {temp_config_path}',
+                stdout=asyncio.subprocess.PIPE,
+                stderr=asyncio.subprocess.PIPE
+            )
+            stdout_syncconf, stderr_syncconf = await process_syncconf.communicate()
         os.unlink(temp_config_path)
         if process_syncconf.returncode != 0:
             return False
@@ -267,6 +501,9 @@ async def restart_wireguard():
     except:
         return False
 
+BACKUP_EXCLUDED_FILES = {os.path.normpath(path) for path in (clients.ARTIFACTS_DB, keypool.POOL_FILE, keypool.POOL_KEY_FILE, file_cache.FILE_ID_CACHE_FILE)}
+BACKUP_EXCLUDED_FILES |= {os.path.normpath(tracing.TRACE_FILE + suffix) for suffix in [''] + [f'.{n}' for n in range(1, tracing.TRACE_FILE_BACKUPS + 1)]}
+
 def create_zip(backup_filepath):
     with zipfile.ZipFile(backup_filepath, 'w') as zipf:
         for main_file in ['awg-decode.py', 'newclient.sh', 'removeclient.sh']:
@@ -275,11 +512,8 @@ def create_zip(backup_filepath):
         for root, dirs, files in os.walk('files'):
             for file in files:
                 filepath = os.path.join(root, file)
-                arcname = os.path.relpath(filepath, os.getcwd())
-                zipf.write(filepath, arcname)
-        for root, dirs, files in os.walk('users'):
-            for file in files:
-                filepath = os.path.join(root, file)
+                if os.path.normpath(filepath) in BACKUP_EXCLUDED_FILES:
+                    continue
                 arcname = os.path.relpath(filepath, os.getcwd())
                 zipf.write(filepath, arcname)
 
@@ -290,6 +524,64 @@ async def delete_message_after_delay(chat_id: int, message_id: int, delay: int):
     except:
         pass
 
+async def notify_admins(text, delay=15, **kwargs):
+    for admin_id in admins:
+        try:
+            sent_message = await bot.send_message(admin_id, text, disable_notification=True, **kwargs)
+        except:
+            continue
+        if delay:
+            asyncio.create_task(delete_message_after_delay(admin_id, sent_message.message_id, delay=delay))
+
+async def run_blocking(func, *args):
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(None, functools.partial(contextvars.copy_context().run, func, *args))
+
+dashboard_text = None
+
+def build_dashboard():
+    return dashboard.render(stats.snapshot, stats.rates, load_traffic_limits(), db.load_expirations())
+
+async def main_menu_text():
+    global dashboard_text
+    if not DASHBOARD:
+        return "Выберите действие:"
+    if dashboard_text is None:
+        dashboard_text = await run_blocking(build_dashboard)
+    return f"{dashboard_text}\n\nВыберите действие:"
+
+def mark_main_menu(session, text):
+    session.dashboard = True
+    session.dashboard_text = text
+    session.dashboard_edited = time.monotonic()
+
+@tracing.traced('job.refresh_dashboards')
+async def refresh_dashboards():
+    global dashboard_text
+    if not DASHBOARD:
+        return
+    watching = [session for session in sessions_store.active() if session.dashboard and session.main_message[1]]
+    if not watching:
+        return
+    if stats.shared is not None:
+        await run_blocking(stats.refresh, WG_CONFIG_FILE, WG_CMD)
+    dashboard_text = await run_blocking(build_dashboard)
+    text = await main_menu_text()
+    for session in watching:
+        if not session.dashboard or session.dashboard_text == text:
+            continue
+        if time.monotonic() - session.dashboard_edited < DASHBOARD_MIN_EDIT_GAP:
+            continue
+        main_chat_id, main_message_id = session.main_message
+        try:
+            await bot.edit_message_text(chat_id=main_chat_id, message_id=main_message_id, text=text, reply_markup=main_menu_markup)
+        except MessageNotModified:
+            pass
+        except Exception:
+            session.dashboard = False
+            continue
+        mark_main_menu(session, text)
+
 def format_vpn_key(vpn_key, num_lines=8):
     line_length = len(vpn_key) // num_lines
     if len(vpn_key) % num_lines != 0:
@@ -300,38 +592,463 @@ def format_vpn_key(vpn_key, num_lines=8):
 
 @dp.message_handler(commands=['start', 'help'])
 async def help_command_handler(message: types.Message):
-    if message.chat.id == admin:
-        sent_message = await message.answer("Выберите действие:", reply_markup=main_menu_markup)
-        user_main_messages[admin] = (sent_message.chat.id, sent_message.message_id)
+    if is_admin(message.chat.id):
+        session = sessions_store.get(message.chat.id)
+        session.reset()
+        text = await main_menu_text()
+        sent_message = await message.answer(text, reply_markup=main_menu_markup)
+        session.main_message = (sent_message.chat.id, sent_message.message_id)
+        mark_main_menu(session, text)
         try:
             await bot.pin_chat_message(chat_id=message.chat.id, message_id=sent_message.message_id, disable_notification=True)
         except:
             pass
+    elif get_linked_client(message.chat.id):
+        await message.answer(f"Клиент: {get_linked_client(message.chat.id)}", reply_markup=self_service_markup)
+    else:
+        await message.answer("У вас нет доступа к этому боту.")
+
+profile_lock = asyncio.Lock()
+
+async def send_text_file(chat_id, text, filename, caption):
+    await bot.send_document(chat_id, types.InputFile(io.BytesIO(text.encode()), filename=filename), caption=caption, disable_notification=True)
+
+@dp.message_handler(commands=['profile'])
+async def profile_command_handler(message: types.Message):
+    if not is_admin(message.chat.id):
+        await message.answer("У вас нет доступа к этому боту.")
+        return
+    args = message.get_args().split()
+    if not args or not args[0].isdigit() or not 0 < int(args[0]) <= profiling.MAX_SECONDS or args[1:] not in ([], ['sample']):
+        await message.answer(f"Использование: /profile <секунд, до {profiling.MAX_SECONDS}> [sample]")
+        return
+    if profile_lock.locked():
+        await message.answer("Профилирование уже выполняется.")
+        return
+    seconds = int(args[0])
+    stamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+    async with profile_lock:
+        await message.answer(f"Профилирование на {seconds} с...", disable_notification=True)
+        if args[1:]:
+            stacks = await run_blocking(profiling.sample_stacks, seconds)
+            await send_text_file(message.chat.id, profiling.format_samples(stacks), f"samples_{stamp}.txt", f"Сэмплы всех потоков за {seconds} с")
+            return
+        profiler = cProfile.Profile()
+        profiler.enable()
+        try:
+            await asyncio.sleep(seconds)
+        finally:
+            profiler.disable()
+        await send_text_file(message.chat.id, profiling.format_profile(profiler), f"profile_{stamp}.txt", f"cProfile цикла событий за {seconds} с")
+        await bot.send_document(
+            message.chat.id,
+            types.InputFile(io.BytesIO(profiling.dump_profile(profiler)), filename=f"profile_{stamp}.prof"),
+            disable_notification=True
+        )
+
+@dp.message_handler(commands=['memory'])
+async def memory_command_handler(message: types.Message):
+    if not is_admin(message.chat.id):
+        await message.answer("У вас нет доступа к этому боту.")
+        return
+    if message.get_args().strip() == 'stop':
+        profiling.stop_memory_tracing()
+        await message.answer("Трассировка памяти выключена.", disable_notification=True)
+        return
+    counters = {
+        'isp_cache': len(isp_cache),
+        'sessions': len(sessions_store.sessions),
+        'file_ids': len(file_cache.file_ids),
+        'stats.snapshot': len(stats.snapshot),
+        'history.recent': len(history.recent),
+        'scheduler jobs': len(scheduler.get_jobs()),
+    }
+    report = profiling.memory_report(counters)
+    stamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+    await send_text_file(message.chat.id, report, f"memory_{stamp}.txt", "Снимок памяти. Повторите /memory, чтобы увидеть прирост; /memory stop выключает трассировку.")
+
+@dp.message_handler(commands=['traces'])
+async def traces_command_handler(message: types.Message):
+    if not is_admin(message.chat.id):
+        await message.answer("У вас нет доступа к этому боту.")
+        return
+    args = message.get_args().split()
+    if args[1:] or (args and not args[0].isdigit()):
+        await message.answer("Использование: /traces [количество самых медленных трасс]")
+        return
+    top = min(int(args[0]), 100) if args else 10
+    if not tracing.sample_rate:
+        await message.answer("Трассировка выключена: задайте trace_sample_rate в setting.ini.", disable_notification=True)
+        return
+    summary = tracing.summarize(await run_blocking(tracing.load_recent), top=top)
+    if len(summary) <= 4000:
+        await message.answer(f"<pre>{summary}</pre>", parse_mode="HTML", disable_notification=True)
+    else:
+        stamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+        await send_text_file(message.chat.id, summary, f"traces_{stamp}.txt", "Сводка трасс")
+
+def get_linked_client(user_id):
+    if not SELF_SERVICE:
+        return None
+    return user_links.get(user_id)
+
+def build_usage_report(path, days):
+    period_totals = history.period_usage(date.today() - timedelta(days=days - 1)) if days else None
+    with open(WG_CONFIG_FILE, 'r') as f:
+        rows = reports.iter_report_rows(db.iter_peers(f), stats.snapshot, load_traffic_limits(), db.load_expirations(), period_totals)
+        return reports.write_csv(path, rows)
+
+@dp.message_handler(commands=['report'])
+async def report_command_handler(message: types.Message):
+    if not is_admin(message.chat.id):
+        await message.answer("У вас нет доступа к этому боту.")
+        return
+    args = message.get_args().strip()
+    if args and not args.isdigit():
+        await message.answer("Использование: /report [число дней]")
+        return
+    days = int(args) if args else 0
+    report_filename = f"usage_{date.today().isoformat()}.csv"
+    fd, report_path = tempfile.mkstemp(suffix='.csv')
+    os.close(fd)
+    try:
+        count = await run_blocking(build_usage_report, report_path, days)
+        caption = f"Клиентов: {count}" + (f", период: {days} дн." if days else "")
+        await bot.send_document(message.chat.id, types.InputFile(report_path, filename=report_filename), caption=caption, disable_notification=True)
+    except Exception:
+        logger.exception("Usage report failed")
+        await message.answer("Не удалось сформировать отчет.")
+    finally:
+        os.unlink(report_path)
+
+TOP_WINDOWS = {
+    'rate': 'Скорость сейчас',
+    'hour': 'За час',
+    'day': 'За сегодня',
+    'billing': 'За расчетный период',
+}
+TOP_MAX_COUNT = 100
+
+def billing_period_start(today):
+    if today.day >= BILLING_DAY:
+        return today.replace(day=BILLING_DAY)
+    previous_month = today.replace(day=1) - timedelta(days=1)
+    return previous_month.replace(day=BILLING_DAY)
+
+def build_top_users(window, k):
+    if window == 'rate':
+        return stats.top_rates(k)
+    if window == 'hour':
+        usage = history.recent_usage()
+    elif window == 'day':
+        usage = history.period_usage(date.today())
+    else:
+        usage = history.period_usage(billing_period_start(date.today()))
+    return stats.top_k(usage.items(), k)
+
+def format_top_users(window, top):
+    if window == 'billing':
+        title = f"{TOP_WINDOWS[window]} (с {billing_period_start(date.today()).strftime('%d.%m.%Y')})"
+    else:
+        title = TOP_WINDOWS[window]
+    if not top or not top[0][1]:
+        return f"{title}\nНет данных."
+    lines = [title]
+    for position, (username, value) in enumerate(top, 1):
+        if not value:
+            break
+        if window == 'rate':
+            rate = stats.rates[username]
+            lines.append(
+                f"{position}. {username} — {humanize.naturalsize(value, binary=True)}/с "
+                f"(↑ {humanize.naturalsize(rate['received_rate'], binary=True)}/с, ↓ {humanize.naturalsize(rate['sent_rate'], binary=True)}/с)"
+            )
+        else:
+            lines.append(f"{position}. {username} — {humanize.naturalsize(value, binary=True)}")
+    return '\n'.join(lines)
+
+def top_users_markup():
+    buttons = [InlineKeyboardButton(label, callback_data=f"top_users_{window}") for window, label in TOP_WINDOWS.items()]
+    return InlineKeyboardMarkup(row_width=2).add(*buttons).add(InlineKeyboardButton("Домой", callback_data="home"))
+
+@dp.message_handler(commands=['top'])
+async def top_command_handler(message: types.Message):
+    if not is_admin(message.chat.id):
+        await message.answer("У вас нет доступа к этому боту.")
+        return
+    args = message.get_args().split()
+    window = args[0] if args else 'rate'
+    if window not in TOP_WINDOWS or (len(args) > 1 and not args[1].isdigit()):
+        await message.answer(f"Использование: /top [{'|'.join(TOP_WINDOWS)}] [количество]")
+        return
+    k = min(int(args[1]), TOP_MAX_COUNT) if len(args) > 1 else TOP_USERS_COUNT
+    top = await run_blocking(build_top_users, window, k)
+    text = format_top_users(window, top)
+    if len(text) <= 4000:
+        await message.answer(text, disable_notification=True)
+    else:
+        stamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+        await send_text_file(message.chat.id, text, f"top_{window}_{stamp}.txt", TOP_WINDOWS[window])
+
+@dp.callback_query_handler(lambda c: c.data == 'top_users' or c.data.startswith('top_users_'))
+async def top_users_callback(callback_query: types.CallbackQuery):
+    if not is_admin(callback_query.from_user.id):
+        await callback_query.answer("У вас нет прав для выполнения этого действия.", show_alert=True)
+        return
+    chat_id = callback_query.message.chat.id
+    session = sessions_store.get(chat_id)
+    window = callback_query.data[len('top_users_'):] if callback_query.data.startswith('top_users_') else 'rate'
+    if window not in TOP_WINDOWS:
+        await callback_query.answer("Неверная команда.", show_alert=True)
+        return
+    top = await run_blocking(build_top_users, window, TOP_USERS_COUNT)
+    text = format_top_users(window, top)
+    main_chat_id, main_message_id = session.main_message
+    if main_chat_id and main_message_id:
+        try:
+            await bot.edit_message_text(
+                chat_id=main_chat_id,
+                message_id=main_message_id,
+                text=text,
+                reply_markup=top_users_markup()
+            )
+        except MessageNotModified:
+            pass
+    else:
+        sent_message = await callback_query.message.reply(text, reply_markup=top_users_markup())
+        session.main_message = (sent_message.chat.id, sent_message.message_id)
+        try:
+            await bot.pin_chat_message(chat_id=sent_message.chat.id, message_id=sent_message.message_id, disable_notification=True)
+        except:
+            pass
+    await callback_query.answer()
+
+@dp.message_handler(commands=['keypool'])
+async def keypool_command_handler(message: types.Message):
+    if not is_admin(message.chat.id):
+        await message.answer("У вас нет доступа к этому боту.")
+        return
+    pool_size = await run_blocking(keypool.size)
+    counters = keypool.counters
+    await message.answer(
+        f"Пул ключей: {pool_size} из {KEY_POOL_SIZE}\n"
+        f"Попадания: {counters['hits']}, промахи: {counters['misses']}, сгенерировано: {counters['generated']}",
+        disable_notification=True
+    )
+
+@dp.message_handler(commands=['link', 'unlink'])
+async def link_command_handler(message: types.Message):
+    if not is_admin(message.chat.id):
+        await message.answer("У вас нет доступа к этому боту.")
+        return
+    args = message.get_args().split()
+    if message.get_command(pure=True) == 'link':
+        if len(args) != 2 or not args[1].isdigit():
+            await message.answer("Использование: /link <имя клиента> <Telegram ID>")
+            return
+        username, user_id = args[0], int(args[1])
+        if clients.get_peer(username) is None:
+            await message.answer(f"Клиент {username} не найден.")
+            return
+        user_links[user_id] = username
+        text = f"Пользователь {user_id} привязан к клиенту {username}."
+    else:
+        if len(args) != 1 or not args[0].isdigit():
+            await message.answer("Использование: /unlink <Telegram ID>")
+            return
+        user_links.pop(int(args[0]), None)
+        text = f"Привязка пользователя {args[0]} удалена."
+    save_user_links(user_links)
+    await message.answer(text, disable_notification=True)
+
+self_service_markup = InlineKeyboardMarkup(row_width=2).add(
+    InlineKeyboardButton("Конфигурация", callback_data="my_config"),
+    InlineKeyboardButton("QR-код", callback_data="my_qr"),
+    InlineKeyboardButton("Ключ vpn://", callback_data="my_key"),
+    InlineKeyboardButton("Трафик и срок", callback_data="my_status")
+)
+
+def format_self_service_status(username):
+    client_stats = stats.get(username) or {'received_bytes': 0, 'sent_bytes': 0}
+    user_traffic = load_traffic_limits().get(username, {})
+    traffic_limit = user_traffic.get('limit')
+    if traffic_limit:
+        used = user_traffic.get('used', 0)
+        remaining = max(traffic_limit - used, 0)
+        traffic_str = f"{humanize.naturalsize(used, binary=True)} из {humanize.naturalsize(traffic_limit, binary=True)} (осталось {humanize.naturalsize(remaining, binary=True)})"
     else:
+        total_bytes = client_stats['received_bytes'] + client_stats['sent_bytes']
+        traffic_str = f"{humanize.naturalsize(total_bytes, binary=True)} из ♾️ Неограниченно"
+    expiration_time = db.get_user_expiration(username)
+    if expiration_time:
+        remaining_time = expiration_time - datetime.now(pytz.UTC)
+        if remaining_time.total_seconds() > 0:
+            expiration_str = humanize.naturaldelta(remaining_time, months=False, minimum_unit="seconds")
+        else:
+            expiration_str = 'Истекло'
+    else:
+        expiration_str = '♾️ Неограниченно'
+    return f"📧 Клиент: {username}\n📊 Трафик: {traffic_str}\n📅 Срок действия: {expiration_str}"
+
+@dp.callback_query_handler(lambda c: c.data in ('my_config', 'my_qr', 'my_key', 'my_status'))
+async def self_service_callback(callback_query: types.CallbackQuery):
+    user_id = callback_query.from_user.id
+    username = get_linked_client(user_id)
+    if not username:
+        await callback_query.answer("У вас нет доступа к этому боту.", show_alert=True)
+        return
+    if not self_service_limiter.allow(user_id):
+        await callback_query.answer("Слишком много запросов. Попробуйте позже.", show_alert=True)
+        return
+    chat_id = callback_query.message.chat.id
+    if callback_query.data == 'my_status':
+        await callback_query.answer()
+        await bot.send_message(chat_id, format_self_service_status(username), disable_notification=True)
+        return
+    artifacts = await get_client_artifacts(username)
+    if not artifacts:
+        await callback_query.answer("Конфигурация не найдена.", show_alert=True)
+        return
+    await callback_query.answer()
+    if callback_query.data == 'my_config':
+        await send_cached_file(chat_id, username, 'conf', artifacts['conf'], f'{username}.conf', disable_notification=True)
+    elif callback_query.data == 'my_qr':
+        await send_cached_file(chat_id, username, 'png', artifacts['png'], f'{username}.png', disable_notification=True)
+    elif artifacts['vpn_key']:
+        await bot.send_message(chat_id, f"```\n{format_vpn_key(artifacts['vpn_key'])}\n```", parse_mode="Markdown", disable_notification=True)
+    else:
+        await bot.send_message(chat_id, "VPN ключ не был сгенерирован.", disable_notification=True)
+
+def check_interface_drift(fix=False):
+    interface_name = db.get_interface_name(WG_CONFIG_FILE)
+    with open(WG_CONFIG_FILE, 'r') as f:
+        config_text = f.read()
+    peer_index = db.parse_peer_index(config_text)
+    live_peers = db.get_wg_dump(interface_name, WG_CMD)
+    drift = reconcile.diff_peers(peer_index, live_peers, reconcile.config_public_keys(config_text))
+    failed = 0
+    if fix and reconcile.has_drift(drift):
+        failed = reconcile.apply_fixes(drift, peer_index, interface_name, WG_CMD)
+    return drift, failed
+
+def format_drift_report(drift, fixed, failed):
+    summary = reconcile.format_summary(drift)
+    lines = summary.split('\n')
+    if len(lines) > 50:
+        summary = '\n'.join(lines[:50]) + f"\n... и ещё {len(lines) - 50}"
+    text = f"Обнаружено расхождение конфигурации с интерфейсом:\n{summary}"
+    if fixed:
+        text += "\n\nИсправлено." if not failed else f"\n\nНе удалось исправить: {failed}"
+    return text
+
+@tracing.traced('job.reconcile_job')
+async def reconcile_job():
+    global last_drift_summary
+    try:
+        async with config_lock:
+            drift, failed = await run_blocking(check_interface_drift, RECONCILE_AUTOFIX)
+    except Exception:
+        logger.exception("Interface reconcile failed")
+        return
+    if not reconcile.has_drift(drift):
+        last_drift_summary = None
+        return
+    summary = reconcile.format_summary(drift)
+    if summary == last_drift_summary:
+        return
+    last_drift_summary = summary
+    await notify_admins(format_drift_report(drift, RECONCILE_AUTOFIX, failed), delay=None)
+
+@dp.message_handler(commands=['archive'])
+async def archive_command_handler(message: types.Message):
+    if not is_admin(message.chat.id):
+        await message.answer("У вас нет доступа к этому боту.")
+        return
+    args = message.get_args().strip()
+    if (args and not args.isdigit()) or (not args and ARCHIVE_AFTER_DAYS <= 0):
+        await message.answer("Использование: /archive <число дней>")
+        return
+    days = int(args) if args else ARCHIVE_AFTER_DAYS
+    archived = await archive_cold_peers(days)
+    await message.answer(f"В архив перенесено клиентов: {len(archived)}.", disable_notification=True)
+
+@dp.message_handler(commands=['rollout'])
+async def rollout_command_handler(message: types.Message):
+    if not is_admin(message.chat.id):
         await message.answer("У вас нет доступа к этому боту.")
+        return
+    if rollout_lock.locked():
+        await message.answer("Перегенерация уже выполняется.", disable_notification=True)
+        return
+    try:
+        template = await run_blocking(clients.get_interface_template, WG_CONFIG_FILE, ENDPOINT, WG_CMD)
+    except (OSError, subprocess.CalledProcessError):
+        await message.answer("Ошибка при чтении параметров интерфейса.")
+        return
+    if message.get_args().strip() != 'force' and not await run_blocking(clients.template_changed, template):
+        await message.answer("Адрес сервера и ListenPort не менялись, конфигурации актуальны. Для принудительной перегенерации: /rollout force", disable_notification=True)
+        return
+    await rollout_artifacts(message.chat.id, template)
+
+@dp.message_handler(commands=['group'])
+async def group_command_handler(message: types.Message):
+    if not is_admin(message.chat.id):
+        await message.answer("У вас нет доступа к этому боту.")
+        return
+    name = message.get_args().strip()
+    if not name or len(name) > GROUP_NAME_MAX or not all(c.isalnum() or c in "-_" for c in name):
+        await message.answer(f"Использование: /group <имя> (до {GROUP_NAME_MAX} букв, цифр, дефисов и подчёркиваний)")
+        return
+    group_list = groups.load_groups()
+    if name in group_list:
+        await message.answer(f"Группа {name} уже существует.", disable_notification=True)
+        return
+    group_list[name] = groups.new_group()
+    groups.save_groups(group_list)
+    await message.answer(f"Группа {name} создана. Добавьте в нее клиентов через «Выбрать несколько» в списке клиентов.", disable_notification=True)
+
+@dp.message_handler(commands=['reconcile'])
+async def reconcile_command_handler(message: types.Message):
+    if not is_admin(message.chat.id):
+        await message.answer("У вас нет доступа к этому боту.")
+        return
+    fix = message.get_args().strip() == 'fix'
+    try:
+        async with config_lock:
+            drift, failed = await run_blocking(check_interface_drift, fix)
+    except Exception:
+        await message.answer("Ошибка при сверке конфигурации с интерфейсом.")
+        return
+    if reconcile.has_drift(drift):
+        await message.answer(format_drift_report(drift, fix, failed), disable_notification=True)
+    else:
+        await message.answer("Конфигурация совпадает с интерфейсом.", disable_notification=True)
 
 @dp.message_handler()
 async def handle_messages(message: types.Message):
-    if message.chat.id != admin:
-        await message.answer("У вас нет доступа к этому боту.")
+    if not is_admin(message.chat.id):
+        if get_linked_client(message.chat.id):
+            await message.answer("Выберите действие:", reply_markup=self_service_markup)
+        else:
+            await message.answer("У вас нет доступа к этому боту.")
         return
-    if user_main_messages.get('waiting_for_user_name'):
+    session = sessions_store.get(message.chat.id)
+    if session.state == sessions.WAITING_FOR_USER_NAME:
         user_name = message.text.strip()
         if not all(c.isalnum() or c in "-_" for c in user_name):
             sent_message = await message.reply("Имя пользователя может содержать только буквы, цифры, дефисы и подчёркивания.")
             asyncio.create_task(delete_message_after_delay(sent_message.chat.id, sent_message.message_id, delay=2))
             return
-        user_main_messages['client_name'] = user_name
-        user_main_messages['waiting_for_user_name'] = False
         ipv6_subnet = get_ipv6_subnet()
         if ipv6_subnet:
+            session.set_state(sessions.CHOOSING_CONNECTION, client_name=user_name)
             connect_buttons = [
                 InlineKeyboardButton("С IPv6", callback_data=f'connect_{user_name}_ipv6'),
                 InlineKeyboardButton("Без IPv6", callback_data=f'connect_{user_name}_noipv6'),
                 InlineKeyboardButton("Домой", callback_data="home")
             ]
             connect_markup = InlineKeyboardMarkup(row_width=1).add(*connect_buttons)
-            main_chat_id, main_message_id = user_main_messages.get(admin, (None, None))
+            main_chat_id, main_message_id = session.main_message
             if main_chat_id and main_message_id:
                 await bot.edit_message_text(
                     chat_id=main_chat_id,
@@ -343,7 +1060,7 @@ async def handle_messages(message: types.Message):
             else:
                 await message.answer("Ошибка: главное сообщение не найдено.")
         else:
-            user_main_messages['ipv6'] = 'noipv6'
+            session.set_state(sessions.CHOOSING_DURATION, client_name=user_name, ipv6='noipv6')
             duration_buttons = [
                 InlineKeyboardButton("1 час", callback_data=f"duration_1h_{user_name}_noipv6"),
                 InlineKeyboardButton("1 день", callback_data=f"duration_1d_{user_name}_noipv6"),
@@ -353,7 +1070,7 @@ async def handle_messages(message: types.Message):
                 InlineKeyboardButton("Домой", callback_data="home")
             ]
             duration_markup = InlineKeyboardMarkup(row_width=1).add(*duration_buttons)
-            main_chat_id, main_message_id = user_main_messages.get(admin, (None, None))
+            main_chat_id, main_message_id = session.main_message
             if main_chat_id and main_message_id:
                 await bot.edit_message_text(
                     chat_id=main_chat_id,
@@ -370,10 +1087,12 @@ async def handle_messages(message: types.Message):
 
 @dp.callback_query_handler(lambda c: c.data == "add_user")
 async def prompt_for_user_name(callback_query: types.CallbackQuery):
-    if callback_query.from_user.id != admin:
+    if not is_admin(callback_query.from_user.id):
         await callback_query.answer("У вас нет прав для выполнения этого действия.", show_alert=True)
         return
-    main_chat_id, main_message_id = user_main_messages.get(admin, (None, None))
+    chat_id = callback_query.message.chat.id
+    session = sessions_store.get(chat_id)
+    main_chat_id, main_message_id = session.main_message
     if main_chat_id and main_message_id:
         await bot.edit_message_text(
             chat_id=main_chat_id,
@@ -383,23 +1102,27 @@ async def prompt_for_user_name(callback_query: types.CallbackQuery):
                 InlineKeyboardButton("Домой", callback_data="home")
             )
         )
-        user_main_messages['waiting_for_user_name'] = True
+        session.reset()
+        session.set_state(sessions.WAITING_FOR_USER_NAME)
     else:
         await callback_query.answer("Ошибка: главное сообщение не найдено.", show_alert=True)
     await callback_query.answer()
 
 @dp.callback_query_handler(lambda c: c.data.startswith('connect_'))
 async def connect_user(callback: types.CallbackQuery):
-    if callback.from_user.id != admin:
+    if not is_admin(callback.from_user.id):
         await callback.answer("У вас нет прав для выполнения этого действия.", show_alert=True)
         return
+    chat_id = callback.message.chat.id
+    session = sessions_store.get(chat_id)
     try:
         _, client_name, ipv6_flag = callback.data.split('_', 2)
     except ValueError:
         await callback.answer("Неверный формат команды.", show_alert=True)
         return
-    user_main_messages['client_name'] = client_name
-    user_main_messages['ipv6'] = ipv6_flag
+    if not session.set_state(sessions.CHOOSING_DURATION, client_name=client_name, ipv6=ipv6_flag):
+        await callback.answer("Сессия устарела. Начните добавление заново.", show_alert=True)
+        return
     duration_buttons = [
         InlineKeyboardButton("1 час", callback_data=f"duration_1h_{client_name}_{ipv6_flag}"),
         InlineKeyboardButton("1 день", callback_data=f"duration_1d_{client_name}_{ipv6_flag}"),
@@ -409,7 +1132,7 @@ async def connect_user(callback: types.CallbackQuery):
         InlineKeyboardButton("Домой", callback_data="home")
     ]
     duration_markup = InlineKeyboardMarkup(row_width=1).add(*duration_buttons)
-    main_chat_id, main_message_id = user_main_messages.get(admin, (None, None))
+    main_chat_id, main_message_id = session.main_message
     if main_chat_id and main_message_id:
         await bot.edit_message_text(
             chat_id=main_chat_id,
@@ -430,14 +1153,16 @@ def parse_relative_time(timestamp):
 
 @dp.callback_query_handler(lambda c: c.data.startswith('duration_'))
 async def set_config_duration(callback: types.CallbackQuery):
-    if callback.from_user.id != admin:
+    if not is_admin(callback.from_user.id):
         await callback.answer("У вас нет прав для выполнения этого действия.", show_alert=True)
         return
+    chat_id = callback.message.chat.id
+    session = sessions_store.get(chat_id)
     parts = callback.data.split('_')
     duration_choice = parts[1]
     client_name = parts[2]
     ipv6_flag = parts[3] if len(parts) > 3 else 'noipv6'
-    main_chat_id, main_message_id = user_main_messages.get(admin, (None, None))
+    main_chat_id, main_message_id = session.main_message
     if not main_chat_id or not main_message_id:
         await callback.answer("Ошибка: главное сообщение не найдено.", show_alert=True)
         return
@@ -452,11 +1177,12 @@ async def set_config_duration(callback: types.CallbackQuery):
     elif duration_choice == 'unlimited':
         duration = None
     else:
-        sent_message = await bot.send_message(admin, "Неверный выбор времени.", reply_markup=main_menu_markup, disable_notification=True)
-        asyncio.create_task(delete_message_after_delay(admin, sent_message.message_id, delay=2))
+        sent_message = await bot.send_message(chat_id, "Неверный выбор времени.", reply_markup=main_menu_markup, disable_notification=True)
+        asyncio.create_task(delete_message_after_delay(chat_id, sent_message.message_id, delay=2))
+        return
+    if not session.set_state(sessions.CHOOSING_TRAFFIC, client_name=client_name, ipv6=ipv6_flag, duration=duration, duration_choice=duration_choice):
+        await callback.answer("Сессия устарела. Начните добавление заново.", show_alert=True)
         return
-    user_main_messages['duration'] = duration
-    user_main_messages['duration_choice'] = duration_choice
     traffic_buttons = [
         InlineKeyboardButton("5 GB", callback_data=f"traffic_5GB_{client_name}_{ipv6_flag}"),
         InlineKeyboardButton("10 GB", callback_data=f"traffic_10GB_{client_name}_{ipv6_flag}"),
@@ -479,97 +1205,51 @@ async def set_config_duration(callback: types.CallbackQuery):
 
 @dp.callback_query_handler(lambda c: c.data.startswith('traffic_'))
 async def set_traffic_limit(callback: types.CallbackQuery):
-    if callback.from_user.id != admin:
+    if not is_admin(callback.from_user.id):
         await callback.answer("У вас нет прав для выполнения этого действия.", show_alert=True)
         return
+    chat_id = callback.message.chat.id
+    session = sessions_store.get(chat_id)
     parts = callback.data.split('_')
     traffic_choice = parts[1]
     client_name = parts[2]
     ipv6_flag = parts[3] if len(parts) > 3 else 'noipv6'
-    main_chat_id, main_message_id = user_main_messages.get(admin, (None, None))
+    main_chat_id, main_message_id = session.main_message
     if not main_chat_id or not main_message_id:
         await callback.answer("Ошибка: главное сообщение не найдено.", show_alert=True)
         return
-    duration = user_main_messages.get('duration')
-    duration_choice = user_main_messages.get('duration_choice')
+    if session.state != sessions.CHOOSING_TRAFFIC or session.data.get('client_name') != client_name:
+        await callback.answer("Сессия устарела. Начните добавление заново.", show_alert=True)
+        return
+    duration = session.data.get('duration')
+    duration_choice = session.data.get('duration_choice')
+    session.reset()
     if traffic_choice == 'unlimited':
         traffic_limit = None
     else:
         traffic_limit = int(traffic_choice.replace('GB', '')) * 1024 * 1024 * 1024
-    clients_transfer = db.get_all_clients_transfer()
-    user_transfer = next((ct for ct in clients_transfer if ct['username'] == client_name), None)
-    if user_transfer:
-        total_bytes = user_transfer['received_bytes'] + user_transfer['sent_bytes']
-    else:
-        total_bytes = 0
-    traffic_limits = load_traffic_limits()
-    traffic_limits[client_name] = {
-        'limit': traffic_limit,
-        'used': 0,
-        'prev_total': total_bytes
-    }
-    save_traffic_limits(traffic_limits)
-    if ipv6_flag == 'ipv6':
-        success = db.root_add(client_name, ipv6=True)
-    else:
-        success = db.root_add(client_name, ipv6=False)
+    success = await add_client(client_name, ipv6_flag == 'ipv6', duration, traffic_limit)
     if success:
         try:
-            conf_path = os.path.join('users', client_name, f'{client_name}.conf')
-            png_path = os.path.join('users', client_name, f'{client_name}.png')
-            if os.path.exists(png_path):
-                with open(png_path, 'rb') as photo:
-                    sent_photo = await bot.send_photo(admin, photo, disable_notification=True)
-                    asyncio.create_task(delete_message_after_delay(admin, sent_photo.message_id, delay=15))
-            vpn_key = ""
-            if os.path.exists(conf_path):
-                vpn_key = await generate_vpn_key(conf_path)
-            if vpn_key:
-                instruction_text = (
-                    "\nWireGuard [Google play](https://play.google.com/store/apps/details?id=com.wireguard.android), "
-                    "[Official Site](https://www.wireguard.com/install/)\n"
-                    "AmneziaWG [Google play](https://play.google.com/store/apps/details?id=org.amnezia.awg&hl=ru), "
-                    "[GitHub](https://github.com/amnezia-vpn/amneziawg-android)\n"
-                    "AmneziaVPN [Google play](https://play.google.com/store/apps/details?id=org.amnezia.vpn&hl=ru), "
-                    "[GitHub](https://github.com/amnezia-vpn/amnezia-client)\n"
-                )
-                formatted_key = format_vpn_key(vpn_key)
-                key_message = f"```\n{formatted_key}\n```"
-                caption = f"{instruction_text}\n{key_message}"
-            else:
-                caption = "VPN ключ не был сгенерирован."
-            if os.path.exists(conf_path):
-                with open(conf_path, 'rb') as config:
-                    sent_doc = await bot.send_document(
-                        admin,
-                        config,
-                        caption=caption,
-                        parse_mode="Markdown",
-                        disable_notification=True
-                    )
-                    asyncio.create_task(delete_message_after_delay(admin, sent_doc.message_id, delay=15))
+            artifacts = await get_client_artifacts(client_name)
+            if artifacts is None:
+                raise FileNotFoundError()
+            sent_photo, sent_doc = await send_client_files(chat_id, client_name, artifacts)
+            asyncio.create_task(delete_message_after_delay(chat_id, sent_photo.message_id, delay=15))
+            asyncio.create_task(delete_message_after_delay(chat_id, sent_doc.message_id, delay=15))
         except FileNotFoundError:
-            sent_message = await bot.send_message(admin, "Не удалось найти файлы конфигурации для указанного пользователя.", parse_mode="Markdown", disable_notification=True)
-            asyncio.create_task(delete_message_after_delay(admin, sent_message.message_id, delay=15))
+            sent_message = await bot.send_message(chat_id, "Не удалось найти файлы конфигурации для указанного пользователя.", parse_mode="Markdown", disable_notification=True)
+            asyncio.create_task(delete_message_after_delay(chat_id, sent_message.message_id, delay=15))
             await callback.answer()
             return
         except:
-            sent_message = await bot.send_message(admin, "Произошла ошибка.", parse_mode="Markdown", disable_notification=True)
-            asyncio.create_task(delete_message_after_delay(admin, sent_message.message_id, delay=15))
+            sent_message = await bot.send_message(chat_id, "Произошла ошибка.", parse_mode="Markdown", disable_notification=True)
+            asyncio.create_task(delete_message_after_delay(chat_id, sent_message.message_id, delay=15))
             await callback.answer()
             return
         if duration:
-            expiration_time = datetime.now(pytz.UTC) + duration
-            scheduler.add_job(
-                deactivate_user,
-                trigger=DateTrigger(run_date=expiration_time),
-                args=[client_name],
-                id=client_name
-            )
-            db.set_user_expiration(client_name, expiration_time)
             confirmation_text = f"Пользователь **{client_name}** добавлен. Конфигурация истечет через **{duration_choice}**."
         else:
-            db.set_user_expiration(client_name, None)
             confirmation_text = f"Пользователь **{client_name}** добавлен с неограниченным временем действия."
         if traffic_limit:
             limit_str = humanize.naturalsize(traffic_limit, binary=True)
@@ -577,59 +1257,124 @@ async def set_traffic_limit(callback: types.CallbackQuery):
         else:
             confirmation_text += f"\nЛимит трафика: ♾️ Неограниченно"
         sent_confirmation = await bot.send_message(
-            chat_id=admin,
+            chat_id=chat_id,
             text=confirmation_text,
             parse_mode="Markdown",
             disable_notification=True
         )
-        asyncio.create_task(delete_message_after_delay(admin, sent_confirmation.message_id, delay=15))
+        asyncio.create_task(delete_message_after_delay(chat_id, sent_confirmation.message_id, delay=15))
     else:
         sent_confirmation = await bot.send_message(
-            chat_id=admin,
+            chat_id=chat_id,
             text="Не удалось добавить пользователя.",
             parse_mode="Markdown",
             disable_notification=True
         )
-        asyncio.create_task(delete_message_after_delay(admin, sent_confirmation.message_id, delay=15))
+        asyncio.create_task(delete_message_after_delay(chat_id, sent_confirmation.message_id, delay=15))
+    text = await main_menu_text()
     await bot.edit_message_text(
         chat_id=main_chat_id,
         message_id=main_message_id,
-        text="Выберите действие:",
+        text=text,
         reply_markup=main_menu_markup
     )
+    mark_main_menu(session, text)
     await callback.answer()
 
-async def generate_vpn_key(conf_path: str) -> str:
-    try:
-        process = await asyncio.create_subprocess_exec(
-            'python3.11',
-            'awg-decode.py',
-            '--encode',
-            conf_path,
-            stdout=asyncio.subprocess.PIPE,
-            stderr=asyncio.subprocess.PIPE
+def valid_name(name):
+    return isinstance(name, str) and 0 < len(name) and all(c.isalnum() or c in "-_" for c in name)
+
+def set_expiration(username, expiration):
+    if expiration is None:
+        try:
+            scheduler.remove_job(job_id=username)
+        except:
+            pass
+    else:
+        scheduler.add_job(
+            deactivate_user,
+            trigger=DateTrigger(run_date=expiration),
+            args=[username],
+            id=username,
+            replace_existing=True
         )
-        stdout, stderr = await process.communicate()
-        if process.returncode != 0:
-            return ""
-        vpn_key = stdout.decode().strip()
-        if vpn_key.startswith('vpn://'):
-            return vpn_key
-        else:
-            return ""
-    except:
-        return ""
+    db.set_user_expiration(username, expiration)
+
+def set_quota(username, traffic_limit):
+    client_stats = stats.snapshot.get(username)
+    traffic_limits = load_traffic_limits()
+    traffic_limits[username] = {
+        'limit': traffic_limit,
+        'used': 0,
+        'prev_total': client_stats['received_bytes'] + client_stats['sent_bytes'] if client_stats else 0
+    }
+    save_traffic_limits(traffic_limits)
+
+async def add_client(username, ipv6=False, duration=None, traffic_limit=None):
+    keys = await run_blocking(keypool.take) if KEY_POOL_SIZE > 0 else None
+    async with config_lock:
+        reserved = archive.reserved_addresses(archive.load_archive())
+        success = await run_blocking(db.root_add, username, ipv6, keys, reserved)
+    if not success:
+        return False
+    set_quota(username, traffic_limit)
+    set_expiration(username, datetime.now(pytz.UTC) + duration if duration else None)
+    return True
+
+async def get_client_artifacts(username):
+    return await run_blocking(clients.get_artifacts, username, WG_CONFIG_FILE, ENDPOINT, WG_CMD)
+
+async def send_cached_file(chat_id, username, kind, content, filename, **kwargs):
+    digest = file_cache.content_hash(content)
+    file_id = file_cache.get(username, kind, digest)
+    send = bot.send_photo if kind == 'png' else bot.send_document
+    if file_id:
+        try:
+            return await send(chat_id, file_id, **kwargs)
+        except Exception:
+            file_cache.drop(username, kind)
+    data = content.encode() if isinstance(content, str) else content
+    sent = await send(chat_id, types.InputFile(io.BytesIO(data), filename=filename), **kwargs)
+    file_cache.put(username, kind, digest, sent.photo[-1].file_id if kind == 'png' else sent.document.file_id)
+    return sent
+
+async def send_client_files(chat_id, username, artifacts):
+    sent_photo = await send_cached_file(chat_id, username, 'png', artifacts['png'], f'{username}.png', disable_notification=True)
+    sent_doc = await send_cached_file(
+        chat_id, username, 'conf', artifacts['conf'], f'{username}.conf',
+        caption=build_config_caption(artifacts['vpn_key']),
+        parse_mode="Markdown",
+        disable_notification=True
+    )
+    return sent_photo, sent_doc
+
+def build_config_caption(vpn_key):
+    if not vpn_key:
+        return "VPN ключ не был сгенерирован."
+    instruction_text = (
+        "\nWireGuard [Google play](https://play.google.com/store/apps/details?id=com.wireguard.android), "
+        "[Official Site](https://www.wireguard.com/install/)\n"
+        "AmneziaWG [Google play](https://play.google.com/store/apps/details?id=org.amnezia.awg&hl=ru), "
+        "[GitHub](https://github.com/amnezia-vpn/amneziawg-android)\n"
+        "AmneziaVPN [Google play](https://play.google.com/store/apps/details?id=org.amnezia.vpn&hl=ru), "
+        "[GitHub](https://github.com/amnezia-vpn/amnezia-client)\n"
+    )
+    formatted_key = format_vpn_key(vpn_key)
+    key_message = f"```\n{formatted_key}\n```"
+    return f"{instruction_text}\n{key_message}"
 
 @dp.callback_query_handler(lambda c: c.data.startswith('list_users'))
 async def list_users_callback(callback_query: types.CallbackQuery):
-    if callback_query.from_user.id != admin:
+    if not is_admin(callback_query.from_user.id):
         await callback_query.answer("У вас нет прав для выполнения этого действия.", show_alert=True)
         return
-    clients = db.get_client_list()
+    chat_id = callback_query.message.chat.id
+    session = sessions_store.get(chat_id)
+    clients = await run_blocking(db.get_client_list)
     if not clients:
         await callback_query.answer("Список пользователей пуст.", show_alert=True)
         return
-    active_clients = db.get_active_list()
+    active_clients = await run_blocking(db.get_active_list)
     active_clients_dict = {}
     for client in active_clients:
         username = client[0]
@@ -659,8 +1404,9 @@ async def list_users_callback(callback_query: types.CallbackQuery):
             days_str = "?d"
         button_text = f"{status_symbol} ({days_str}) {username}"
         keyboard.insert(InlineKeyboardButton(button_text, callback_data=f"client_{username}"))
+    keyboard.add(InlineKeyboardButton("☑️ Выбрать несколько", callback_data="bulk"))
     keyboard.add(InlineKeyboardButton("Домой", callback_data="home"))
-    main_chat_id, main_message_id = user_main_messages.get(admin, (None, None))
+    main_chat_id, main_message_id = session.main_message
     if main_chat_id and main_message_id:
         await bot.edit_message_text(
             chat_id=main_chat_id,
@@ -670,7 +1416,7 @@ async def list_users_callback(callback_query: types.CallbackQuery):
         )
     else:
         sent_message = await callback_query.message.reply("Выберите пользователя:", reply_markup=keyboard)
-        user_main_messages[admin] = (sent_message.chat.id, sent_message.message_id)
+        session.main_message = (sent_message.chat.id, sent_message.message_id)
         try:
             await bot.pin_chat_message(chat_id=sent_message.chat.id, message_id=sent_message.message_id, disable_notification=True)
         except:
@@ -698,9 +1444,14 @@ def parse_transfer(transfer_str):
 
 @dp.callback_query_handler(lambda c: c.data.startswith('client_'))
 async def client_selected_callback(callback_query: types.CallbackQuery):
+    if not is_admin(callback_query.from_user.id):
+        await callback_query.answer("У вас нет прав для выполнения этого действия.", show_alert=True)
+        return
+    chat_id = callback_query.message.chat.id
+    session = sessions_store.get(chat_id)
     _, username = callback_query.data.split('client_', 1)
     username = username.strip()
-    clients = db.get_client_list()
+    clients = await run_blocking(db.get_client_list)
     client_info = next((c for c in clients if c[0] == username), None)
     if not client_info:
         await callback_query.answer("Ошибка: пользователь не найден.", show_alert=True)
@@ -726,7 +1477,7 @@ async def client_selected_callback(callback_query: types.CallbackQuery):
                 ipv6 = ip_with_mask
             elif '.' in ip_adr:
                 ipv4 = ip_with_mask
-    active_clients = db.get_active_list()
+    active_clients = await run_blocking(db.get_active_list)
     active_info = next((ac for ac in active_clients if ac[0] == username), None)
     now = datetime.now(pytz.UTC)
     if active_info:
@@ -798,7 +1549,7 @@ async def client_selected_callback(callback_query: types.CallbackQuery):
         InlineKeyboardButton("Назад", callback_data="list_users"),
         InlineKeyboardButton("Домой", callback_data="home")
     )
-    main_chat_id, main_message_id = user_main_messages.get(admin, (None, None))
+    main_chat_id, main_message_id = session.main_message
     if main_chat_id and main_message_id:
         try:
             await bot.edit_message_text(
@@ -815,38 +1566,49 @@ async def client_selected_callback(callback_query: types.CallbackQuery):
         return
     await callback_query.answer()
 
+accounting_lock = asyncio.Lock()
+
+@tracing.traced('job.update_traffic_usage')
 async def update_traffic_usage():
+    async with accounting_lock:
+        await account_traffic()
+
+async def account_traffic():
     traffic_limits = load_traffic_limits()
-    clients_transfer = db.get_all_clients_transfer()
-    for client in clients_transfer:
-        username = client['username']
+    snapshot = await run_blocking(stats.refresh, WG_CONFIG_FILE, WG_CMD)
+    deltas = {}
+    for username, client in snapshot.items():
         received_bytes = client['received_bytes']
         sent_bytes = client['sent_bytes']
         total_bytes = received_bytes + sent_bytes
-        if username in traffic_limits:
-            user_traffic = traffic_limits[username]
-            prev_total = user_traffic.get('prev_total', total_bytes)
-            delta = total_bytes - prev_total
-            if delta < 0:
-                delta = 0
-            user_traffic['used'] += delta
-            user_traffic['prev_total'] = total_bytes
-            if user_traffic['limit'] and user_traffic['used'] >= user_traffic['limit']:
-                if not is_user_blocked(username):
-                    success = await block_user(username)
-                    if success:
-                        sent_message = await bot.send_message(
-                            admin,
-                            f"Пользователь **{username}** достиг лимита трафика и был заблокирован.",
-                            parse_mode="Markdown",
-                            disable_notification=True
-                        )
-                        asyncio.create_task(delete_message_after_delay(admin, sent_message.message_id, delay=15))
-            traffic_limits[username] = user_traffic
+        user_traffic = traffic_limits.setdefault(username, {'limit': None, 'used': 0, 'prev_total': total_bytes})
+        prev_total = user_traffic.get('prev_total', total_bytes)
+        delta = total_bytes - prev_total
+        if delta < 0:
+            delta = total_bytes
+        user_traffic['used'] += delta
+        user_traffic['prev_total'] = total_bytes
+        deltas[username] = delta
+        if user_traffic['limit'] and user_traffic['used'] >= user_traffic['limit']:
+            if not is_user_blocked(username):
+                success = await block_user(username)
+                if success:
+                    await notify_admins(f"Пользователь **{username}** достиг лимита трафика и был заблокирован.", parse_mode="Markdown")
     save_traffic_limits(traffic_limits)
+    history.record(deltas)
+    group_list = groups.load_groups()
+    index = groups.member_index(group_list)
+    if any(username in index for username in deltas):
+        exhausted = groups.record_usage(group_list, index, deltas)
+        groups.save_groups(group_list)
+        for name in exhausted:
+            await block_group(name, "достигла лимита трафика")
 
 @dp.callback_query_handler(lambda c: c.data.startswith('connections_'))
 async def client_connections_callback(callback_query: types.CallbackQuery):
+    if not is_admin(callback_query.from_user.id):
+        await callback_query.answer("У вас нет прав для выполнения этого действия.", show_alert=True)
+        return
     _, username = callback_query.data.split('connections_', 1)
     username = username.strip()
     file_path = os.path.join('files', 'connections', f'{username}_ip.json')
@@ -883,9 +1645,14 @@ async def client_connections_callback(callback_query: types.CallbackQuery):
 
 @dp.callback_query_handler(lambda c: c.data.startswith('ip_info_'))
 async def ip_info_callback(callback_query: types.CallbackQuery):
+    if not is_admin(callback_query.from_user.id):
+        await callback_query.answer("У вас нет прав для выполнения этого действия.", show_alert=True)
+        return
+    chat_id = callback_query.message.chat.id
+    session = sessions_store.get(chat_id)
     _, username = callback_query.data.split('ip_info_', 1)
     username = username.strip()
-    active_clients = db.get_active_list()
+    active_clients = await run_blocking(db.get_active_list)
     active_info = next((ac for ac in active_clients if ac[0] == username), None)
     if active_info:
         endpoint = active_info[3]
@@ -895,8 +1662,8 @@ async def ip_info_callback(callback_query: types.CallbackQuery):
         return
     url = f"http://ip-api.com/json/{ip_address}?fields=message,country,countryCode,region,regionName,city,zip,lat,lon,timezone,isp,org,as,hosting"
     try:
-        async with aiohttp.ClientSession() as session:
-            async with session.get(url) as resp:
+        async with aiohttp.ClientSession() as http:
+            async with http.get(url) as resp:
                 if resp.status == 200:
                     data = await resp.json()
                     if 'message' in data:
@@ -916,7 +1683,7 @@ async def ip_info_callback(callback_query: types.CallbackQuery):
         InlineKeyboardButton("Назад", callback_data=f"client_{username}"),
         InlineKeyboardButton("Домой", callback_data="home")
     )
-    main_chat_id, main_message_id = user_main_messages.get(admin, (None, None))
+    main_chat_id, main_message_id = session.main_message
     if main_chat_id and main_message_id:
         try:
             await bot.edit_message_text(
@@ -936,27 +1703,17 @@ async def ip_info_callback(callback_query: types.CallbackQuery):
 
 @dp.callback_query_handler(lambda c: c.data.startswith('delete_user_'))
 async def client_delete_callback(callback_query: types.CallbackQuery):
+    if not is_admin(callback_query.from_user.id):
+        await callback_query.answer("У вас нет прав для выполнения этого действия.", show_alert=True)
+        return
+    chat_id = callback_query.message.chat.id
+    session = sessions_store.get(chat_id)
     username = callback_query.data.split('delete_user_')[1]
-    success = db.deactive_user_db(username)
-    if success:
-        db.remove_user_expiration(username)
-        try:
-            scheduler.remove_job(job_id=username)
-        except:
-            pass
-        conf_path = os.path.join('users', username, f'{username}.conf')
-        png_path = os.path.join('users', username, f'{username}.png')
-        try:
-            if os.path.exists(conf_path):
-                os.remove(conf_path)
-            if os.path.exists(png_path):
-                os.remove(png_path)
-        except:
-            pass
+    if await delete_users([username]):
         confirmation_text = f"Пользователь **{username}** успешно удален."
     else:
         confirmation_text = f"Не удалось удалить пользователя **{username}**."
-    main_chat_id, main_message_id = user_main_messages.get(admin, (None, None))
+    main_chat_id, main_message_id = session.main_message
     if main_chat_id and main_message_id:
         await bot.edit_message_text(
             chat_id=main_chat_id,
@@ -972,6 +1729,10 @@ async def client_delete_callback(callback_query: types.CallbackQuery):
 
 @dp.callback_query_handler(lambda c: c.data.startswith('block_user_') or c.data.startswith('unblock_user_'))
 async def client_block_callback(callback_query: types.CallbackQuery):
+    if not is_admin(callback_query.from_user.id):
+        await callback_query.answer("У вас нет прав для выполнения этого действия.", show_alert=True)
+        return
+    chat_id = callback_query.message.chat.id
     data = callback_query.data
     if data.startswith('block_user_'):
         action = 'block'
@@ -1034,20 +1795,21 @@ async def client_block_callback(callback_query: types.CallbackQuery):
             await client_selected_callback(callback_query)
             if confirmation_text:
                 sent_confirmation = await bot.send_message(
-                    chat_id=admin,
+                    chat_id=chat_id,
                     text=confirmation_text,
                     parse_mode="Markdown",
                     disable_notification=True
                 )
-                asyncio.create_task(delete_message_after_delay(admin, sent_confirmation.message_id, delay=15))
+                asyncio.create_task(delete_message_after_delay(chat_id, sent_confirmation.message_id, delay=15))
 
     await callback_query.answer()
 
 @dp.callback_query_handler(lambda c: c.data.startswith('unblock_duration_'))
 async def unblock_set_duration(callback: types.CallbackQuery):
-    if callback.from_user.id != admin:
+    if not is_admin(callback.from_user.id):
         await callback.answer("У вас нет прав для выполнения этого действия.", show_alert=True)
         return
+    chat_id = callback.message.chat.id
     
     parts = callback.data.split('_')
     duration_choice = parts[2]
@@ -1070,28 +1832,21 @@ async def unblock_set_duration(callback: types.CallbackQuery):
     success = await unblock_user(username)
     if success:
         if duration:
-            expiration_time = datetime.now(pytz.UTC) + duration
-            scheduler.add_job(
-                deactivate_user,
-                trigger=DateTrigger(run_date=expiration_time),
-                args=[username],
-                id=username
-            )
-            db.set_user_expiration(username, expiration_time)
+            set_expiration(username, datetime.now(pytz.UTC) + duration)
             confirmation_text = f"Пользователь **{username}** разблокирован. Новый срок действия: {duration_choice}."
         else:
-            db.set_user_expiration(username, None)
+            set_expiration(username, None)
             confirmation_text = f"Пользователь **{username}** разблокирован без ограничения по времени."
     else:
         confirmation_text = f"Не удалось разблокировать пользователя **{username}**."
     
     sent_confirmation = await bot.send_message(
-        chat_id=admin,
+        chat_id=chat_id,
         text=confirmation_text,
         parse_mode="Markdown",
         disable_notification=True
     )
-    asyncio.create_task(delete_message_after_delay(admin, sent_confirmation.message_id, delay=15))
+    asyncio.create_task(delete_message_after_delay(chat_id, sent_confirmation.message_id, delay=15))
     
     callback.data = f'client_{username}'
     await client_selected_callback(callback)
@@ -1099,9 +1854,10 @@ async def unblock_set_duration(callback: types.CallbackQuery):
 
 @dp.callback_query_handler(lambda c: c.data.startswith('reset_traffic_'))
 async def reset_traffic_limit(callback: types.CallbackQuery):
-    if callback.from_user.id != admin:
+    if not is_admin(callback.from_user.id):
         await callback.answer("У вас нет прав для выполнения этого действия.", show_alert=True)
         return
+    chat_id = callback.message.chat.id
     parts = callback.data.split('_')
     traffic_choice = parts[2]
     username = parts[3]
@@ -1109,26 +1865,14 @@ async def reset_traffic_limit(callback: types.CallbackQuery):
         traffic_limit = None
     else:
         traffic_limit = int(traffic_choice.replace('GB', '')) * 1024 * 1024 * 1024
-    clients_transfer = db.get_all_clients_transfer()
-    user_transfer = next((ct for ct in clients_transfer if ct['username'] == username), None)
-    if user_transfer:
-        total_bytes = user_transfer['received_bytes'] + user_transfer['sent_bytes']
-    else:
-        total_bytes = 0
-    traffic_limits = load_traffic_limits()
-    traffic_limits[username] = {
-        'limit': traffic_limit,
-        'used': 0,
-        'prev_total': total_bytes
-    }
-    save_traffic_limits(traffic_limits)
+    set_quota(username, traffic_limit)
     success = await unblock_user(username)
     if success:
         confirmation_text = f"Пользователь **{username}** разблокирован. Новый лимит трафика установлен."
     else:
         confirmation_text = f"Не удалось разблокировать пользователя **{username}**."
     await bot.send_message(
-        chat_id=admin,
+        chat_id=chat_id,
         text=confirmation_text,
         parse_mode="Markdown",
         disable_notification=True
@@ -1137,45 +1881,685 @@ async def reset_traffic_limit(callback: types.CallbackQuery):
     await client_selected_callback(callback)
     await callback.answer()
 
+ARCHIVE_REASONS = {'expired': 'истек срок', 'inactive': 'неактивен'}
+ARCHIVE_JOB_INTERVAL = 6
+MAX_ARCHIVE_BUTTONS = 50
+
+def forget_clients(usernames):
+    peers = clients.load_peers()
+    expirations = db.load_expirations()
+    traffic_limits = load_traffic_limits()
+    for username in usernames:
+        peers.pop(username, None)
+        expirations.pop(username, None)
+        traffic_limits.pop(username, None)
+        clients.drop_artifacts(username)
+        file_cache.drop(username)
+        try:
+            scheduler.remove_job(job_id=username)
+        except:
+            pass
+    clients.save_peers(peers)
+    db.save_expirations(expirations)
+    save_traffic_limits(traffic_limits)
+    group_list = groups.load_groups()
+    if groups.remove_members(group_list, usernames):
+        groups.save_groups(group_list)
+
+async def archive_cold_peers(days):
+    peer_index = await run_blocking(db.get_peer_index, WG_CONFIG_FILE)
+    expirations = db.load_expirations()
+    cold = archive.find_cold_peers(peer_index, stats.snapshot, expirations, days)
+    if not cold:
+        return []
+    extracted = {}
+
+    def extract(config):
+        config, blocks = archive.extract_blocks(config, cold)
+        if blocks:
+            entries = archive.load_archive()
+            peers = clients.load_peers()
+            traffic_limits = load_traffic_limits()
+            for username, block in blocks.items():
+                entries[username] = archive.make_entry(
+                    block, peers.get(username), expirations.get(username), traffic_limits.get(username), cold[username]
+                )
+            archive.save_archive(entries)
+            extracted.update(blocks)
+        return config, blocks
+
+    archived = await rewrite_config(extract)
+    if not archived:
+        if extracted:
+            entries = archive.load_archive()
+            for username in extracted:
+                entries.pop(username, None)
+            archive.save_archive(entries)
+        return []
+    forget_clients(archived)
+    return archived
+
+async def restore_archived(username):
+    entries = archive.load_archive()
+    entry = entries.get(username)
+    if entry is None:
+        return False
+    archived_ips = set(db.parse_peer_index(entry['block']).get(username, {}).get('allowed_ips', ()))
+
+    def append(config):
+        peer_index = db.parse_peer_index(config)
+        if username in peer_index or any(archived_ips & set(peer['allowed_ips']) for peer in peer_index.values()):
+            return config, []
+        return archive.append_block(config, entry['block']), [username]
+
+    if not await rewrite_config(append):
+        return False
+    if entry['peer']:
+        clients.set_peer(username, entry['peer']['private_key'], entry['peer']['preshared_key'], entry['peer']['address'])
+    expiration_time = datetime.fromisoformat(entry['expiration']) if entry['expiration'] else None
+    db.set_user_expiration(username, expiration_time)
+    if expiration_time and expiration_time > datetime.now(pytz.UTC):
+        scheduler.add_job(
+            deactivate_user,
+            trigger=DateTrigger(run_date=expiration_time),
+            args=[username],
+            id=username,
+            replace_existing=True
+        )
+    if entry['traffic']:
+        traffic_limits = load_traffic_limits()
+        traffic_limits[username] = dict(entry['traffic'], prev_total=0)
+        save_traffic_limits(traffic_limits)
+    entries = archive.load_archive()
+    entries.pop(username, None)
+    archive.save_archive(entries)
+    return True
+
+@tracing.traced('job.archive_job')
+async def archive_job():
+    if ARCHIVE_AFTER_DAYS <= 0:
+        return
+    archived = await archive_cold_peers(ARCHIVE_AFTER_DAYS)
+    if archived:
+        await notify_admins(f"В архив перенесено клиентов: {len(archived)}.")
+
+ROLLOUT_CHUNK = 50
+ROLLOUT_PROGRESS_INTERVAL = 3
+MAX_ROLLOUT_FAILURES = 20
+
+rollout_lock = asyncio.Lock()
+
+async def rollout_artifacts(chat_id, template):
+    async with rollout_lock:
+        peers = await run_blocking(clients.load_peers)
+        items = list(peers.items())
+        chunks = [items[i:i + ROLLOUT_CHUNK] for i in range(0, len(items), ROLLOUT_CHUNK)]
+        progress = await bot.send_message(chat_id, f"Перегенерация конфигураций: 0 из {len(items)}", disable_notification=True)
+        started = time.monotonic()
+        last_edit = started
+        rendered = []
+        loop = asyncio.get_running_loop()
+        try:
+            try:
+                futures = [loop.run_in_executor(rollout_pool, clients.render_artifacts, chunk, template) for chunk in chunks]
+            except BrokenProcessPool:
+                logger.warning("Rollout process pool is broken, rendering in threads")
+                futures = [run_blocking(clients.render_artifacts, chunk, template) for chunk in chunks]
+            for future in asyncio.as_completed(futures):
+                rendered.extend(await future)
+                if time.monotonic() - last_edit >= ROLLOUT_PROGRESS_INTERVAL and len(rendered) < len(items):
+                    last_edit = time.monotonic()
+                    try:
+                        await bot.edit_message_text(
+                            f"Перегенерация конфигураций: {len(rendered)} из {len(items)}",
+                            chat_id=chat_id, message_id=progress.message_id
+                        )
+                    except MessageNotModified:
+                        pass
+        except Exception as e:
+            logger.exception("Rollout failed")
+            await bot.edit_message_text(
+                f"Перегенерация прервана после {len(rendered)} из {len(items)}, конфигурации не сохранены: {str(e) or type(e).__name__}",
+                chat_id=chat_id, message_id=progress.message_id
+            )
+            return None
+        await run_blocking(clients.store_artifacts, rendered, template)
+        failed = [(username, error) for username, _, _, _, _, error in rendered if error is not None]
+        lines = [f"Перегенерировано конфигураций: {len(rendered) - len(failed)} из {len(items)} за {time.monotonic() - started:.1f} с."]
+        if failed:
+            lines.append(f"Ошибки ({len(failed)}):")
+            lines += [f"  {username}: {error}" for username, error in failed[:MAX_ROLLOUT_FAILURES]]
+            if len(failed) > MAX_ROLLOUT_FAILURES:
+                lines.append(f"  и еще {len(failed) - MAX_ROLLOUT_FAILURES}")
+        await bot.edit_message_text('\n'.join(lines), chat_id=chat_id, message_id=progress.message_id)
+        return failed
+
+@tracing.traced('job.check_rollout_needed')
+async def check_rollout_needed():
+    try:
+        template = await run_blocking(clients.get_interface_template, WG_CONFIG_FILE, ENDPOINT, WG_CMD)
+    except (OSError, subprocess.CalledProcessError):
+        logger.exception("Failed to read the interface template")
+        return
+    if await run_blocking(clients.get_rendered_template) is None:
+        await run_blocking(clients.store_artifacts, [], template)
+    elif clients.load_peers() and await run_blocking(clients.template_changed, template):
+        await notify_admins("Адрес сервера или ListenPort изменились, клиентские конфигурации устарели. Выполните /rollout, чтобы перегенерировать их.", delay=None)
+
+def archive_markup():
+    entries = archive.load_archive()
+    keyboard = InlineKeyboardMarkup(row_width=1)
+    newest = sorted(entries.items(), key=lambda item: item[1]['archived_at'], reverse=True)[:MAX_ARCHIVE_BUTTONS]
+    for username, entry in newest:
+        reason = ARCHIVE_REASONS.get(entry['reason'], entry['reason'])
+        keyboard.add(InlineKeyboardButton(f"♻️ {username} ({reason})", callback_data=f"archive_restore_{username}"))
+    if ARCHIVE_AFTER_DAYS > 0:
+        keyboard.add(InlineKeyboardButton(f"Архивировать неактивных {ARCHIVE_AFTER_DAYS} дн.", callback_data="archive_run"))
+    keyboard.add(InlineKeyboardButton("Домой", callback_data="home"))
+    text = f"В архиве: {len(entries)}. Нажмите на клиента, чтобы восстановить его." if entries else "Архив пуст."
+    return text, keyboard
+
+async def show_screen(callback_query, session, text, keyboard):
+    main_chat_id, main_message_id = session.main_message
+    if main_chat_id and main_message_id:
+        try:
+            await bot.edit_message_text(chat_id=main_chat_id, message_id=main_message_id, text=text, reply_markup=keyboard)
+        except MessageNotModified:
+            pass
+    else:
+        sent_message = await callback_query.message.reply(text, reply_markup=keyboard)
+        session.main_message = (sent_message.chat.id, sent_message.message_id)
+        try:
+            await bot.pin_chat_message(chat_id=sent_message.chat.id, message_id=sent_message.message_id, disable_notification=True)
+        except:
+            pass
+
+@dp.callback_query_handler(lambda c: c.data == 'archive' or c.data.startswith('archive_'))
+async def archive_callback(callback_query: types.CallbackQuery):
+    if not is_admin(callback_query.from_user.id):
+        await callback_query.answer("У вас нет прав для выполнения этого действия.", show_alert=True)
+        return
+    chat_id = callback_query.message.chat.id
+    session = sessions_store.get(chat_id)
+    data = callback_query.data
+    notice = None
+    if data.startswith('archive_restore_'):
+        username = data[len('archive_restore_'):]
+        if await restore_archived(username):
+            notice = f"Клиент {username} восстановлен."
+        else:
+            notice = f"Не удалось восстановить клиента {username}."
+    elif data == 'archive_run' and ARCHIVE_AFTER_DAYS > 0:
+        archived = await archive_cold_peers(ARCHIVE_AFTER_DAYS)
+        notice = f"В архив перенесено клиентов: {len(archived)}."
+    text, keyboard = await run_blocking(archive_markup)
+    await show_screen(callback_query, session, text, keyboard)
+    await callback_query.answer(notice or "")
+
+BULK_ACTIONS = {
+    'block': 'Заблокировано',
+    'unblock': 'Разблокировано',
+    'delete': 'Удалено',
+    'extend': 'Продлено',
+    'reset': 'Сброшен трафик',
+}
+
+async def delete_users(usernames):
+    try:
+        deleted = await rewrite_config(lambda config: archive.extract_blocks(config, usernames))
+    except:
+        return []
+    forget_clients(deleted)
+    unlinked = [user_id for user_id, username in user_links.items() if username in deleted]
+    for user_id in unlinked:
+        del user_links[user_id]
+    if unlinked:
+        save_user_links(user_links)
+    return deleted
+
+async def extend_users(usernames, duration):
+    peer_index = await run_blocking(db.get_peer_index, WG_CONFIG_FILE)
+    expirations = db.load_expirations()
+    traffic_limits = load_traffic_limits()
+    usernames = [username for username in usernames if username in peer_index]
+    blocked = {username for username in usernames if peer_index[username]['blocked']}
+    to_unblock = blocked & bulk.expired(peer_index, expirations) - bulk.over_quota(peer_index, traffic_limits)
+    if to_unblock:
+        unblocked = set(await unblock_users(sorted(to_unblock)))
+        usernames = [username for username in usernames if username not in to_unblock or username in unblocked]
+    for username in usernames:
+        expirations[username] = bulk.extend_expiration(expirations.get(username), duration)
+        scheduler.add_job(
+            deactivate_user,
+            trigger=DateTrigger(run_date=expirations[username]),
+            args=[username],
+            id=username,
+            replace_existing=True
+        )
+    db.save_expirations(expirations)
+    return usernames
+
+async def reset_users_traffic(usernames):
+    peer_index = await run_blocking(db.get_peer_index, WG_CONFIG_FILE)
+    expirations = db.load_expirations()
+    traffic_limits = load_traffic_limits()
+    usernames = [username for username in usernames if username in traffic_limits]
+    blocked = {username for username in usernames if username in peer_index and peer_index[username]['blocked']}
+    to_unblock = blocked & bulk.over_quota(peer_index, traffic_limits) - bulk.expired(peer_index, expirations)
+    for username in usernames:
+        client_stats = stats.snapshot.get(username)
+        traffic_limits[username]['used'] = 0
+        traffic_limits[username]['prev_total'] = client_stats['received_bytes'] + client_stats['sent_bytes'] if client_stats else 0
+    save_traffic_limits(traffic_limits)
+    if to_unblock:
+        await unblock_users(sorted(to_unblock))
+    return usernames
+
+async def apply_bulk_action(action, usernames, duration=None):
+    usernames = sorted(usernames)
+    if action == 'block':
+        return await block_users(usernames)
+    if action == 'unblock':
+        return await unblock_users(usernames)
+    if action == 'delete':
+        return await delete_users(usernames)
+    if action == 'extend':
+        return await extend_users(usernames, duration)
+    if action == 'reset':
+        return await reset_users_traffic(usernames)
+    return []
+
+def bulk_markup(session):
+    peer_index = db.get_peer_index(WG_CONFIG_FILE)
+    session.selection &= set(peer_index)
+    names, session.selection_page, pages = bulk.page(peer_index, session.selection_page)
+    keyboard = InlineKeyboardMarkup(row_width=2)
+    for username in names:
+        mark = '✅' if username in session.selection else '▫️'
+        lock = ' 🔒' if peer_index[username]['blocked'] else ''
+        keyboard.insert(InlineKeyboardButton(f"{mark} {username}{lock}", callback_data=f"bulk_toggle_{username}"))
+    navigation = []
+    if session.selection_page > 0:
+        navigation.append(InlineKeyboardButton("◀️", callback_data=f"bulk_page_{session.selection_page - 1}"))
+    if session.selection_page < pages - 1:
+        navigation.append(InlineKeyboardButton("▶️", callback_data=f"bulk_page_{session.selection_page + 1}"))
+    if navigation:
+        keyboard.row(*navigation)
+    keyboard.row(
+        InlineKeyboardButton("Истекшие", callback_data="bulk_filter_expired"),
+        InlineKeyboardButton("Сверх лимита", callback_data="bulk_filter_quota"),
+    )
+    keyboard.row(*(
+        InlineKeyboardButton(f"Неактивны {days} дн.", callback_data=f"bulk_filter_inactive_{days}")
+        for days in bulk.INACTIVE_DAYS
+    ))
+    keyboard.row(
+        InlineKeyboardButton("Выбрать страницу", callback_data="bulk_filter_page"),
+        InlineKeyboardButton("Снять выбор", callback_data="bulk_clear"),
+    )
+    if session.selection:
+        keyboard.row(
+            InlineKeyboardButton("Заблокировать", callback_data="bulk_do_block"),
+            InlineKeyboardButton("Разблокировать", callback_data="bulk_do_unblock"),
+        )
+        keyboard.row(
+            InlineKeyboardButton("Продлить", callback_data="bulk_extend"),
+            InlineKeyboardButton("Сбросить трафик", callback_data="bulk_do_reset"),
+        )
+        keyboard.row(
+            InlineKeyboardButton("В группу", callback_data="bulk_group"),
+            InlineKeyboardButton("Удалить", callback_data="bulk_delete"),
+        )
+    keyboard.row(
+        InlineKeyboardButton("Назад", callback_data="list_users"),
+        InlineKeyboardButton("Домой", callback_data="home"),
+    )
+    text = f"Выбрано: {len(session.selection)} из {len(peer_index)}. Страница {session.selection_page + 1} из {pages}."
+    return text, keyboard
+
+def bulk_extend_markup(session):
+    keyboard = InlineKeyboardMarkup(row_width=2)
+    for key in bulk.EXTEND_DURATIONS:
+        keyboard.insert(InlineKeyboardButton(f"+{key}", callback_data=f"bulk_do_extend_{key}"))
+    keyboard.add(InlineKeyboardButton("Отмена", callback_data="bulk"))
+    return f"На сколько продлить срок действия {len(session.selection)} клиентов? Заблокированные по сроку будут разблокированы.", keyboard
+
+def bulk_group_markup(session):
+    keyboard = InlineKeyboardMarkup(row_width=2)
+    for name in sorted(groups.load_groups()):
+        keyboard.insert(InlineKeyboardButton(f"👥 {name}", callback_data=f"bulk_group_{name}"))
+    keyboard.add(InlineKeyboardButton("Отмена", callback_data="bulk"))
+    return f"В какую группу добавить выбранных клиентов ({len(session.selection)})? Новая группа создается командой /group <имя>.", keyboard
+
+def bulk_delete_markup(session):
+    keyboard = InlineKeyboardMarkup(row_width=2).add(
+        InlineKeyboardButton("Удалить", callback_data="bulk_do_delete"),
+        InlineKeyboardButton("Отмена", callback_data="bulk"),
+    )
+    return f"Удалить выбранных клиентов ({len(session.selection)})? Это действие нельзя отменить.", keyboard
+
+@dp.callback_query_handler(lambda c: c.data == 'bulk' or c.data.startswith('bulk_'))
+async def bulk_callback(callback_query: types.CallbackQuery):
+    if not is_admin(callback_query.from_user.id):
+        await callback_query.answer("У вас нет прав для выполнения этого действия.", show_alert=True)
+        return
+    chat_id = callback_query.message.chat.id
+    session = sessions_store.get(chat_id)
+    data = callback_query.data
+    notice = None
+    markup = bulk_markup
+    if data.startswith('bulk_toggle_'):
+        session.selection ^= {data[len('bulk_toggle_'):]}
+    elif data.startswith('bulk_page_'):
+        session.selection_page = int(data[len('bulk_page_'):])
+    elif data == 'bulk_clear':
+        session.selection.clear()
+    elif data.startswith('bulk_filter_'):
+        kind = data[len('bulk_filter_'):]
+        peer_index = await run_blocking(db.get_peer_index, WG_CONFIG_FILE)
+        if kind == 'expired':
+            selected = bulk.expired(peer_index, db.load_expirations())
+        elif kind == 'quota':
+            selected = bulk.over_quota(peer_index, load_traffic_limits())
+        elif kind == 'page':
+            selected = set(bulk.page(peer_index, session.selection_page)[0])
+        else:
+            selected = bulk.inactive(peer_index, stats.snapshot, int(kind[len('inactive_'):]))
+        session.selection |= selected
+        notice = f"Добавлено в выбор: {len(selected)}."
+    elif data == 'bulk_extend' and session.selection:
+        markup = bulk_extend_markup
+    elif data == 'bulk_delete' and session.selection:
+        markup = bulk_delete_markup
+    elif data == 'bulk_group' and session.selection:
+        markup = bulk_group_markup
+    elif data.startswith('bulk_group_') and session.selection:
+        name = data[len('bulk_group_'):]
+        group_list = groups.load_groups()
+        if name in group_list:
+            index = groups.member_index(group_list)
+            was_held = {username for username, group in index.items() if groups.exhausted(group_list[group])}
+            added = groups.add_members(group_list, name, sorted(session.selection))
+            groups.save_groups(group_list)
+            session.selection.clear()
+            notice = f"В группу {name} добавлено клиентов: {len(added)}."
+            if groups.exhausted(group_list[name]):
+                await block_group(name, "достигла лимита трафика" if groups.over_limit(group_list[name]) else "истек срок действия")
+            else:
+                await release_members([username for username in added if username in was_held])
+    elif data.startswith('bulk_do_') and session.selection:
+        action, _, duration = data[len('bulk_do_'):].partition('_')
+        if action not in BULK_ACTIONS or (action == 'extend' and duration not in bulk.EXTEND_DURATIONS):
+            await callback_query.answer("Неверная команда.", show_alert=True)
+            return
+        requested = set(session.selection)
+        done = await apply_bulk_action(action, requested, bulk.EXTEND_DURATIONS.get(duration))
+        session.selection = requested - set(done)
+        notice = f"{BULK_ACTIONS[action]}: {len(done)} из {len(requested)}."
+        if session.selection:
+            notice += " Не обработанные клиенты остались выбранными."
+    text, keyboard = await run_blocking(markup, session)
+    await show_screen(callback_query, session, text, keyboard)
+    await callback_query.answer(notice or "", show_alert=bool(notice and data.startswith('bulk_do_')))
+
+GROUP_NAME_MAX = 32
+GROUP_LIMITS = ('5GB', '10GB', '30GB', '100GB', '300GB')
+
+async def block_group(name, reason):
+    group = groups.load_groups().get(name)
+    if group is None:
+        return []
+    peer_index = await run_blocking(db.get_peer_index, WG_CONFIG_FILE)
+    members = [username for username in group['members'] if username in peer_index and not peer_index[username]['blocked']]
+    blocked = await block_users(members) if members else []
+    if blocked:
+        await notify_admins(f"Группа {name} {reason}. Заблокированы клиенты: {len(blocked)}.")
+    elif members:
+        await notify_admins(f"Группа {name} {reason}, но заблокировать клиентов не удалось.")
+    return blocked
+
+async def release_members(usernames):
+    group_list = groups.load_groups()
+    index = groups.member_index(group_list)
+    peer_index = await run_blocking(db.get_peer_index, WG_CONFIG_FILE)
+    held = bulk.expired(peer_index, db.load_expirations()) | bulk.over_quota(peer_index, load_traffic_limits())
+    held |= {username for username, name in index.items() if groups.exhausted(group_list[name])}
+    members = [
+        username for username in usernames
+        if username in peer_index and peer_index[username]['blocked'] and username not in held
+    ]
+    return await unblock_users(members) if members else []
+
+async def release_group(name):
+    group = groups.load_groups().get(name)
+    if group is None or groups.exhausted(group):
+        return []
+    return await release_members(group['members'])
+
+@tracing.traced('job.deactivate_group')
+async def deactivate_group(name):
+    await block_group(name, "истек срок действия")
+
+def schedule_group_expiration(name, expiration):
+    job_id = f"group:{name}"
+    if expiration is None:
+        try:
+            scheduler.remove_job(job_id=job_id)
+        except:
+            pass
+        return
+    scheduler.add_job(deactivate_group, trigger=DateTrigger(run_date=expiration), args=[name], id=job_id, replace_existing=True)
+
+def groups_markup(page_number):
+    group_list = groups.load_groups()
+    names, page_number, pages = bulk.page(group_list, page_number)
+    keyboard = InlineKeyboardMarkup(row_width=2)
+    for name in names:
+        group = group_list[name]
+        mark = '⛔' if groups.exhausted(group) else '👥'
+        keyboard.insert(InlineKeyboardButton(f"{mark} {name} ({len(group['members'])})", callback_data=f"gr_open_{name}"))
+    navigation = []
+    if page_number > 0:
+        navigation.append(InlineKeyboardButton("◀️", callback_data=f"groups_page_{page_number - 1}"))
+    if page_number < pages - 1:
+        navigation.append(InlineKeyboardButton("▶️", callback_data=f"groups_page_{page_number + 1}"))
+    if navigation:
+        keyboard.row(*navigation)
+    keyboard.add(InlineKeyboardButton("Домой", callback_data="home"))
+    if not group_list:
+        return "Групп пока нет. Создайте группу командой /group <имя>, затем добавьте в нее клиентов через «Выбрать несколько» в списке клиентов.", keyboard
+    return f"Групп: {len(group_list)}. Страница {page_number + 1} из {pages}.", keyboard
+
+def group_markup(session):
+    group = groups.load_groups().get(session.group)
+    if group is None:
+        return groups_markup(0)
+    peer_index = db.get_peer_index(WG_CONFIG_FILE)
+    names, session.group_page, pages = bulk.page(group['members'], session.group_page)
+    keyboard = InlineKeyboardMarkup(row_width=2)
+    for username in names:
+        lock = ' 🔒' if username in peer_index and peer_index[username]['blocked'] else ''
+        keyboard.insert(InlineKeyboardButton(f"✖️ {username}{lock}", callback_data=f"gr_remove_{username}"))
+    navigation = []
+    if session.group_page > 0:
+        navigation.append(InlineKeyboardButton("◀️", callback_data=f"gr_page_{session.group_page - 1}"))
+    if session.group_page < pages - 1:
+        navigation.append(InlineKeyboardButton("▶️", callback_data=f"gr_page_{session.group_page + 1}"))
+    if navigation:
+        keyboard.row(*navigation)
+    keyboard.row(
+        InlineKeyboardButton("Лимит трафика", callback_data="gr_limit"),
+        InlineKeyboardButton("Продлить", callback_data="gr_extend"),
+    )
+    keyboard.row(
+        InlineKeyboardButton("Сбросить трафик", callback_data="gr_reset"),
+        InlineKeyboardButton("Удалить группу", callback_data="gr_delete"),
+    )
+    keyboard.row(
+        InlineKeyboardButton("Назад", callback_data="groups"),
+        InlineKeyboardButton("Домой", callback_data="home"),
+    )
+    limit = humanize.naturalsize(group['limit'], binary=True) if group.get('limit') else "без ограничений"
+    expiration = group['expiration'].astimezone(pytz.UTC).strftime('%d.%m.%Y %H:%M UTC') if group.get('expiration') else "бессрочно"
+    lines = [
+        f"Группа {session.group}",
+        f"Клиентов: {len(group['members'])}",
+        f"Трафик: {humanize.naturalsize(group['used'], binary=True)} из {limit}",
+        f"Действует до: {expiration}",
+    ]
+    if group['members']:
+        lines.append(f"Страница {session.group_page + 1} из {pages}. Нажмите на клиента, чтобы убрать его из группы.")
+    return '\n'.join(lines), keyboard
+
+def group_limit_markup(session):
+    keyboard = InlineKeyboardMarkup(row_width=2)
+    for choice in GROUP_LIMITS:
+        keyboard.insert(InlineKeyboardButton(choice.replace('GB', ' GB'), callback_data=f"gr_limit_{choice}"))
+    keyboard.add(InlineKeyboardButton("Без ограничений", callback_data="gr_limit_unlimited"))
+    keyboard.add(InlineKeyboardButton("Отмена", callback_data=f"gr_open_{session.group}"))
+    return f"Общий лимит трафика для группы {session.group}:", keyboard
+
+def group_extend_markup(session):
+    keyboard = InlineKeyboardMarkup(row_width=2)
+    for key in bulk.EXTEND_DURATIONS:
+        keyboard.insert(InlineKeyboardButton(f"+{key}", callback_data=f"gr_extend_{key}"))
+    keyboard.add(InlineKeyboardButton("Без ограничений", callback_data="gr_extend_unlimited"))
+    keyboard.add(InlineKeyboardButton("Отмена", callback_data=f"gr_open_{session.group}"))
+    return f"На сколько продлить срок действия группы {session.group}?", keyboard
+
+def group_delete_markup(session):
+    keyboard = InlineKeyboardMarkup(row_width=2).add(
+        InlineKeyboardButton("Удалить", callback_data="gr_delete_yes"),
+        InlineKeyboardButton("Отмена", callback_data=f"gr_open_{session.group}"),
+    )
+    return f"Удалить группу {session.group}? Клиенты останутся, но лимит и срок группы перестанут на них действовать.", keyboard
+
+@dp.callback_query_handler(lambda c: c.data == 'groups' or c.data.startswith('groups_page_') or c.data.startswith('gr_'))
+async def groups_callback(callback_query: types.CallbackQuery):
+    if not is_admin(callback_query.from_user.id):
+        await callback_query.answer("У вас нет прав для выполнения этого действия.", show_alert=True)
+        return
+    chat_id = callback_query.message.chat.id
+    session = sessions_store.get(chat_id)
+    data = callback_query.data
+    notice = None
+    if data == 'groups' or data.startswith('groups_page_'):
+        page_number = int(data[len('groups_page_'):]) if data.startswith('groups_page_') else 0
+        text, keyboard = await run_blocking(groups_markup, page_number)
+        await show_screen(callback_query, session, text, keyboard)
+        await callback_query.answer()
+        return
+    markup = group_markup
+    if data.startswith('gr_open_'):
+        session.group = data[len('gr_open_'):]
+        session.group_page = 0
+    elif data.startswith('gr_page_'):
+        session.group_page = int(data[len('gr_page_'):])
+    elif data == 'gr_limit':
+        markup = group_limit_markup
+    elif data == 'gr_extend':
+        markup = group_extend_markup
+    elif data == 'gr_delete':
+        markup = group_delete_markup
+    else:
+        group_list = groups.load_groups()
+        group = group_list.get(session.group)
+        if group is None:
+            await callback_query.answer("Группа не найдена.", show_alert=True)
+            return
+        release = False
+        released = []
+        if data.startswith('gr_remove_'):
+            username = data[len('gr_remove_'):]
+            if groups.remove_members(group_list, [username]) and groups.exhausted(group):
+                released = [username]
+            notice = f"Клиент {username} убран из группы."
+        elif data.startswith('gr_limit_'):
+            choice = data[len('gr_limit_'):]
+            if choice != 'unlimited' and choice not in GROUP_LIMITS:
+                await callback_query.answer("Неверная команда.", show_alert=True)
+                return
+            group['limit'] = None if choice == 'unlimited' else int(choice.replace('GB', '')) * 1024 * 1024 * 1024
+            release = True
+        elif data.startswith('gr_extend_'):
+            choice = data[len('gr_extend_'):]
+            if choice != 'unlimited' and choice not in bulk.EXTEND_DURATIONS:
+                await callback_query.answer("Неверная команда.", show_alert=True)
+                return
+            group['expiration'] = None if choice == 'unlimited' else bulk.extend_expiration(group['expiration'], bulk.EXTEND_DURATIONS[choice])
+            schedule_group_expiration(session.group, group['expiration'])
+            release = True
+        elif data == 'gr_reset':
+            group['used'] = 0
+            release = True
+        elif data == 'gr_delete_yes':
+            if groups.exhausted(group):
+                released = list(group['members'])
+            del group_list[session.group]
+            schedule_group_expiration(session.group, None)
+            notice = f"Группа {session.group} удалена."
+        groups.save_groups(group_list)
+        if released:
+            unblocked = await release_members(released)
+            if unblocked:
+                notice += f" Разблокировано клиентов: {len(unblocked)}."
+        if data == 'gr_delete_yes':
+            session.group = None
+            text, keyboard = await run_blocking(groups_markup, 0)
+            await show_screen(callback_query, session, text, keyboard)
+            await callback_query.answer(notice)
+            return
+        if release:
+            unblocked = await release_group(session.group)
+            if unblocked:
+                notice = f"Разблокировано клиентов группы: {len(unblocked)}."
+    text, keyboard = await run_blocking(markup, session)
+    await show_screen(callback_query, session, text, keyboard)
+    await callback_query.answer(notice or "")
+
 @dp.callback_query_handler(lambda c: c.data == "home")
 async def return_home(callback_query: types.CallbackQuery):
-    if callback_query.from_user.id != admin:
+    if not is_admin(callback_query.from_user.id):
         await callback_query.answer("У вас нет прав для выполнения этого действия.", show_alert=True)
         return
-    main_chat_id, main_message_id = user_main_messages.get(admin, (None, None))
+    chat_id = callback_query.message.chat.id
+    session = sessions_store.get(chat_id)
+    text = await main_menu_text()
+    main_chat_id, main_message_id = session.main_message
     if main_chat_id and main_message_id:
-        user_main_messages.pop('waiting_for_user_name', None)
-        user_main_messages.pop('client_name', None)
-        user_main_messages.pop('ipv6', None)
+        session.reset()
         try:
             await bot.edit_message_text(
                 chat_id=main_chat_id,
                 message_id=main_message_id,
-                text="Выберите действие:",
+                text=text,
                 reply_markup=main_menu_markup
             )
         except:
-            sent_message = await callback_query.message.reply("Выберите действие:", reply_markup=main_menu_markup)
-            user_main_messages[admin] = (sent_message.chat.id, sent_message.message_id)
+            sent_message = await callback_query.message.reply(text, reply_markup=main_menu_markup)
+            session.main_message = (sent_message.chat.id, sent_message.message_id)
             try:
                 await bot.pin_chat_message(chat_id=sent_message.chat.id, message_id=sent_message.message_id, disable_notification=True)
             except:
                 pass
     else:
-        sent_message = await callback_query.message.reply("Выберите действие:", reply_markup=main_menu_markup)
-        user_main_messages[admin] = (sent_message.chat.id, sent_message.message_id)
+        sent_message = await callback_query.message.reply(text, reply_markup=main_menu_markup)
+        session.main_message = (sent_message.chat.id, sent_message.message_id)
         try:
             await bot.pin_chat_message(chat_id=sent_message.chat.id, message_id=sent_message.message_id, disable_notification=True)
         except:
             pass
+    mark_main_menu(session, text)
     await callback_query.answer()
 
 @dp.callback_query_handler(lambda c: c.data == "get_config")
 async def list_users_for_config(callback_query: types.CallbackQuery):
-    if callback_query.from_user.id != admin:
+    if not is_admin(callback_query.from_user.id):
         await callback_query.answer("У вас нет прав для выполнения этого действия.", show_alert=True)
         return
-    clients = db.get_client_list()
+    chat_id = callback_query.message.chat.id
+    session = sessions_store.get(chat_id)
+    clients = await run_blocking(db.get_client_list)
     if not clients:
         await callback_query.answer("Список пользователей пуст.", show_alert=True)
         return
@@ -1184,7 +2568,7 @@ async def list_users_for_config(callback_query: types.CallbackQuery):
         username = client[0]
         keyboard.insert(InlineKeyboardButton(username, callback_data=f"send_config_{username}"))
     keyboard.add(InlineKeyboardButton("Домой", callback_data="home"))
-    main_chat_id, main_message_id = user_main_messages.get(admin, (None, None))
+    main_chat_id, main_message_id = session.main_message
     if main_chat_id and main_message_id:
         await bot.edit_message_text(
             chat_id=main_chat_id,
@@ -1194,7 +2578,7 @@ async def list_users_for_config(callback_query: types.CallbackQuery):
         )
     else:
         sent_message = await callback_query.message.reply("Выберите пользователя для получения конфигурации:", reply_markup=keyboard)
-        user_main_messages[admin] = (sent_message.chat.id, sent_message.message_id)
+        session.main_message = (sent_message.chat.id, sent_message.message_id)
         try:
             await bot.pin_chat_message(chat_id=sent_message.chat.id, message_id=sent_message.message_id, disable_notification=True)
         except:
@@ -1203,128 +2587,152 @@ async def list_users_for_config(callback_query: types.CallbackQuery):
 
 @dp.callback_query_handler(lambda c: c.data.startswith('send_config_'))
 async def send_user_config(callback_query: types.CallbackQuery):
-    if callback_query.from_user.id != admin:
+    if not is_admin(callback_query.from_user.id):
         await callback_query.answer("У вас нет прав для выполнения этого действия.", show_alert=True)
         return
+    chat_id = callback_query.message.chat.id
     _, username = callback_query.data.split('send_config_', 1)
     username = username.strip()
     sent_messages = []
     try:
-        png_path = os.path.join('users', username, f'{username}.png')
-        if os.path.exists(png_path):
-            with open(png_path, 'rb') as photo:
-                sent_photo = await bot.send_photo(admin, photo, disable_notification=True)
-                sent_messages.append(sent_photo.message_id)
-        conf_path = os.path.join('users', username, f'{username}.conf')
-        if os.path.exists(conf_path):
-            vpn_key = await generate_vpn_key(conf_path)
-            if vpn_key:
-                instruction_text = (
-                    "\nWireGuard [Google play](https://play.google.com/store/apps/details?id=com.wireguard.android), "
-                    "[Official Site](https://www.wireguard.com/install/)\n"
-                    "AmneziaWG [Google play](https://play.google.com/store/apps/details?id=org.amnezia.awg&hl=ru), "
-                    "[GitHub](https://github.com/amnezia-vpn/amneziawg-android)\n"
-                    "AmneziaVPN [Google play](https://play.google.com/store/apps/details?id=org.amnezia.vpn&hl=ru), "
-                    "[GitHub](https://github.com/amnezia-vpn/amnezia-client)\n"
-                )
-                formatted_key = format_vpn_key(vpn_key)
-                key_message = f"```\n{formatted_key}\n```"
-                caption = f"{instruction_text}\n{key_message}"
-            else:
-                caption = "VPN ключ не был сгенерирован."
-            if os.path.exists(conf_path):
-                with open(conf_path, 'rb') as config:
-                    sent_doc = await bot.send_document(
-                        admin,
-                        config,
-                        caption=caption,
-                        parse_mode="Markdown",
-                        disable_notification=True
-                    )
-                    sent_messages.append(sent_doc.message_id)
+        artifacts = await get_client_artifacts(username)
+        if artifacts:
+            sent_photo, sent_doc = await send_client_files(chat_id, username, artifacts)
+            sent_messages.append(sent_photo.message_id)
+            sent_messages.append(sent_doc.message_id)
     except:
-        sent_message = await bot.send_message(admin, "Произошла ошибка.", parse_mode="Markdown", disable_notification=True)
-        asyncio.create_task(delete_message_after_delay(admin, sent_message.message_id, delay=15))
+        sent_message = await bot.send_message(chat_id, "Произошла ошибка.", parse_mode="Markdown", disable_notification=True)
+        asyncio.create_task(delete_message_after_delay(chat_id, sent_message.message_id, delay=15))
         await callback_query.answer()
         return
     if not sent_messages:
-        sent_message = await bot.send_message(admin, f"Не удалось найти файлы конфигурации для пользователя **{username}**.", parse_mode="Markdown", disable_notification=True)
-        asyncio.create_task(delete_message_after_delay(admin, sent_message.message_id, delay=15))
+        sent_message = await bot.send_message(chat_id, f"Не удалось найти файлы конфигурации для пользователя **{username}**.", parse_mode="Markdown", disable_notification=True)
+        asyncio.create_task(delete_message_after_delay(chat_id, sent_message.message_id, delay=15))
         await callback_query.answer()
         return
     else:
         sent_confirmation = await bot.send_message(
-            chat_id=admin,
+            chat_id=chat_id,
             text=f"Конфигурация для **{username}** отправлена.",
             parse_mode="Markdown",
             disable_notification=True
         )
-        asyncio.create_task(delete_message_after_delay(admin, sent_confirmation.message_id, delay=15))
+        asyncio.create_task(delete_message_after_delay(chat_id, sent_confirmation.message_id, delay=15))
     for message_id in sent_messages:
-        asyncio.create_task(delete_message_after_delay(admin, message_id, delay=15))
+        asyncio.create_task(delete_message_after_delay(chat_id, message_id, delay=15))
     await callback_query.answer()
 
 @dp.callback_query_handler(lambda c: c.data == "create_backup")
 async def create_backup_callback(callback_query: types.CallbackQuery):
-    if callback_query.from_user.id != admin:
+    if not is_admin(callback_query.from_user.id):
         await callback_query.answer("У вас нет прав для выполнения этого действия.", show_alert=True)
         return
+    chat_id = callback_query.message.chat.id
     date_str = datetime.now().strftime('%Y-%m-%d')
     backup_filename = f"backup_{date_str}.zip"
     backup_filepath = os.path.join(os.getcwd(), backup_filename)
     try:
-        loop = asyncio.get_running_loop()
-        await loop.run_in_executor(None, create_zip, backup_filepath)
+        await run_blocking(create_zip, backup_filepath)
         if os.path.exists(backup_filepath):
             with open(backup_filepath, 'rb') as f:
-                await bot.send_document(admin, f, caption=backup_filename, disable_notification=True)
+                await bot.send_document(chat_id, f, caption=backup_filename, disable_notification=True)
         else:
-            await bot.send_message(admin, "Не удалось создать бекап.", disable_notification=True)
+            await bot.send_message(chat_id, "Не удалось создать бекап.", disable_notification=True)
     except:
-        await bot.send_message(admin, "Не удалось создать бекап.", disable_notification=True)
+        await bot.send_message(chat_id, "Не удалось создать бекап.", disable_notification=True)
     await callback_query.answer()
 
+def inspect_interface():
+    interface_name = db.get_interface_name(WG_CONFIG_FILE)
+    with open(WG_CONFIG_FILE, 'r') as f:
+        config_text = f.read()
+    section = reconcile.read_interface_section(config_text)
+    try:
+        live_interface = db.get_wg_interface(interface_name, WG_CMD)
+        live_peers = db.get_wg_dump(interface_name, WG_CMD)
+    except subprocess.CalledProcessError:
+        live_interface, live_peers = None, {}
+    changes = reconcile.interface_changes(section, live_interface, reconcile.load_interface_fingerprint())
+    peer_index = db.parse_peer_index(config_text)
+    return interface_name, section, changes, peer_index, reconcile.diff_peers(peer_index, live_peers, reconcile.config_public_keys(config_text))
+
+async def bounce_interface(interface_name):
+    for action in ('down', 'up'):
+        process = await asyncio.create_subprocess_exec(
+            WG_QUICK_CMD, action, interface_name,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE
+        )
+        await process.communicate()
+        if process.returncode != 0 and action == 'up':
+            return False
+    return True
+
+def reset_traffic_checkpoint():
+    traffic_limits = load_traffic_limits()
+    for user_traffic in traffic_limits.values():
+        user_traffic['prev_total'] = 0
+    save_traffic_limits(traffic_limits)
+
+async def reload_interface():
+    async with accounting_lock:
+        await account_traffic()
+        async with config_lock:
+            return await apply_interface()
+
+async def apply_interface():
+    interface_name, section, changes, peer_index, drift = await run_blocking(inspect_interface)
+    fingerprint = reconcile.interface_fingerprint(section)
+    if changes:
+        if not await bounce_interface(interface_name):
+            raise RuntimeError(f"{WG_QUICK_CMD} up {interface_name} failed")
+        reset_traffic_checkpoint()
+        await run_blocking(reconcile.save_interface_fingerprint, fingerprint)
+        return f"Интерфейс перезапущен: изменены параметры {', '.join(changes)}."
+    await run_blocking(reconcile.save_interface_fingerprint, fingerprint)
+    operations = len(reconcile.fix_operations(drift, peer_index))
+    if not operations:
+        unknown = f" Неизвестных пиров на интерфейсе: {len(drift['extra'])}." if drift['extra'] else ""
+        return "Конфигурация уже применена, изменений нет." + unknown
+    failed = await run_blocking(reconcile.apply_fixes, drift, peer_index, interface_name, WG_CMD)
+    if failed:
+        raise RuntimeError(f"{failed} of {operations} peer updates failed")
+    return f"Применено изменений пиров без перезапуска интерфейса: {operations}."
+
 @dp.callback_query_handler(lambda c: c.data == "reload_config")
 async def reload_config_callback(callback_query: types.CallbackQuery):
-    if callback_query.from_user.id != admin:
+    if not is_admin(callback_query.from_user.id):
         await callback_query.answer("У вас нет прав для выполнения этого действия.", show_alert=True)
         return
-    interface_name = os.path.basename(WG_CONFIG_FILE).split('.')[0]
+    chat_id = callback_query.message.chat.id
+    session = sessions_store.get(chat_id)
     try:
-        process_down = await asyncio.create_subprocess_shell(
-            f"{WG_QUICK_CMD} down {interface_name}",
-            stdout=asyncio.subprocess.PIPE,
-            stderr=asyncio.subprocess.PIPE
-        )
-        stdout_down, stderr_down = await process_down.communicate()
-        if process_down.returncode != 0:
-            raise Exception()
-        process_up = await asyncio.create_subprocess_shell(
-            f"{WG_QUICK_CMD} up {interface_name}",
-            stdout=asyncio.subprocess.PIPE,
-            stderr=asyncio.subprocess.PIPE
-        )
-        stdout_up, stderr_up = await process_up.communicate()
-        if process_up.returncode != 0:
-            raise Exception()
-    except:
-        await bot.send_message(admin, "Ошибка при перезагрузке конфигурации.", disable_notification=True)
+        notice = await reload_interface()
+    except Exception:
+        logger.exception("Interface reload failed")
+        await bot.send_message(chat_id, "Ошибка при перезагрузке конфигурации.", disable_notification=True)
+    else:
+        sent_notice = await bot.send_message(chat_id, notice, disable_notification=True)
+        asyncio.create_task(delete_message_after_delay(chat_id, sent_notice.message_id, delay=15))
     finally:
-        main_chat_id, main_message_id = user_main_messages.get(admin, (None, None))
+        text = await main_menu_text()
+        main_chat_id, main_message_id = session.main_message
         if main_chat_id and main_message_id:
             try:
                 await bot.edit_message_text(
                     chat_id=main_chat_id,
                     message_id=main_message_id,
-                    text="Выберите действие:",
+                    text=text,
                     reply_markup=main_menu_markup
                 )
+                mark_main_menu(session, text)
             except:
                 pass
         else:
             try:
-                sent_message = await callback_query.message.reply("Выберите действие:", reply_markup=main_menu_markup)
-                user_main_messages[admin] = (sent_message.chat.id, sent_message.message_id)
+                sent_message = await callback_query.message.reply(text, reply_markup=main_menu_markup)
+                session.main_message = (sent_message.chat.id, sent_message.message_id)
+                mark_main_menu(session, text)
                 await bot.pin_chat_message(chat_id=sent_message.chat.id, message_id=sent_message.message_id, disable_notification=True)
             except:
                 pass
@@ -1334,68 +2742,295 @@ async def reload_config_callback(callback_query: types.CallbackQuery):
 async def process_unknown_callback(callback_query: types.CallbackQuery):
     await callback_query.answer("Неизвестная команда.", show_alert=True)
 
+@tracing.traced('job.deactivate_user')
 async def deactivate_user(client_name: str):
     if not is_user_blocked(client_name):
         success = await block_user(client_name)
         if success:
-            sent_message = await bot.send_message(
-                admin,
-                f"Срок действия конфигурации пользователя **{client_name}** истек. Пользователь заблокирован.",
-                parse_mode="Markdown",
-                disable_notification=True
-            )
-            asyncio.create_task(delete_message_after_delay(admin, sent_message.message_id, delay=15))
-            
+            await notify_admins(f"Срок действия конфигурации пользователя **{client_name}** истек. Пользователь заблокирован.", parse_mode="Markdown")
             db.set_user_expiration(client_name, datetime.now(pytz.UTC))
         else:
-            sent_message = await bot.send_message(
-                admin,
-                f"Не удалось заблокировать пользователя **{client_name}** по истечении срока действия.",
-                parse_mode="Markdown",
-                disable_notification=True
-            )
-            asyncio.create_task(delete_message_after_delay(admin, sent_message.message_id, delay=15))
+            await notify_admins(f"Не удалось заблокировать пользователя **{client_name}** по истечении срока действия.", parse_mode="Markdown")
     else:
         db.set_user_expiration(client_name, datetime.now(pytz.UTC))
 
 
+def api_names(names):
+    if isinstance(names, str):
+        names = [names]
+    if not isinstance(names, list) or not names or not all(valid_name(name) for name in names):
+        raise api.ApiError('names must be a non-empty list of client names')
+    return names
+
+def api_bytes(limit_gb):
+    if limit_gb is None:
+        return None
+    if not isinstance(limit_gb, (int, float)) or limit_gb <= 0:
+        raise api.ApiError('limit_gb must be a positive number or null')
+    return int(limit_gb * 1024 * 1024 * 1024)
+
+def api_duration(days):
+    if days is None:
+        return None
+    if not isinstance(days, (int, float)) or days <= 0:
+        raise api.ApiError('days must be a positive number or null')
+    return timedelta(days=days)
+
+async def api_require(name):
+    peer_index = await run_blocking(db.get_peer_index, WG_CONFIG_FILE)
+    if name not in peer_index:
+        raise api.ApiError(f'client {name} not found')
+    return peer_index
+
+async def api_list():
+    peer_index = await run_blocking(db.get_peer_index, WG_CONFIG_FILE)
+    expirations = db.load_expirations()
+    traffic_limits = load_traffic_limits()
+    index = groups.member_index(groups.load_groups())
+    return [
+        {
+            'name': name,
+            'blocked': peer['blocked'],
+            'allowed_ips': peer['allowed_ips'],
+            'expiration': expirations[name].isoformat() if expirations.get(name) else None,
+            'limit': traffic_limits.get(name, {}).get('limit'),
+            'used': traffic_limits.get(name, {}).get('used', 0),
+            'group': index.get(name),
+        }
+        for name, peer in peer_index.items()
+    ]
+
+async def api_stats(names=None):
+    selected = api_names(names) if names is not None else list(stats.snapshot)
+    return {
+        name: dict(stats.snapshot[name], **stats.rates.get(name, {'received_rate': 0.0, 'sent_rate': 0.0}))
+        for name in selected if name in stats.snapshot
+    }
+
+async def api_add(name, ipv6=False, days=None, limit_gb=None):
+    if not valid_name(name):
+        raise api.ApiError('name may contain only letters, digits, dashes and underscores')
+    duration = api_duration(days)
+    traffic_limit = api_bytes(limit_gb)
+    if name in await run_blocking(db.get_peer_index, WG_CONFIG_FILE):
+        raise api.ApiError(f'client {name} already exists')
+    if not await add_client(name, bool(ipv6), duration, traffic_limit):
+        raise api.ApiError(f'failed to add client {name}')
+    artifacts = await get_client_artifacts(name)
+    return {'name': name, 'conf': artifacts['conf'], 'vpn_key': artifacts['vpn_key']} if artifacts else {'name': name}
+
+async def api_block(names):
+    return {'done': await block_users(api_names(names))}
+
+async def api_unblock(names):
+    return {'done': await unblock_users(api_names(names))}
+
+async def api_delete(names):
+    return {'done': await delete_users(api_names(names))}
+
+async def api_set_quota(name, limit_gb=None):
+    traffic_limit = api_bytes(limit_gb)
+    await api_require(name)
+    set_quota(name, traffic_limit)
+    return {'name': name, 'limit': traffic_limit}
+
+async def api_set_expiry(name, days=None):
+    duration = api_duration(days)
+    await api_require(name)
+    expiration = datetime.now(pytz.UTC) + duration if duration else None
+    set_expiration(name, expiration)
+    return {'name': name, 'expiration': expiration.isoformat() if expiration else None}
+
+API_OPERATIONS = {
+    'list': api_list,
+    'stats': api_stats,
+    'add': api_add,
+    'block': api_block,
+    'unblock': api_unblock,
+    'delete': api_delete,
+    'set_quota': api_set_quota,
+    'set_expiry': api_set_expiry,
+}
+
+def replicated_paths():
+    return {
+        'peers': clients.PEERS_FILE,
+        'expirations': db.EXPIRATIONS_FILE,
+        'traffic_limits': TRAFFIC_LIMITS_FILE,
+        'user_links': USER_LINKS_FILE,
+        'archive': archive.ARCHIVE_FILE,
+        'groups': groups.GROUPS_FILE,
+        'file_ids': file_cache.FILE_ID_CACHE_FILE,
+        'wg_config': WG_CONFIG_FILE,
+    }
+
+replicated = {}
+replicated_full_sync = 0.0
+replication_error = None
+
+@tracing.traced('job.replicate_state')
+async def replicate_state():
+    global replicated, replicated_full_sync, replication_error
+    if time.monotonic() - replicated_full_sync >= HA_FULL_SYNC_INTERVAL:
+        replicated = {}
+    changed, current = await run_blocking(ha.read_state, replicated_paths(), replicated)
+    if not changed:
+        return
+    body = ha.pack_state(changed)
+    try:
+        async with aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=10)) as session:
+            async with session.post(
+                HA_PEER.rstrip('/') + ha.STATE_PATH,
+                data=body,
+                headers={ha.SIGNATURE_HEADER: ha.sign(HA_SECRET, body), 'Content-Type': 'application/json'}
+            ) as resp:
+                error = None if resp.status == 204 else f"HTTP {resp.status}"
+    except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+        error = str(e) or type(e).__name__
+    if error:
+        if replication_error is None:
+            logger.error("State replication to %s failed: %s", HA_PEER, error)
+        replication_error = error
+        return
+    if replication_error is not None:
+        logger.warning("State replication to %s restored", HA_PEER)
+        replication_error = None
+    if not replicated:
+        replicated_full_sync = time.monotonic()
+    replicated = current
+
+async def reload_settings():
+    old = settings.get()
+    try:
+        new = await run_blocking(settings.load)
+    except (OSError, ValueError) as e:
+        logger.error("Settings reload failed: %s", e)
+        await notify_admins(f"Ошибка в {settings.SETTINGS_FILE}, используются прежние настройки: {e}", delay=None)
+        return
+    apply_settings(new)
+    sessions_store.ttl = SESSION_TTL.total_seconds()
+    self_service_limiter.rate = SELF_SERVICE_RATE
+    pending = settings.restart_required(old, new)
+    if STATS_COLLECTOR and old.wg_config_file != new.wg_config_file:
+        pending.append('wg_config_file')
+    if old.endpoint != new.endpoint:
+        await check_rollout_needed()
+    if pending:
+        await notify_admins(f"Настройки перечитаны. Для применения параметров {', '.join(pending)} требуется перезапуск бота.", delay=None)
+    else:
+        logger.warning("Settings reloaded from %s", settings.SETTINGS_FILE)
+
+async def watch_settings():
+    if settings.changed():
+        await reload_settings()
+
+def start_stats_collector():
+    try:
+        stats.shared = collector.start(WG_CONFIG_FILE, WG_CMD, STATS_COLLECTOR_INTERVAL, STATS_COLLECTOR_CAPACITY)
+    except OSError:
+        logger.exception("Stats collector failed to start, polling in the bot process")
+        return
+    atexit.register(stats.shared.close)
+
+async def catch_up_expirations(overdue):
+    blocked = await block_users(overdue)
+    failed = [username for username in overdue if username not in blocked]
+    lines = []
+    if blocked:
+        names = ', '.join(blocked[:50])
+        if len(blocked) > 50:
+            names += f' и еще {len(blocked) - 50}'
+        lines.append(f"Пока бот не работал, истек срок действия конфигураций: {len(blocked)}. Заблокированы: {names}.")
+    if failed:
+        lines.append(f"Не удалось заблокировать пользователей с истекшим сроком действия: {len(failed)}.")
+    await notify_admins('\n'.join(lines))
+
 async def on_startup(dp):
+    global user_links
     os.makedirs('files/connections', exist_ok=True)
-    os.makedirs('users', exist_ok=True)
+    tracing.configure()
+    user_links = load_user_links()
+    if HA and not await restart_wireguard():
+        logger.error("Failed to apply %s to the interface after taking over", WG_CONFIG_FILE)
+    clients.migrate_legacy_users()
+    file_cache.load()
+    if STATS_COLLECTOR:
+        start_stats_collector()
     await load_isp_cache_task()
-    users = db.get_users_with_expiration()
-    for user in users:
-        client_name, expiration_time = user
-        if expiration_time:
-            try:
-                expiration_datetime = datetime.fromisoformat(expiration_time)
-            except ValueError:
-                continue
-            if expiration_datetime.tzinfo is None:
-                expiration_datetime = expiration_datetime.replace(tzinfo=pytz.UTC)
-            if expiration_datetime > datetime.now(pytz.UTC):
-                scheduler.add_job(
-                    deactivate_user,
-                    trigger=DateTrigger(run_date=expiration_datetime),
-                    args=[client_name],
-                    id=client_name
-                )
-            elif not is_user_blocked(client_name):
-                await deactivate_user(client_name)
+    expirations = db.load_expirations()
+    peer_index = db.get_peer_index(WG_CONFIG_FILE)
+    now = datetime.now(pytz.UTC)
+    overdue = []
+    for client_name, expiration_datetime in expirations.items():
+        if not expiration_datetime:
+            continue
+        if expiration_datetime > now:
+            scheduler.add_job(
+                deactivate_user,
+                trigger=DateTrigger(run_date=expiration_datetime),
+                args=[client_name],
+                id=client_name
+            )
+        elif client_name in peer_index and not peer_index[client_name]['blocked']:
+            overdue.append(client_name)
+    if overdue:
+        asyncio.create_task(catch_up_expirations(overdue))
+    for name, group in groups.load_groups().items():
+        if group['expiration'] is None:
+            continue
+        if group['expiration'] > now:
+            schedule_group_expiration(name, group['expiration'])
+        else:
+            asyncio.create_task(block_group(name, "истек срок действия"))
+    asyncio.create_task(check_rollout_needed())
 
-    traffic_limits = load_traffic_limits()
-    clients_transfer = db.get_all_clients_transfer()
-    for client in clients_transfer:
-        username = client['username']
-        received_bytes = client['received_bytes']
-        sent_bytes = client['sent_bytes']
-        total_bytes = received_bytes + sent_bytes
-        if username in traffic_limits:
-            user_traffic = traffic_limits[username]
-            user_traffic['prev_total'] = total_bytes
-            traffic_limits[username] = user_traffic
-    save_traffic_limits(traffic_limits)
+    await update_traffic_usage()
 
     scheduler.add_job(update_traffic_usage, 'interval', seconds=15)
+    scheduler.add_job(run_blocking, 'interval', minutes=5, args=[history.flush])
+    if KEY_POOL_SIZE > 0:
+        scheduler.add_job(
+            run_blocking,
+            'interval',
+            seconds=KEY_POOL_REFILL_INTERVAL,
+            args=[keypool.refill, WG_CMD, KEY_POOL_SIZE, KEY_POOL_REFILL_BATCH],
+            next_run_time=datetime.now(pytz.UTC)
+        )
+    if RECONCILE_INTERVAL > 0:
+        scheduler.add_job(reconcile_job, 'interval', minutes=RECONCILE_INTERVAL)
+    scheduler.add_job(watch_settings, 'interval', seconds=SETTINGS_WATCH_INTERVAL)
+    scheduler.add_job(refresh_dashboards, 'interval', seconds=DASHBOARD_INTERVAL)
+    scheduler.add_job(archive_job, 'interval', hours=ARCHIVE_JOB_INTERVAL)
+    if API_SOCKET:
+        await api.start(API_SOCKET, API_OPERATIONS)
+    if HA and HA_PEER:
+        scheduler.add_job(replicate_state, 'interval', seconds=HA_REPLICATE_INTERVAL, next_run_time=datetime.now(pytz.UTC))
+    asyncio.get_running_loop().add_signal_handler(signal.SIGHUP, lambda: asyncio.create_task(reload_settings()))
+
+@web.middleware
+async def webhook_secret_middleware(request, handler):
+    if request.path == WEBHOOK_PATH:
+        token = request.headers.get('X-Telegram-Bot-Api-Secret-Token', '')
+        if not hmac.compare_digest(token, WEBHOOK_SECRET):
+            return web.Response(status=403)
+    return await handler(request)
+
+async def register_webhook(dp):
+    if WEBHOOK_URL:
+        await bot.set_webhook(WEBHOOK_URL.rstrip('/') + WEBHOOK_PATH, secret_token=WEBHOOK_SECRET or None)
+
+if HA and not ha_lease.acquire():
+    state_server = ha.serve_state(HA_LISTEN, HA_SECRET, replicated_paths()) if HA_LISTEN else None
+    logger.warning("Standing by: %s is held by the active instance", ha_lease.path)
+    ha.wait_for_leadership(ha_lease)
+    if state_server:
+        state_server.shutdown()
+        state_server.server_close()
+    logger.warning("Lease acquired, taking over")
 
-executor.start_polling(dp, on_startup=on_startup)
+if BOT_MODE == 'webhook':
+    web_app = web.Application(middlewares=[webhook_secret_middleware])
+    webhook_executor = executor.set_webhook(dp, WEBHOOK_PATH, on_startup=[on_startup, register_webhook], web_app=web_app)
+    webhook_executor.run_app(host=WEBHOOK_HOST, port=WEBHOOK_PORT)
+else:
+    executor.start_polling(dp, on_startup=on_startup)
@@ -0,0 +1,46 @@
+import time
+from datetime import datetime, timedelta
+import pytz
+
+PAGE_SIZE = 30
+INACTIVE_DAYS = (7, 30, 90)
+EXTEND_DURATIONS = {
+    '1d': timedelta(days=1),
+    '1w': timedelta(weeks=1),
+    '1m': timedelta(days=30),
+    '3m': timedelta(days=90),
+}
+
+def expired(peer_index, expirations, now=None):
+    if now is None:
+        now = datetime.now(pytz.UTC)
+    return {username for username in peer_index if expirations.get(username) and expirations[username] <= now}
+
+def over_quota(peer_index, traffic_limits):
+    return {
+        username for username in peer_index
+        if traffic_limits.get(username, {}).get('limit')
+        and traffic_limits[username].get('used', 0) >= traffic_limits[username]['limit']
+    }
+
+def inactive(peer_index, snapshot, days, now=None):
+    if now is None:
+        now = time.time()
+    cutoff = now - days * 86400
+    selected = set()
+    for username in peer_index:
+        client_stats = snapshot.get(username)
+        if client_stats is not None and client_stats['latest_handshake'] and client_stats['latest_handshake'] <= cutoff:
+            selected.add(username)
+    return selected
+
+def extend_expiration(expiration, duration, now=None):
+    if now is None:
+        now = datetime.now(pytz.UTC)
+    return max(expiration, now) + duration if expiration else now + duration
+
+def page(usernames, number):
+    ordered = sorted(usernames)
+    pages = max((len(ordered) + PAGE_SIZE - 1) // PAGE_SIZE, 1)
+    number = min(max(number, 0), pages - 1)
+    return ordered[number * PAGE_SIZE:(number + 1) * PAGE_SIZE], number, pages
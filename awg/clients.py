@@ -0,0 +1,227 @@
+import os
+import json
+import hashlib
+import sqlite3
+import shutil
+import subprocess
+import importlib
+from contextlib import closing
+import tracing
+
+PEERS_FILE = 'files/peers.json'
+ARTIFACTS_DB = 'files/artifacts.db'
+LEGACY_USERS_DIR = 'users'
+AMNEZIA_PARAMS = ['Jc', 'Jmin', 'Jmax', 'H1', 'H2', 'H3', 'H4']
+
+vpn_codec = importlib.import_module('awg-decode')
+server_public_keys = {}
+
+def load_peers():
+    if not os.path.exists(PEERS_FILE):
+        return {}
+    with tracing.span('read peers'), open(PEERS_FILE, 'r') as f:
+        try:
+            return json.load(f)
+        except json.JSONDecodeError:
+            return {}
+
+def save_peers(peers):
+    os.makedirs(os.path.dirname(PEERS_FILE), exist_ok=True)
+    temp_path = PEERS_FILE + '.tmp'
+    with tracing.span('write peers'), open(temp_path, 'w') as f:
+        json.dump(peers, f)
+    os.replace(temp_path, PEERS_FILE)
+
+def get_peer(username):
+    return load_peers().get(username)
+
+def set_peer(username, private_key, preshared_key, address):
+    peers = load_peers()
+    peers[username] = {'private_key': private_key, 'preshared_key': preshared_key, 'address': address}
+    save_peers(peers)
+
+def remove_peer(username):
+    peers = load_peers()
+    if username in peers:
+        del peers[username]
+        save_peers(peers)
+    drop_artifacts(username)
+
+def get_server_public_key(private_key, wg_cmd):
+    if private_key not in server_public_keys:
+        server_public_keys[private_key] = subprocess.check_output(
+            [wg_cmd, 'pubkey'], input=private_key + '\n', text=True
+        ).strip()
+    return server_public_keys[private_key]
+
+def get_interface_template(wg_config_file, endpoint, wg_cmd):
+    values = {}
+    with open(wg_config_file, 'r') as f:
+        in_interface = False
+        for line in f:
+            line = line.strip()
+            if line.startswith('['):
+                in_interface = line == '[Interface]'
+                continue
+            if not in_interface or line.startswith('#'):
+                continue
+            key, sep, value = line.partition('=')
+            if sep:
+                values.setdefault(key.strip(), value.strip())
+    template = {
+        'endpoint': endpoint,
+        'listen_port': values.get('ListenPort', ''),
+        'dns': values.get('DNS') or '8.8.8.8, 8.8.4.4',
+        'server_public_key': get_server_public_key(values.get('PrivateKey', ''), wg_cmd),
+        'amnezia': {},
+    }
+    if 'amnezia' in wg_config_file.lower():
+        template['amnezia'] = {param: values.get(param, '0') for param in AMNEZIA_PARAMS}
+    return template
+
+def template_fingerprint(template):
+    return hashlib.sha256(json.dumps(template, sort_keys=True).encode()).hexdigest()
+
+def render_config(record, template):
+    lines = [
+        '[Interface]',
+        f"Address = {record['address']}",
+        f"DNS = {template['dns']}",
+        f"PrivateKey = {record['private_key']}",
+    ]
+    for param, value in template['amnezia'].items():
+        lines.append(f"{param} = {value}")
+    allowed_ips = '0.0.0.0/0, ::/0' if ':' in record['address'] else '0.0.0.0/0'
+    lines += [
+        '[Peer]',
+        f"PublicKey = {template['server_public_key']}",
+        f"PresharedKey = {record['preshared_key']}",
+        f"AllowedIPs = {allowed_ips}",
+        f"Endpoint = {template['endpoint']}:{template['listen_port']}",
+        'PersistentKeepalive = 25',
+    ]
+    return '\n'.join(lines) + '\n'
+
+def render_qr(conf_text):
+    with tracing.span('subprocess qrencode'):
+        return subprocess.check_output(['qrencode', '-l', 'L', '-o', '-'], input=conf_text.encode())
+
+def render_vpn_key(conf_text):
+    try:
+        return vpn_codec.encode(vpn_codec.process_conf_data(conf_text))
+    except ValueError:
+        return ""
+
+def open_artifacts_db():
+    os.makedirs(os.path.dirname(ARTIFACTS_DB), exist_ok=True)
+    conn = sqlite3.connect(ARTIFACTS_DB)
+    conn.execute(
+        'CREATE TABLE IF NOT EXISTS artifacts ('
+        'username TEXT PRIMARY KEY, fingerprint TEXT, conf TEXT, vpn_key TEXT, png BLOB)'
+    )
+    conn.execute('CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)')
+    return conn
+
+def drop_artifacts(username=None):
+    with closing(open_artifacts_db()) as conn, conn:
+        if username is None:
+            conn.execute('DELETE FROM artifacts')
+        else:
+            conn.execute('DELETE FROM artifacts WHERE username = ?', (username,))
+
+def prune_artifacts(fingerprint):
+    with closing(open_artifacts_db()) as conn, conn:
+        conn.execute('DELETE FROM artifacts WHERE fingerprint != ?', (fingerprint,))
+
+def get_rendered_template():
+    with closing(open_artifacts_db()) as conn:
+        row = conn.execute("SELECT value FROM meta WHERE key = 'template'").fetchone()
+        return row[0] if row else None
+
+def template_changed(template):
+    return get_rendered_template() != template_fingerprint(template)
+
+def render_artifacts(items, template):
+    rendered = []
+    for username, record in items:
+        try:
+            conf = render_config(record, template)
+            rendered.append((
+                username, template_fingerprint({'template': template, 'record': record}),
+                conf, render_vpn_key(conf), render_qr(conf), None
+            ))
+        except (OSError, KeyError, subprocess.CalledProcessError) as e:
+            rendered.append((username, None, None, None, None, str(e) or type(e).__name__))
+    return rendered
+
+def store_artifacts(rendered, template):
+    with closing(open_artifacts_db()) as conn, conn:
+        conn.executemany(
+            'INSERT OR REPLACE INTO artifacts (username, fingerprint, conf, vpn_key, png) VALUES (?, ?, ?, ?, ?)',
+            (row[:5] for row in rendered if row[5] is None)
+        )
+        conn.execute(
+            "INSERT OR REPLACE INTO meta (key, value) VALUES ('template', ?)",
+            (template_fingerprint(template),)
+        )
+
+def get_artifacts(username, wg_config_file, endpoint, wg_cmd):
+    record = get_peer(username)
+    if record is None:
+        return None
+    template = get_interface_template(wg_config_file, endpoint, wg_cmd)
+    fingerprint = template_fingerprint({'template': template, 'record': record})
+    with tracing.span('artifacts', client=username), closing(open_artifacts_db()) as conn:
+        row = conn.execute(
+            'SELECT conf, vpn_key, png FROM artifacts WHERE username = ? AND fingerprint = ?',
+            (username, fingerprint)
+        ).fetchone()
+        if row:
+            return {'conf': row[0], 'vpn_key': row[1], 'png': row[2]}
+        conf = render_config(record, template)
+        artifacts = {'conf': conf, 'vpn_key': render_vpn_key(conf), 'png': render_qr(conf)}
+        with conn:
+            conn.execute(
+                'INSERT OR REPLACE INTO artifacts (username, fingerprint, conf, vpn_key, png) VALUES (?, ?, ?, ?, ?)',
+                (username, fingerprint, artifacts['conf'], artifacts['vpn_key'], artifacts['png'])
+            )
+        return artifacts
+
+def parse_client_config(conf_text):
+    values = {}
+    for line in conf_text.splitlines():
+        key, sep, value = line.strip().partition('=')
+        if sep:
+            values.setdefault(key.strip(), value.strip())
+    return values
+
+def migrate_legacy_users():
+    if not os.path.isdir(LEGACY_USERS_DIR):
+        return 0
+    peers = load_peers()
+    migrated = 0
+    for username in os.listdir(LEGACY_USERS_DIR):
+        user_dir = os.path.join(LEGACY_USERS_DIR, username)
+        conf_path = os.path.join(user_dir, f'{username}.conf')
+        if not os.path.isfile(conf_path):
+            continue
+        if username not in peers:
+            with open(conf_path, 'r') as f:
+                values = parse_client_config(f.read())
+            if not values.get('PrivateKey') or not values.get('Address'):
+                continue
+            peers[username] = {
+                'private_key': values['PrivateKey'],
+                'preshared_key': values.get('PresharedKey', ''),
+                'address': values['Address'],
+            }
+            migrated += 1
+    if migrated:
+        save_peers(peers)
+    for username in peers:
+        shutil.rmtree(os.path.join(LEGACY_USERS_DIR, username), ignore_errors=True)
+    try:
+        os.rmdir(LEGACY_USERS_DIR)
+    except OSError:
+        pass
+    return migrated
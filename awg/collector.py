@@ -0,0 +1,159 @@
+import os
+import sys
+import time
+import struct
+import logging
+import argparse
+import subprocess
+from multiprocessing import shared_memory, resource_tracker
+import db
+import stats
+
+HEADER = struct.Struct('<QQQd')
+RECORD = struct.Struct('<128sQQq64sdd')
+READ_RETRIES = 100
+STALE_INTERVALS = 3
+
+logger = logging.getLogger(__name__)
+
+def segment_size(capacity):
+    return HEADER.size + RECORD.size * capacity
+
+class SnapshotWriter:
+    def __init__(self, shm):
+        self.buf = shm.buf
+        self.capacity = (len(shm.buf) - HEADER.size) // RECORD.size
+
+    def publish(self, snapshot, rates, timestamp):
+        seq = HEADER.unpack_from(self.buf, 0)[0]
+        struct.pack_into('<Q', self.buf, 0, seq + 1)
+        count = 0
+        for username, client in snapshot.items():
+            if count == self.capacity:
+                break
+            rate = rates.get(username, {'received_rate': 0.0, 'sent_rate': 0.0})
+            RECORD.pack_into(
+                self.buf, HEADER.size + count * RECORD.size,
+                username.encode(), client['received_bytes'], client['sent_bytes'], client['latest_handshake'],
+                (client['endpoint'] or '').encode(), rate['received_rate'], rate['sent_rate']
+            )
+            count += 1
+        HEADER.pack_into(self.buf, 0, seq + 1, count, len(snapshot), timestamp)
+        struct.pack_into('<Q', self.buf, 0, seq + 2)
+        return count
+
+class SnapshotReader:
+    def __init__(self, shm, process=None, interval=None):
+        self.shm = shm
+        self.buf = shm.buf
+        self.process = process
+        self.max_age = interval * STALE_INTERVALS if interval else None
+        self.unusable = None
+
+    def alive(self):
+        return self.process is None or self.process.poll() is None
+
+    def read(self):
+        for _ in range(READ_RETRIES):
+            seq, count, total, timestamp = HEADER.unpack_from(self.buf, 0)
+            if seq & 1:
+                time.sleep(0)
+                continue
+            records = list(RECORD.iter_unpack(self.buf[HEADER.size:HEADER.size + count * RECORD.size]))
+            if HEADER.unpack_from(self.buf, 0)[0] == seq:
+                break
+        else:
+            return None
+        if not timestamp:
+            return None
+        if total > count:
+            return self.reject(f"{total} peers do not fit into the segment of {count}")
+        if self.max_age and time.time() - timestamp > self.max_age:
+            return self.reject(f"no update for {time.time() - timestamp:.0f} s")
+        if self.unusable is not None:
+            logger.warning("Stats collector snapshot is usable again")
+            self.unusable = None
+        snapshot = {}
+        rates = {}
+        for name, received_bytes, sent_bytes, latest_handshake, endpoint, received_rate, sent_rate in records:
+            username = name.rstrip(b'\0').decode()
+            endpoint = endpoint.rstrip(b'\0').decode()
+            snapshot[username] = {
+                'received_bytes': received_bytes,
+                'sent_bytes': sent_bytes,
+                'latest_handshake': latest_handshake,
+                'endpoint': endpoint,
+            }
+            rates[username] = {'received_rate': received_rate, 'sent_rate': sent_rate}
+        return snapshot, rates, timestamp
+
+    def reject(self, reason):
+        if self.unusable is None:
+            logger.warning("Stats collector snapshot ignored, polling in the bot process: %s", reason)
+        self.unusable = reason
+        return None
+
+    def close(self):
+        if self.process is not None and self.process.poll() is None:
+            self.process.terminate()
+        self.buf = None
+        self.shm.close()
+        self.shm.unlink()
+
+def start(wg_config_file, wg_cmd, interval, capacity):
+    shm = shared_memory.SharedMemory(create=True, size=segment_size(capacity))
+    try:
+        process = subprocess.Popen([
+            sys.executable, os.path.abspath(__file__),
+            '--shm', shm.name,
+            '--config', wg_config_file,
+            '--wg-cmd', wg_cmd,
+            '--interval', str(interval),
+            '--parent', str(os.getpid()),
+        ])
+    except OSError:
+        shm.close()
+        shm.unlink()
+        raise
+    return SnapshotReader(shm, process, interval)
+
+def run(shm_name, wg_config_file, wg_cmd, interval, parent_pid):
+    shm = shared_memory.SharedMemory(name=shm_name)
+    resource_tracker.unregister(shm._name, 'shared_memory')
+    writer = SnapshotWriter(shm)
+    previous = None
+    previous_time = None
+    try:
+        while os.getppid() == parent_pid:
+            started = time.time()
+            try:
+                interface_name = db.get_interface_name(wg_config_file)
+                peer_index = db.get_peer_index(wg_config_file)
+                live_peers = db.get_wg_dump(interface_name, wg_cmd)
+            except (OSError, subprocess.CalledProcessError) as e:
+                print(f"collector: {e}", file=sys.stderr)
+            else:
+                current = stats.build_snapshot(peer_index, live_peers)
+                rates = stats.compute_rates(previous, current, started - previous_time) if previous is not None else {}
+                writer.publish(current, rates, started)
+                previous, previous_time = current, started
+            time.sleep(max(interval - (time.time() - started), 0))
+    finally:
+        writer = None
+        shm.close()
+
+def main():
+    parser = argparse.ArgumentParser(description='Poll the WireGuard interface and publish per-peer counters into shared memory.')
+    parser.add_argument('--shm', required=True, help='Name of the shared memory segment created by the bot.')
+    parser.add_argument('--config', required=True, help='WireGuard config file.')
+    parser.add_argument('--wg-cmd', default='wg')
+    parser.add_argument('--interval', type=float, default=15)
+    parser.add_argument('--parent', type=int, default=os.getppid(), help='Exit when this process is gone.')
+    args = parser.parse_args()
+    try:
+        run(args.shm, args.config, args.wg_cmd, args.interval, args.parent)
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,48 @@
+import heapq
+import time
+from datetime import datetime, timedelta
+import humanize
+import pytz
+
+ONLINE_WINDOW = 180
+NEAR_LIMIT_RATIO = 0.9
+EXPIRATION_WINDOW = timedelta(days=3)
+MAX_ITEMS = 5
+
+def render(snapshot, rates, traffic_limits, expirations):
+    now = time.time()
+    online = sum(1 for client in snapshot.values() if client['latest_handshake'] and now - client['latest_handshake'] <= ONLINE_WINDOW)
+    received_rate = sum(rate['received_rate'] for rate in rates.values())
+    sent_rate = sum(rate['sent_rate'] for rate in rates.values())
+    lines = [
+        f"🟢 Онлайн: {online} из {len(snapshot)}",
+        f"📶 ↑ {humanize.naturalsize(received_rate, binary=True)}/с, ↓ {humanize.naturalsize(sent_rate, binary=True)}/с",
+    ]
+
+    near_limit = heapq.nlargest(
+        MAX_ITEMS,
+        ((username, user_traffic['used'] / user_traffic['limit'], user_traffic)
+         for username, user_traffic in traffic_limits.items()
+         if user_traffic.get('limit') and user_traffic.get('used', 0) >= user_traffic['limit'] * NEAR_LIMIT_RATIO),
+        key=lambda item: item[1]
+    )
+    if near_limit:
+        lines.append("⚠️ Близки к лимиту:")
+        for username, ratio, user_traffic in near_limit:
+            lines.append(
+                f"  {username} — {humanize.naturalsize(user_traffic['used'], binary=True)} "
+                f"из {humanize.naturalsize(user_traffic['limit'], binary=True)} ({min(ratio, 1):.0%})"
+            )
+
+    current = datetime.now(pytz.UTC)
+    expiring = heapq.nsmallest(
+        MAX_ITEMS,
+        ((username, expiration) for username, expiration in expirations.items()
+         if expiration and current < expiration <= current + EXPIRATION_WINDOW),
+        key=lambda item: item[1]
+    )
+    if expiring:
+        lines.append("📅 Скоро истекают:")
+        for username, expiration in expiring:
+            lines.append(f"  {username} — через {humanize.naturaldelta(expiration - current)}")
+    return '\n'.join(lines)
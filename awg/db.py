@@ -7,6 +7,10 @@ import glob
 import sys
 import socket
 import re
+import ipaddress
+import clients
+import settings
+import tracing
 from datetime import datetime
 
 EXPIRATIONS_FILE = 'files/expirations.json'
@@ -114,7 +118,7 @@ def create_config(path='files/setting.ini'):
                 print("Неверный выбор. Пожалуйста, введите 1 или 2")
 
     bot_token = input("Введите токен Telegram бота: ").strip()
-    admin_id = input("Введите Telegram ID администратора: ").strip()
+    admin_id = input("Введите Telegram ID администратора (несколько ID — через запятую): ").strip()
 
     os.makedirs("files", exist_ok=True)
     with open(path, "w") as f:
@@ -148,9 +152,9 @@ def save_client_endpoint(username, endpoint):
 
 def get_all_clients_transfer():
 
-    setting = get_config()
-    wg_config_file = setting['wg_config_file']
-    WG_CMD = get_wg_cmd()
+    config = settings.get()
+    wg_config_file = config.wg_config_file
+    WG_CMD = config.wg_cmd
 
     try:
         call = subprocess.check_output(
@@ -204,34 +208,127 @@ def get_all_clients_transfer():
     except subprocess.CalledProcessError as e:
         return []
 
-def get_config(path='files/setting.ini'):
+def get_interface_name(wg_config_file):
+    return os.path.basename(wg_config_file).split('.')[0]
+
+def normalize_allowed_ips(value):
+    networks = []
+    for item in value.split(','):
+        item = item.strip()
+        if not item or item == '(none)':
+            continue
+        try:
+            networks.append(str(ipaddress.ip_network(item, strict=False)))
+        except ValueError:
+            networks.append(item)
+    return tuple(sorted(networks))
+
+def iter_peers(lines):
+    name = None
+    block = []
+    for raw_line in lines:
+        line = raw_line.strip()
+        if line.startswith('# BEGIN_PEER '):
+            name = line[len('# BEGIN_PEER '):].strip()
+            block = []
+        elif line.startswith('# END_PEER ') and name is not None:
+            content = [l for l in block if l]
+            blocked = bool(content) and all(l.startswith('#') for l in content)
+            peer = {'public_key': None, 'preshared_key': None, 'allowed_ips': (), 'blocked': blocked}
+            for l in content:
+                key, sep, value = l.lstrip('# ').partition('=')
+                if not sep:
+                    continue
+                key = key.strip()
+                value = value.strip()
+                if key == 'PublicKey':
+                    peer['public_key'] = value
+                elif key == 'PresharedKey':
+                    peer['preshared_key'] = value
+                elif key == 'AllowedIPs':
+                    peer['allowed_ips'] = normalize_allowed_ips(value)
+            if peer['public_key']:
+                yield name, peer
+            name = None
+        elif name is not None:
+            block.append(line)
+
+def parse_peer_index(config_text):
+    return dict(iter_peers(config_text.splitlines()))
+
+def get_peer_index(wg_config_file=None):
+    if wg_config_file is None:
+        wg_config_file = settings.get().wg_config_file
+    with tracing.span('read peer index'), open(wg_config_file, 'r') as f:
+        return parse_peer_index(f.read())
+
+def get_wg_dump(interface, wg_cmd=None):
+    if wg_cmd is None:
+        wg_cmd = get_wg_cmd()
+    with tracing.span('subprocess wg show dump'):
+        output = subprocess.check_output([wg_cmd, 'show', interface, 'dump'], text=True)
+    peers = {}
+    for line in output.splitlines()[1:]:
+        parts = line.split('\t')
+        if len(parts) < 8:
+            continue
+        peers[parts[0]] = {
+            'preshared_key': None if parts[1] == '(none)' else parts[1],
+            'endpoint': parts[2],
+            'allowed_ips': normalize_allowed_ips(parts[3]),
+            'latest_handshake': int(parts[4]),
+            'received_bytes': int(parts[5]),
+            'sent_bytes': int(parts[6]),
+        }
+    return peers
+
+def get_wg_interface(interface, wg_cmd=None):
+    if wg_cmd is None:
+        wg_cmd = get_wg_cmd()
+    output = subprocess.check_output([wg_cmd, 'show', interface, 'dump'], text=True)
+    parts = output.splitlines()[0].split('\t') if output else []
+    if len(parts) < 4:
+        return None
+    return {
+        'private_key': parts[0],
+        'listen_port': parts[2],
+        'fwmark': parts[3],
+    }
+
+def get_config(path=settings.SETTINGS_FILE):
     if not os.path.exists(path):
         create_config(path)
-
-    config = configparser.ConfigParser()
-    config.read(path)
-    return {key: config['setting'][key] for key in config['setting']}
+    return settings.get().values
 
 def get_wg_cmd():
-    setting = get_config()
-    wg_config_file = setting['wg_config_file']
-    return 'awg' if 'amnezia' in wg_config_file.lower() else 'wg'
+    return settings.get().wg_cmd
 
-def root_add(id_user, ipv6=False):
-    setting = get_config()
-    endpoint = setting['endpoint']
-    wg_config_file = setting['wg_config_file']
-    WG_CMD = get_wg_cmd()
+def root_add(id_user, ipv6=False, keys=None, reserved=()):
+    config = settings.get()
+    endpoint = config.endpoint
+    wg_config_file = config.wg_config_file
+    WG_CMD = config.wg_cmd
 
     cmd = ["./newclient.sh", id_user, endpoint, wg_config_file, WG_CMD]
     if ipv6:
         cmd.append('ipv6')
 
-    return subprocess.call(cmd) == 0
+    env = dict(os.environ, CLIENT_RESERVED_IPS=' '.join(reserved))
+    if keys:
+        env.update(CLIENT_PRIVATE_KEY=keys['private_key'], CLIENT_PUBLIC_KEY=keys['public_key'], CLIENT_PSK=keys['preshared_key'])
+    with tracing.span('subprocess newclient.sh', client=id_user):
+        result = subprocess.run(cmd, capture_output=True, text=True, env=env)
+    if result.returncode != 0:
+        return False
+    for line in result.stdout.splitlines():
+        if line.startswith('CLIENT_RECORD '):
+            _, private_key, preshared_key, address = line.split(' ', 3)
+            clients.set_peer(id_user, private_key, preshared_key, address)
+            return True
+    return False
 
 def get_client_list():
-    setting = get_config()
-    wg_config_file = setting['wg_config_file']
+    wg_config_file = settings.get().wg_config_file
 
     try:
         call = subprocess.check_output(f"awk '/# BEGIN_PEER/ {{print $3}}' {wg_config_file}", shell=True)
@@ -248,9 +345,9 @@ def get_active_list():
     import subprocess
     import re
 
-    setting = get_config()
-    wg_config_file = setting['wg_config_file']
-    WG_CMD = get_wg_cmd()
+    config = settings.get()
+    wg_config_file = config.wg_config_file
+    WG_CMD = config.wg_cmd
 
     try:
         call = subprocess.check_output(
@@ -333,16 +430,21 @@ def get_active_list():
         return []
 
 def deactive_user_db(id_user):
-    setting = get_config()
-    wg_config_file = setting['wg_config_file']
-    WG_CMD = get_wg_cmd()
+    config = settings.get()
+    wg_config_file = config.wg_config_file
+    WG_CMD = config.wg_cmd
 
-    return subprocess.call(["./removeclient.sh", id_user, wg_config_file, WG_CMD]) == 0
+    with tracing.span('subprocess removeclient.sh', client=id_user):
+        returncode = subprocess.call(["./removeclient.sh", id_user, wg_config_file, WG_CMD])
+    if returncode != 0:
+        return False
+    clients.remove_peer(id_user)
+    return True
 
 def load_expirations():
     if not os.path.exists(EXPIRATIONS_FILE):
         return {}
-    with open(EXPIRATIONS_FILE, 'r') as f:
+    with tracing.span('read expirations'), open(EXPIRATIONS_FILE, 'r') as f:
         try:
             data = json.load(f)
             for user, timestamp in data.items():
@@ -357,7 +459,7 @@ def load_expirations():
 def save_expirations(expirations):
     os.makedirs(os.path.dirname(EXPIRATIONS_FILE), exist_ok=True)
     data = {user: (ts.isoformat() if ts else None) for user, ts in expirations.items()}
-    with open(EXPIRATIONS_FILE, 'w') as f:
+    with tracing.span('write expirations'), open(EXPIRATIONS_FILE, 'w') as f:
         json.dump(data, f)
 
 def set_user_expiration(username: str, expiration: datetime):
@@ -0,0 +1,256 @@
+import sys
+import json
+import time
+import asyncio
+import argparse
+import itertools
+from aiohttp import web
+
+BOT_USER = {'id': 1, 'is_bot': True, 'first_name': 'awg_bot', 'username': 'awg_bot'}
+REPLY_METHODS = {'sendmessage', 'editmessagetext', 'editmessagereplymarkup', 'senddocument', 'sendphoto'}
+
+SCENARIOS = {
+    'list': lambda client, name: [('callback', 'list_users', False)],
+    'open': lambda client, name: [('callback', f'client_{client}', False)],
+    'top': lambda client, name: [('callback', 'top_users_rate', False), ('callback', 'top_users_billing', False)],
+    'block': lambda client, name: [('callback', f'block_user_{client}', False)],
+    'unblock': lambda client, name: [('callback', f'unblock_user_{client}', False)],
+    'reload': lambda client, name: [('callback', 'reload_config', False)],
+    'bulk': lambda client, name: [
+        ('callback', 'bulk', False),
+        ('callback', f'bulk_toggle_{client}', False),
+        ('callback', 'bulk_do_block', False),
+        ('callback', f'bulk_toggle_{client}', False),
+        ('callback', 'bulk_do_unblock', False),
+    ],
+    'group': lambda client, name: [
+        ('message', f'/group {name}', False),
+        ('callback', 'bulk', False),
+        ('callback', f'bulk_toggle_{client}', False),
+        ('callback', f'bulk_group_{name}', False),
+        ('callback', 'groups', False),
+        ('callback', f'gr_open_{name}', False),
+        ('callback', 'gr_limit_5GB', False),
+        ('callback', 'gr_extend_1w', False),
+        ('callback', 'gr_delete_yes', False),
+    ],
+    'add': lambda client, name: [
+        ('callback', 'add_user', False),
+        ('message', name, False),
+        ('callback', f'connect_{name}_noipv6', True),
+        ('callback', f'duration_unlimited_{name}_noipv6', False),
+        ('callback', f'traffic_unlimited_{name}_noipv6', False),
+        ('callback', f'delete_user_{name}', False),
+    ],
+}
+
+def percentile(values, fraction):
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+class FakeBotAPI:
+    def __init__(self):
+        self.updates = []
+        self.update_ids = itertools.count(1)
+        self.message_ids = itertools.count(1000)
+        self.callback_ids = itertools.count(1)
+        self.new_updates = asyncio.Event()
+        self.connected = asyncio.Event()
+        self.delivered = {}
+        self.callback_waiters = {}
+        self.chat_waiters = {}
+        self.keyboards = {}
+        self.calls = {}
+
+    def chat(self, chat_id):
+        return {'id': chat_id, 'type': 'private', 'first_name': f'admin{chat_id}'}
+
+    def user(self, chat_id):
+        return {'id': chat_id, 'is_bot': False, 'first_name': f'admin{chat_id}'}
+
+    def message(self, chat_id, text='', sender=None, message_id=None):
+        return {
+            'message_id': message_id or next(self.message_ids),
+            'date': int(time.time()),
+            'chat': self.chat(chat_id),
+            'from': sender or BOT_USER,
+            'text': text,
+        }
+
+    def push(self, update):
+        update['update_id'] = next(self.update_ids)
+        self.updates.append(update)
+        self.new_updates.set()
+        return update['update_id']
+
+    def push_message(self, chat_id, text):
+        message = self.message(chat_id, text, sender=self.user(chat_id))
+        if text.startswith('/'):
+            message['entities'] = [{'type': 'bot_command', 'offset': 0, 'length': len(text.split()[0])}]
+        return self.push({'message': message})
+
+    def push_callback(self, chat_id, message_id, data, callback_id):
+        return self.push({'callback_query': {
+            'id': callback_id,
+            'from': self.user(chat_id),
+            'message': self.message(chat_id, message_id=message_id),
+            'chat_instance': str(chat_id),
+            'data': data,
+        }})
+
+    async def get_updates(self, params):
+        self.connected.set()
+        offset = int(params.get('offset') or 0)
+        timeout = float(params.get('timeout') or 0)
+        self.updates = [update for update in self.updates if update['update_id'] >= offset]
+        if not self.updates and timeout:
+            self.new_updates.clear()
+            try:
+                await asyncio.wait_for(self.new_updates.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+        now = time.perf_counter()
+        for update in self.updates:
+            self.delivered.setdefault(update['update_id'], now)
+        return self.updates[:int(params.get('limit') or 100)]
+
+    def record_keyboard(self, chat_id, params):
+        markup = params.get('reply_markup')
+        if not markup:
+            return
+        rows = json.loads(markup).get('inline_keyboard', [])
+        self.keyboards[chat_id] = {button.get('callback_data') for row in rows for button in row}
+
+    def handle(self, method, params):
+        chat_id = int(params['chat_id']) if params.get('chat_id') else None
+        if method == 'getme':
+            return BOT_USER
+        if method == 'getwebhookinfo':
+            return {'url': '', 'has_custom_certificate': False, 'pending_update_count': 0}
+        if method == 'answercallbackquery':
+            waiter = self.callback_waiters.pop(params.get('callback_query_id'), None)
+            if waiter and not waiter.done():
+                waiter.set_result(None)
+            return True
+        if method not in REPLY_METHODS or chat_id is None:
+            return True
+        message = self.message(chat_id, params.get('text', ''), message_id=int(params.get('message_id') or 0) or None)
+        if method == 'senddocument':
+            message['document'] = {'file_id': f'doc{message["message_id"]}', 'file_unique_id': f'doc{message["message_id"]}'}
+        elif method == 'sendphoto':
+            message['photo'] = [{'file_id': f'photo{message["message_id"]}', 'file_unique_id': f'photo{message["message_id"]}', 'width': 1, 'height': 1}]
+        self.record_keyboard(chat_id, params)
+        waiter = self.chat_waiters.get(chat_id)
+        if waiter and waiter[0] in self.delivered and method in waiter[1]:
+            del self.chat_waiters[chat_id]
+            if not waiter[2].done():
+                waiter[2].set_result(message['message_id'])
+        return message
+
+    async def dispatch(self, request):
+        method = request.match_info['method'].lower()
+        self.calls[method] = self.calls.get(method, 0) + 1
+        params = dict(request.query)
+        if request.can_read_body:
+            params.update((key, value) for key, value in (await request.post()).items() if isinstance(value, str))
+        if method == 'getupdates':
+            result = await self.get_updates(params)
+        else:
+            result = self.handle(method, params)
+        return web.json_response({'ok': True, 'result': result})
+
+    def wait_for_callback(self, callback_id):
+        future = asyncio.get_running_loop().create_future()
+        self.callback_waiters[callback_id] = future
+        return future
+
+    def send_message(self, chat_id, text, methods=REPLY_METHODS):
+        future = asyncio.get_running_loop().create_future()
+        update_id = self.push_message(chat_id, text)
+        self.chat_waiters[chat_id] = (update_id, methods, future)
+        return update_id, future
+
+async def run_session(api, chat_id, steps, step_timeout, latencies, failures):
+    update_id, future = api.send_message(chat_id, '/start', methods={'sendmessage'})
+    try:
+        main_message_id = await asyncio.wait_for(future, step_timeout)
+    except asyncio.TimeoutError:
+        failures['start'] = failures.get('start', 0) + 1
+        return
+    latencies.setdefault('start', []).append(time.perf_counter() - api.delivered[update_id])
+    for kind, payload, optional in steps:
+        if kind == 'callback':
+            if optional and payload not in api.keyboards.get(chat_id, ()):
+                continue
+            name = payload.split('_')[0]
+            callback_id = str(next(api.callback_ids))
+            future = api.wait_for_callback(callback_id)
+            update_id = api.push_callback(chat_id, main_message_id, payload, callback_id)
+        else:
+            name = 'message'
+            update_id, future = api.send_message(chat_id, payload)
+        try:
+            await asyncio.wait_for(future, step_timeout)
+        except asyncio.TimeoutError:
+            failures[name] = failures.get(name, 0) + 1
+            return
+        latencies.setdefault(name, []).append(time.perf_counter() - api.delivered[update_id])
+
+async def run_load(args):
+    api = FakeBotAPI()
+    app = web.Application()
+    app.router.add_route('*', '/bot{token}/{method}', api.dispatch)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, args.host, args.port).start()
+    chat_ids = [args.first_chat_id + i for i in range(args.chats)]
+    print(f"Fake Bot API on http://{args.host}:{args.port}. Set api_server to this URL and admin_id to include {chat_ids[0]}..{chat_ids[-1]}, then start the bot.", file=sys.stderr)
+    await api.connected.wait()
+
+    latencies = {}
+    failures = {}
+
+    async def chat_loop(chat_id):
+        for round_number in range(args.rounds):
+            for scenario in args.scenarios:
+                steps = SCENARIOS[scenario](args.client, f'lt{chat_id}r{round_number}')
+                await run_session(api, chat_id, steps, args.timeout, latencies, failures)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(chat_loop(chat_id) for chat_id in chat_ids))
+    elapsed = time.perf_counter() - started
+    await runner.cleanup()
+    return latencies, failures, elapsed, api.calls
+
+def main():
+    parser = argparse.ArgumentParser(description='Run a local stand-in for the Telegram Bot API and drive scripted admin sessions through the bot.')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8081)
+    parser.add_argument('--client', default='', help='Existing client used by the open/block/unblock/bulk/group scenarios.')
+    parser.add_argument('-s', '--scenarios', default='list,open', help=f"Comma-separated scenarios: {', '.join(SCENARIOS)}.")
+    parser.add_argument('-c', '--chats', type=int, default=1, help='Number of admin chats driven in parallel.')
+    parser.add_argument('--first-chat-id', type=int, default=100000001, help='Chat id of the first simulated admin.')
+    parser.add_argument('-n', '--rounds', type=int, default=20, help='Scenario rounds per chat.')
+    parser.add_argument('--timeout', type=float, default=30, help='Seconds to wait for each step.')
+    args = parser.parse_args()
+
+    args.scenarios = [scenario.strip() for scenario in args.scenarios.split(',') if scenario.strip()]
+    unknown = [scenario for scenario in args.scenarios if scenario not in SCENARIOS]
+    if unknown:
+        parser.error(f"unknown scenarios: {', '.join(unknown)}")
+    if not args.client and {'open', 'block', 'unblock', 'bulk', 'group'} & set(args.scenarios):
+        parser.error('--client is required for the open, block, unblock, bulk and group scenarios')
+
+    latencies, failures, elapsed, calls = asyncio.run(run_load(args))
+    total = sum(len(values) for values in latencies.values())
+    for name, values in sorted(latencies.items()):
+        values.sort()
+        print(f"{name}: {len(values)} ok, {failures.get(name, 0)} failed, "
+              f"p50: {percentile(values, 0.5) * 1000:.1f} ms, p99: {percentile(values, 0.99) * 1000:.1f} ms")
+    for name in sorted(set(failures) - set(latencies)):
+        print(f"{name}: 0 ok, {failures[name]} failed")
+    print(f"steps: {total}, elapsed: {elapsed:.1f} s, throughput: {total / elapsed if elapsed else 0:.1f} steps/s")
+    print('api calls: ' + ', '.join(f'{method}={count}' for method, count in sorted(calls.items())))
+    sys.exit(1 if failures else 0)
+
+if __name__ == '__main__':
+    main()
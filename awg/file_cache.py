@@ -0,0 +1,47 @@
+import os
+import json
+import hashlib
+
+FILE_ID_CACHE_FILE = 'files/file_ids.json'
+
+file_ids = {}
+
+def load():
+    global file_ids
+    if os.path.exists(FILE_ID_CACHE_FILE):
+        with open(FILE_ID_CACHE_FILE, 'r') as f:
+            try:
+                file_ids = json.load(f)
+            except json.JSONDecodeError:
+                file_ids = {}
+
+def save():
+    os.makedirs(os.path.dirname(FILE_ID_CACHE_FILE), exist_ok=True)
+    temp_path = FILE_ID_CACHE_FILE + '.tmp'
+    with open(temp_path, 'w') as f:
+        json.dump(file_ids, f)
+    os.replace(temp_path, FILE_ID_CACHE_FILE)
+
+def content_hash(content):
+    if isinstance(content, str):
+        content = content.encode()
+    return hashlib.sha256(content).hexdigest()
+
+def get(username, kind, digest):
+    entry = file_ids.get(username, {}).get(kind)
+    if entry and entry['hash'] == digest:
+        return entry['file_id']
+    return None
+
+def put(username, kind, digest, file_id):
+    file_ids.setdefault(username, {})[kind] = {'hash': digest, 'file_id': file_id}
+    save()
+
+def drop(username, kind=None):
+    if username not in file_ids:
+        return
+    if kind is None:
+        del file_ids[username]
+    else:
+        file_ids[username].pop(kind, None)
+    save()
@@ -0,0 +1,83 @@
+import os
+import json
+from datetime import datetime
+import pytz
+
+GROUPS_FILE = 'files/groups.json'
+
+def load_groups():
+    if not os.path.exists(GROUPS_FILE):
+        return {}
+    with open(GROUPS_FILE, 'r') as f:
+        try:
+            groups = json.load(f)
+        except json.JSONDecodeError:
+            return {}
+    for group in groups.values():
+        group['expiration'] = datetime.fromisoformat(group['expiration']) if group.get('expiration') else None
+    return groups
+
+def save_groups(groups):
+    os.makedirs(os.path.dirname(GROUPS_FILE), exist_ok=True)
+    data = {
+        name: dict(group, expiration=group['expiration'].isoformat() if group.get('expiration') else None)
+        for name, group in groups.items()
+    }
+    temp_path = GROUPS_FILE + '.tmp'
+    with open(temp_path, 'w') as f:
+        json.dump(data, f)
+    os.replace(temp_path, GROUPS_FILE)
+
+def new_group():
+    return {'members': [], 'limit': None, 'used': 0, 'expiration': None}
+
+def member_index(groups):
+    return {username: name for name, group in groups.items() for username in group['members']}
+
+def add_members(groups, name, usernames):
+    index = member_index(groups)
+    added = []
+    for username in usernames:
+        current = index.get(username)
+        if current == name:
+            continue
+        if current is not None:
+            groups[current]['members'].remove(username)
+        groups[name]['members'].append(username)
+        added.append(username)
+    groups[name]['members'].sort()
+    return added
+
+def remove_members(groups, usernames):
+    usernames = set(usernames)
+    removed = []
+    for group in groups.values():
+        kept = [username for username in group['members'] if username not in usernames]
+        if len(kept) != len(group['members']):
+            removed += [username for username in group['members'] if username in usernames]
+            group['members'] = kept
+    return removed
+
+def over_limit(group):
+    return bool(group.get('limit')) and group['used'] >= group['limit']
+
+def expired(group, now=None):
+    if now is None:
+        now = datetime.now(pytz.UTC)
+    return group.get('expiration') is not None and group['expiration'] <= now
+
+def exhausted(group, now=None):
+    return over_limit(group) or expired(group, now)
+
+def record_usage(groups, index, deltas):
+    exhausted = []
+    for username, delta in deltas.items():
+        name = index.get(username)
+        if name is None or delta <= 0:
+            continue
+        group = groups[name]
+        was_over = over_limit(group)
+        group['used'] += delta
+        if not was_over and over_limit(group):
+            exhausted.append(name)
+    return exhausted
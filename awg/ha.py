@@ -0,0 +1,142 @@
+import os
+import json
+import hmac
+import time
+import fcntl
+import base64
+import hashlib
+import logging
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+LEASE_RETRY = 1
+STATE_PATH = '/state'
+SIGNATURE_HEADER = 'X-HA-Signature'
+MAX_STATE_SIZE = 256 * 1024 * 1024
+MAX_CLOCK_SKEW = 300
+
+logger = logging.getLogger(__name__)
+
+class FileLease:
+    def __init__(self, path):
+        self.path = path
+        self.fd = None
+
+    @property
+    def held(self):
+        return self.fd is not None
+
+    def acquire(self):
+        if self.fd is not None:
+            return True
+        if os.path.dirname(self.path):
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o600)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            os.close(fd)
+            return False
+        os.ftruncate(fd, 0)
+        os.write(fd, f'{os.getpid()}\n'.encode())
+        self.fd = fd
+        return True
+
+    def release(self):
+        if self.fd is None:
+            return
+        fcntl.flock(self.fd, fcntl.LOCK_UN)
+        os.close(self.fd)
+        self.fd = None
+
+def wait_for_leadership(lease, retry=LEASE_RETRY):
+    while not lease.acquire():
+        time.sleep(retry)
+
+def sign(secret, body):
+    return hmac.new(secret.encode(), body, hashlib.sha256).hexdigest()
+
+def pack_state(files):
+    return json.dumps({'sent': time.time_ns(), 'files': files}).encode()
+
+def read_state(paths, seen):
+    changed = {}
+    current = {}
+    for name, path in paths.items():
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            continue
+        current[name] = [stat.st_mtime_ns, stat.st_size]
+        if seen.get(name) != current[name]:
+            with open(path, 'rb') as f:
+                changed[name] = base64.b64encode(f.read()).decode()
+    return changed, current
+
+def write_state(paths, files):
+    written = []
+    for name, content in files.items():
+        path = paths.get(name)
+        if path is None:
+            continue
+        data = base64.b64decode(content)
+        try:
+            with open(path, 'rb') as f:
+                if f.read() == data:
+                    continue
+        except FileNotFoundError:
+            pass
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        temp_path = path + '.tmp'
+        with open(temp_path, 'wb') as f:
+            f.write(data)
+        os.replace(temp_path, path)
+        written.append(name)
+    return written
+
+class StateHandler(BaseHTTPRequestHandler):
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        if self.path != STATE_PATH or not 0 < length <= MAX_STATE_SIZE:
+            self.send_error(400)
+            return
+        body = self.rfile.read(length)
+        if not hmac.compare_digest(self.headers.get(SIGNATURE_HEADER, ''), sign(self.server.secret, body)):
+            self.send_error(403)
+            return
+        try:
+            state = json.loads(body)
+            sent, files = int(state['sent']), state['files']
+        except (ValueError, KeyError, TypeError):
+            self.send_error(400)
+            return
+        with self.server.lock:
+            if sent <= self.server.last_sent or abs(time.time_ns() - sent) > MAX_CLOCK_SKEW * 10**9:
+                logger.error("Rejected stale or replayed state update")
+                self.send_error(409)
+                return
+            self.server.last_sent = sent
+            try:
+                written = write_state(self.server.paths, files)
+            except (ValueError, OSError) as e:
+                logger.error("Failed to apply replicated state: %s", e)
+                self.send_error(500)
+                return
+        if written:
+            logger.warning("Replicated state updated: %s", ', '.join(written))
+        self.send_response(204)
+        self.end_headers()
+
+    def log_message(self, format, *args):
+        pass
+
+def serve_state(listen, secret, paths):
+    host, _, port = listen.rpartition(':')
+    server = ThreadingHTTPServer((host or '0.0.0.0', int(port)), StateHandler)
+    server.secret = secret
+    server.paths = paths
+    server.lock = threading.Lock()
+    server.last_sent = 0
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
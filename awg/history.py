@@ -0,0 +1,85 @@
+import os
+import json
+import time
+import threading
+from datetime import date, timedelta
+
+HISTORY_DIR = 'files/history'
+RECENT_WINDOW = 3600
+
+pending = {}
+recent = {}
+pending_lock = threading.Lock()
+
+def day_path(day):
+    return os.path.join(HISTORY_DIR, f'{day.isoformat()}.json')
+
+def load_day(day):
+    path = day_path(day)
+    if not os.path.exists(path):
+        return {}
+    with open(path, 'r') as f:
+        try:
+            return json.load(f)
+        except json.JSONDecodeError:
+            return {}
+
+def record(deltas, day=None):
+    if day is None:
+        day = date.today()
+    minute = int(time.time()) // 60
+    with pending_lock:
+        usage = pending.setdefault(day, {})
+        bucket = recent.setdefault(minute, {})
+        for username, delta in deltas.items():
+            if delta > 0:
+                usage[username] = usage.get(username, 0) + delta
+                bucket[username] = bucket.get(username, 0) + delta
+        for old_minute in [m for m in recent if m <= minute - RECENT_WINDOW // 60]:
+            del recent[old_minute]
+
+def flush():
+    global pending
+    with pending_lock:
+        batches, pending = pending, {}
+    if not batches:
+        return
+    os.makedirs(HISTORY_DIR, exist_ok=True)
+    for day, usage in batches.items():
+        data = load_day(day)
+        for username, delta in usage.items():
+            data[username] = data.get(username, 0) + delta
+        temp_path = day_path(day) + '.tmp'
+        with open(temp_path, 'w') as f:
+            json.dump(data, f)
+        os.replace(temp_path, day_path(day))
+
+def iter_days(start, end):
+    day = start
+    while day <= end:
+        yield day
+        day += timedelta(days=1)
+
+def period_usage(start, end=None):
+    if end is None:
+        end = date.today()
+    totals = {}
+    for day in iter_days(start, end):
+        usage = load_day(day)
+        with pending_lock:
+            unflushed = dict(pending.get(day, {}))
+        for username, delta in unflushed.items():
+            usage[username] = usage.get(username, 0) + delta
+        for username, delta in usage.items():
+            totals[username] = totals.get(username, 0) + delta
+    return totals
+
+def recent_usage(seconds=RECENT_WINDOW):
+    since = (int(time.time()) - seconds) // 60
+    totals = {}
+    with pending_lock:
+        for minute, usage in recent.items():
+            if minute > since:
+                for username, delta in usage.items():
+                    totals[username] = totals.get(username, 0) + delta
+    return totals
@@ -0,0 +1,108 @@
+import os
+import json
+import secrets
+import threading
+import subprocess
+import clients
+
+POOL_FILE = 'files/key_pool.enc'
+POOL_KEY_FILE = 'files/key_pool.key'
+
+pool_lock = threading.Lock()
+flush_lock = threading.Lock()
+entries = None
+dirty = False
+counters = {'hits': 0, 'misses': 0, 'generated': 0}
+
+def get_pool_key():
+    if not os.path.exists(POOL_KEY_FILE):
+        os.makedirs(os.path.dirname(POOL_KEY_FILE), exist_ok=True)
+        fd = os.open(POOL_KEY_FILE, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+        with os.fdopen(fd, 'w') as f:
+            f.write(secrets.token_hex(32))
+    return POOL_KEY_FILE
+
+def openssl(args, data):
+    return subprocess.run(
+        ['openssl', 'enc', '-aes-256-cbc', '-pbkdf2', '-salt', '-pass', f'file:{get_pool_key()}'] + args,
+        input=data, capture_output=True, check=True
+    ).stdout
+
+def load_pool():
+    if not os.path.exists(POOL_FILE):
+        return []
+    with open(POOL_FILE, 'rb') as f:
+        encrypted = f.read()
+    try:
+        return json.loads(openssl(['-d'], encrypted))
+    except (OSError, subprocess.CalledProcessError, json.JSONDecodeError):
+        return []
+
+def save_pool(entries):
+    encrypted = openssl([], json.dumps(entries).encode())
+    temp_path = POOL_FILE + '.tmp'
+    fd = os.open(temp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    with os.fdopen(fd, 'wb') as f:
+        f.write(encrypted)
+    os.replace(temp_path, POOL_FILE)
+
+def generate_keys(wg_cmd):
+    private_key = subprocess.check_output([wg_cmd, 'genkey'], text=True).strip()
+    public_key = subprocess.check_output([wg_cmd, 'pubkey'], input=private_key + '\n', text=True).strip()
+    preshared_key = subprocess.check_output([wg_cmd, 'genpsk'], text=True).strip()
+    return {'private_key': private_key, 'public_key': public_key, 'preshared_key': preshared_key}
+
+def pool_entries():
+    global entries, dirty
+    if entries is None:
+        used = {record.get('private_key') for record in clients.load_peers().values()}
+        loaded = load_pool()
+        entries = [entry for entry in loaded if entry['private_key'] not in used]
+        dirty = len(entries) != len(loaded)
+    return entries
+
+def take():
+    global dirty
+    with pool_lock:
+        pool = pool_entries()
+        if not pool:
+            counters['misses'] += 1
+            return None
+        entry = pool.pop()
+        dirty = True
+        counters['hits'] += 1
+        return entry
+
+def size():
+    with pool_lock:
+        return len(pool_entries())
+
+def flush():
+    global dirty
+    with flush_lock:
+        with pool_lock:
+            if not dirty:
+                return
+            snapshot = list(pool_entries())
+            dirty = False
+        try:
+            save_pool(snapshot)
+        except (OSError, subprocess.CalledProcessError):
+            dirty = True
+            raise
+
+def refill(wg_cmd, target, batch):
+    global dirty
+    with pool_lock:
+        missing = target - len(pool_entries())
+    added = []
+    if missing > 0:
+        fresh = [generate_keys(wg_cmd) for _ in range(min(missing, batch))]
+        with pool_lock:
+            pool = pool_entries()
+            added = fresh[:max(target - len(pool), 0)]
+            pool.extend(added)
+            dirty = dirty or bool(added)
+        counters['generated'] += len(added)
+    flush()
+    return len(added)
@@ -71,8 +71,9 @@ if [ "$base_prefix" -ne 24 ]; then
 fi
 
 base_subnet="${a}.${b}.${c}"
+reserved_ips=" ${CLIENT_RESERVED_IPS:-} "
 octet=2
-while grep -E "AllowedIPs\s*=\s*$base_subnet\.$octet/32" "$WG_CONFIG_FILE" > /dev/null; do
+while grep -E "AllowedIPs\s*=\s*$base_subnet\.$octet/32" "$WG_CONFIG_FILE" > /dev/null || [[ "$reserved_ips" == *" $base_subnet.$octet/32 "* ]]; do
     (( octet++ ))
 done
 
@@ -81,34 +82,12 @@ if [ "$octet" -gt 254 ]; then
     exit 1
 fi
 
-pwd=$(pwd)
-
-mkdir -p "$pwd/users/$CLIENT_NAME"
-
-key=$($WG_CMD genkey)
-psk=$($WG_CMD genpsk)
-
-get_value() {
-    local key="$1"
-    value=$(awk -F '=' -v k="$key" '$1 ~ k {gsub(/^[ \t]+|[ \t]+$/, "", $2); print $2}' "$WG_CONFIG_FILE")
-
-    if [[ -z "$value" ]]; then
-        value=0
-        echo "Значение для '$key' не найдено. Устанавливаем в 0."
-    fi
-
-    echo "$value"
-}
-
-dns_servers=$(awk '/^\[Interface\]/ {flag=1; next} /^\[/ {flag=0} flag && /^DNS\s*=/ {
-    gsub(/DNS\s*=\s*/, "")
-    print
-    exit
-}' "$WG_CONFIG_FILE")
-
-if [ -z "$dns_servers" ]; then
-    dns_servers="8.8.8.8, 8.8.4.4"
-    echo "DNS servers not found in WireGuard configuration. Using default DNS 8.8.8.8."
+key="${CLIENT_PRIVATE_KEY:-$($WG_CMD genkey)}"
+psk="${CLIENT_PSK:-$($WG_CMD genpsk)}"
+if [ -n "$CLIENT_PRIVATE_KEY" ] && [ -n "$CLIENT_PUBLIC_KEY" ]; then
+    public_key="$CLIENT_PUBLIC_KEY"
+else
+    public_key=$(echo "$key" | $WG_CMD pubkey)
 fi
 
 if [ "$IPV6" == "yes" ]; then
@@ -160,84 +139,16 @@ else
     ALLOWED_IPS="$base_subnet.$octet/32"
 fi
 
-server_private_key=$(awk '/^PrivateKey\s*=/ {print $3}' "$WG_CONFIG_FILE")
-if [ -z "$server_private_key" ]; then
-    echo "Error: Server PrivateKey not found in WireGuard configuration."
-    exit 1
-fi
-server_public_key=$(echo "$server_private_key" | $WG_CMD pubkey)
-
 cat << EOF >> "$WG_CONFIG_FILE"
 # BEGIN_PEER $CLIENT_NAME
 [Peer]
-PublicKey = $(echo "$key" | $WG_CMD pubkey)
+PublicKey = $public_key
 PresharedKey = $psk
 AllowedIPs = $ALLOWED_IPS
 # END_PEER $CLIENT_NAME
 EOF
 
-if [ "$IPV6" == "yes" ]; then
-    listen_port=$(awk '/ListenPort\s*=/ {print $3}' "$WG_CONFIG_FILE")
-    cat << EOF > "$pwd/users/$CLIENT_NAME/$CLIENT_NAME.conf"
-[Interface]
-Address = $ALLOWED_IPS
-DNS = $dns_servers
-PrivateKey = $key
-EOF
-
-    if [[ "$WG_CONFIG_FILE" == *amnezia* ]]; then
-        cat << EOF >> "$pwd/users/$CLIENT_NAME/$CLIENT_NAME.conf"
-    Jc=$(get_value "Jc")
-    Jmin=$(get_value "Jmin")
-    Jmax=$(get_value "Jmax")
-    H1=$(get_value "H1")
-    H2=$(get_value "H2")
-    H3=$(get_value "H3")
-    H4=$(get_value "H4")
-EOF
-    fi
-
-    cat << EOF >> "$pwd/users/$CLIENT_NAME/$CLIENT_NAME.conf"
-[Peer]
-PublicKey = $server_public_key
-PresharedKey = $psk
-AllowedIPs = 0.0.0.0/0, ::/0
-Endpoint = $ENDPOINT:$listen_port
-PersistentKeepalive = 25
-EOF
-else
-    listen_port=$(awk '/ListenPort\s*=/ {print $3}' "$WG_CONFIG_FILE")
-    cat << EOF > "$pwd/users/$CLIENT_NAME/$CLIENT_NAME.conf"
-[Interface]
-Address = $ALLOWED_IPS
-DNS = $dns_servers
-PrivateKey = $key
-EOF
-
-    if [[ "$WG_CONFIG_FILE" == *amnezia* ]]; then
-        cat << EOF >> "$pwd/users/$CLIENT_NAME/$CLIENT_NAME.conf"
-    Jc=$(get_value "Jc")
-    Jmin=$(get_value "Jmin")
-    Jmax=$(get_value "Jmax")
-    H1=$(get_value "H1")
-    H2=$(get_value "H2")
-    H3=$(get_value "H3")
-    H4=$(get_value "H4")
-EOF
-    fi
-
-    cat << EOF >> "$pwd/users/$CLIENT_NAME/$CLIENT_NAME.conf"
-[Peer]
-PublicKey = $server_public_key
-PresharedKey = $psk
-AllowedIPs = 0.0.0.0/0
-Endpoint = $ENDPOINT:$listen_port
-PersistentKeepalive = 25
-EOF
-fi
-
-qrencode -l L < "$pwd/users/$CLIENT_NAME/$CLIENT_NAME.conf" -o "$pwd/users/$CLIENT_NAME/$CLIENT_NAME.png"
-
 $WG_CMD addconf "$(basename "$WG_CONFIG_FILE" .conf)" <(sed -n "/^# BEGIN_PEER $CLIENT_NAME$/, /^# END_PEER $CLIENT_NAME$/p" "$WG_CONFIG_FILE")
 
+echo "CLIENT_RECORD $key $psk $ALLOWED_IPS"
 echo "Client $CLIENT_NAME successfully added to WireGuard"
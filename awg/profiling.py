@@ -0,0 +1,85 @@
+import io
+import os
+import sys
+import time
+import marshal
+import pstats
+import threading
+import tracemalloc
+from collections import Counter
+
+MAX_SECONDS = 300
+TOP_STATS = 40
+SAMPLE_INTERVAL = 0.005
+TRACE_FRAMES = 1
+
+previous_snapshot = None
+
+def format_profile(profiler, limit=TOP_STATS):
+    stream = io.StringIO()
+    stats = pstats.Stats(profiler, stream=stream)
+    stats.sort_stats('cumulative').print_stats(limit)
+    stats.sort_stats('tottime').print_stats(limit)
+    return stream.getvalue()
+
+def dump_profile(profiler):
+    profiler.create_stats()
+    return marshal.dumps(profiler.stats)
+
+def frame_label(frame):
+    return f"{frame.f_code.co_name} ({os.path.basename(frame.f_code.co_filename)}:{frame.f_lineno})"
+
+def sample_stacks(seconds, interval=SAMPLE_INTERVAL):
+    me = threading.get_ident()
+    stacks = Counter()
+    deadline = time.monotonic() + seconds
+    while time.monotonic() < deadline:
+        names = {thread.ident: thread.name for thread in threading.enumerate()}
+        for ident, frame in sys._current_frames().items():
+            if ident == me:
+                continue
+            stack = []
+            while frame is not None:
+                stack.append(frame_label(frame))
+                frame = frame.f_back
+            stack.append(names.get(ident, str(ident)))
+            stacks[';'.join(reversed(stack))] += 1
+        time.sleep(interval)
+    return stacks
+
+def format_samples(stacks, limit=TOP_STATS):
+    leaves = Counter()
+    for stack, count in stacks.items():
+        leaves[stack.rsplit(';', 1)[-1]] += count
+    total = sum(stacks.values()) or 1
+    lines = [f"Samples: {total}", "", "Top frames:"]
+    lines += [f"{count:8} {count / total:6.1%}  {label}" for label, count in leaves.most_common(limit)]
+    lines += ["", "Collapsed stacks (flamegraph.pl / speedscope):"]
+    lines += [f"{stack} {count}" for stack, count in stacks.most_common()]
+    return '\n'.join(lines) + '\n'
+
+def memory_report(counters, limit=TOP_STATS):
+    global previous_snapshot
+    if not tracemalloc.is_tracing():
+        tracemalloc.start(TRACE_FRAMES)
+        previous_snapshot = None
+    snapshot = tracemalloc.take_snapshot().filter_traces((
+        tracemalloc.Filter(False, tracemalloc.__file__),
+        tracemalloc.Filter(False, '<frozen importlib._bootstrap>'),
+        tracemalloc.Filter(False, '<frozen importlib._bootstrap_external>'),
+    ))
+    current, peak = tracemalloc.get_traced_memory()
+    lines = [f"Traced: {current / 1024 / 1024:.1f} MiB, peak: {peak / 1024 / 1024:.1f} MiB", "", "Objects:"]
+    lines += [f"  {name}: {count}" for name, count in counters.items()]
+    lines += ["", "Top allocations:"]
+    lines += [f"  {stat}" for stat in snapshot.statistics('lineno')[:limit]]
+    if previous_snapshot is not None:
+        lines += ["", "Growth since the previous snapshot:"]
+        lines += [f"  {stat}" for stat in snapshot.compare_to(previous_snapshot, 'lineno')[:limit]]
+    previous_snapshot = snapshot
+    return '\n'.join(lines) + '\n'
+
+def stop_memory_tracing():
+    global previous_snapshot
+    previous_snapshot = None
+    tracemalloc.stop()
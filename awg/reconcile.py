@@ -0,0 +1,131 @@
+import os
+import json
+import hashlib
+import subprocess
+
+INTERFACE_STATE_FILE = 'files/interface.json'
+
+def config_public_keys(config_text):
+    keys = set()
+    in_peer = False
+    for line in config_text.splitlines():
+        line = line.strip()
+        if line.startswith('['):
+            in_peer = line == '[Peer]'
+        elif in_peer:
+            key, sep, value = line.partition('=')
+            if sep and key.strip() == 'PublicKey':
+                keys.add(value.strip())
+    return keys
+
+def diff_peers(peer_index, live_peers, config_keys=()):
+    drift = {'missing': [], 'extra': [], 'blocked_live': [], 'mismatched': []}
+    known_keys = set(config_keys)
+    for name, peer in peer_index.items():
+        public_key = peer['public_key']
+        known_keys.add(public_key)
+        live = live_peers.get(public_key)
+        if peer['blocked']:
+            if live is not None:
+                drift['blocked_live'].append((name, public_key))
+            continue
+        if live is None:
+            drift['missing'].append((name, public_key))
+            continue
+        fields = []
+        if live['allowed_ips'] != peer['allowed_ips']:
+            fields.append('allowed_ips')
+        if (live['preshared_key'] is None) != (peer['preshared_key'] is None):
+            fields.append('preshared_key')
+        if fields:
+            drift['mismatched'].append((name, public_key, fields))
+    for public_key in live_peers.keys() - known_keys:
+        drift['extra'].append((None, public_key))
+    return drift
+
+def has_drift(drift):
+    return any(drift.values())
+
+def fix_operations(drift, peer_index):
+    operations = []
+    for _, public_key in drift['blocked_live']:
+        operations.append((['peer', public_key, 'remove'], None))
+    for item in drift['missing'] + drift['mismatched']:
+        name, public_key = item[0], item[1]
+        peer = peer_index[name]
+        args = ['peer', public_key]
+        psk_input = None
+        if peer['preshared_key']:
+            args += ['preshared-key', '/dev/stdin']
+            psk_input = peer['preshared_key'] + '\n'
+        else:
+            args += ['preshared-key', '/dev/null']
+        args += ['allowed-ips', ','.join(peer['allowed_ips'])]
+        operations.append((args, psk_input))
+    return operations
+
+def apply_fixes(drift, peer_index, interface, wg_cmd):
+    failed = 0
+    for args, psk_input in fix_operations(drift, peer_index):
+        result = subprocess.run([wg_cmd, 'set', interface] + args, input=psk_input, text=True, capture_output=True)
+        if result.returncode != 0:
+            failed += 1
+    return failed
+
+def format_summary(drift):
+    lines = []
+    for name, public_key in drift['missing']:
+        lines.append(f"➖ {name}: отсутствует на интерфейсе")
+    for name, public_key in drift['blocked_live']:
+        lines.append(f"⛔ {name}: заблокирован, но активен на интерфейсе")
+    for name, public_key, fields in drift['mismatched']:
+        lines.append(f"⚠️ {name}: расхождение ({', '.join(fields)})")
+    for _, public_key in drift['extra']:
+        lines.append(f"➕ {public_key}: неизвестный пир на интерфейсе (не удаляется автоматически)")
+    return '\n'.join(lines)
+
+def read_interface_section(config_text):
+    values = {}
+    in_interface = False
+    for line in config_text.splitlines():
+        line = line.strip()
+        if line.startswith('['):
+            in_interface = line == '[Interface]'
+            continue
+        if not in_interface or not line or line.startswith('#'):
+            continue
+        key, sep, value = line.partition('=')
+        if sep:
+            values.setdefault(key.strip(), []).append(value.strip())
+    return values
+
+def interface_fingerprint(section):
+    return hashlib.sha256(json.dumps(section, sort_keys=True).encode()).hexdigest()
+
+def load_interface_fingerprint():
+    if not os.path.exists(INTERFACE_STATE_FILE):
+        return None
+    with open(INTERFACE_STATE_FILE, 'r') as f:
+        try:
+            return json.load(f).get('fingerprint')
+        except json.JSONDecodeError:
+            return None
+
+def save_interface_fingerprint(fingerprint):
+    os.makedirs(os.path.dirname(INTERFACE_STATE_FILE), exist_ok=True)
+    temp_path = INTERFACE_STATE_FILE + '.tmp'
+    with open(temp_path, 'w') as f:
+        json.dump({'fingerprint': fingerprint}, f)
+    os.replace(temp_path, INTERFACE_STATE_FILE)
+
+def interface_changes(section, live_interface, applied_fingerprint):
+    if live_interface is None:
+        return ['interface']
+    changes = []
+    if section.get('PrivateKey', [''])[0] != live_interface['private_key']:
+        changes.append('PrivateKey')
+    if section.get('ListenPort') and section['ListenPort'][0] != live_interface['listen_port']:
+        changes.append('ListenPort')
+    if not changes and applied_fingerprint is not None and applied_fingerprint != interface_fingerprint(section):
+        changes.append('[Interface]')
+    return changes
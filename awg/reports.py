@@ -0,0 +1,53 @@
+import csv
+from datetime import datetime
+import pytz
+
+REPORT_HEADER = [
+    'name', 'ipv4', 'ipv6', 'status', 'expiration', 'quota_bytes',
+    'used_bytes', 'received_bytes', 'sent_bytes', 'last_handshake', 'period_bytes'
+]
+
+def split_addresses(allowed_ips):
+    ipv4 = ' '.join(ip for ip in allowed_ips if ':' not in ip)
+    ipv6 = ' '.join(ip for ip in allowed_ips if ':' in ip)
+    return ipv4, ipv6
+
+def iter_report_rows(peers, snapshot, traffic_limits, expirations, period_totals=None):
+    now = datetime.now(pytz.UTC)
+    for username, peer in peers:
+        client_stats = snapshot.get(username)
+        user_traffic = traffic_limits.get(username, {})
+        expiration = expirations.get(username)
+        received_bytes = client_stats['received_bytes'] if client_stats else 0
+        sent_bytes = client_stats['sent_bytes'] if client_stats else 0
+        latest_handshake = client_stats['latest_handshake'] if client_stats else 0
+        if peer['blocked']:
+            status = 'blocked'
+        elif expiration and expiration <= now:
+            status = 'expired'
+        else:
+            status = 'active'
+        ipv4, ipv6 = split_addresses(peer['allowed_ips'])
+        yield [
+            username,
+            ipv4,
+            ipv6,
+            status,
+            expiration.isoformat() if expiration else '',
+            user_traffic.get('limit') or '',
+            user_traffic.get('used', received_bytes + sent_bytes),
+            received_bytes,
+            sent_bytes,
+            datetime.fromtimestamp(latest_handshake, pytz.UTC).isoformat() if latest_handshake else '',
+            period_totals.get(username, 0) if period_totals is not None else '',
+        ]
+
+def write_csv(path, rows):
+    count = 0
+    with open(path, 'w', newline='', encoding='utf-8-sig') as f:
+        writer = csv.writer(f)
+        writer.writerow(REPORT_HEADER)
+        for row in rows:
+            writer.writerow(row)
+            count += 1
+    return count
@@ -0,0 +1,75 @@
+import time
+
+IDLE = 'idle'
+WAITING_FOR_USER_NAME = 'waiting_for_user_name'
+CHOOSING_CONNECTION = 'choosing_connection'
+CHOOSING_DURATION = 'choosing_duration'
+CHOOSING_TRAFFIC = 'choosing_traffic'
+
+TRANSITIONS = {
+    IDLE: {WAITING_FOR_USER_NAME},
+    WAITING_FOR_USER_NAME: {WAITING_FOR_USER_NAME, CHOOSING_CONNECTION, CHOOSING_DURATION},
+    CHOOSING_CONNECTION: {CHOOSING_DURATION},
+    CHOOSING_DURATION: {CHOOSING_TRAFFIC},
+    CHOOSING_TRAFFIC: set(),
+}
+
+class Session:
+    def __init__(self, chat_id):
+        self.chat_id = chat_id
+        self.main_message = (None, None)
+        self.state = IDLE
+        self.data = {}
+        self.touched = time.monotonic()
+        self.dashboard = False
+        self.dashboard_text = None
+        self.dashboard_edited = 0.0
+        self.selection = set()
+        self.selection_page = 0
+        self.group = None
+        self.group_page = 0
+
+    def can_enter(self, state):
+        return state == IDLE or state in TRANSITIONS[self.state]
+
+    def set_state(self, state, **data):
+        if not self.can_enter(state):
+            return False
+        if state == IDLE or self.state == IDLE:
+            self.data = {}
+        self.state = state
+        self.data.update(data)
+        return True
+
+    def reset(self):
+        self.set_state(IDLE)
+
+class SessionStore:
+    def __init__(self, ttl):
+        self.ttl = ttl
+        self.sessions = {}
+        self.next_eviction = time.monotonic() + ttl
+
+    def get(self, chat_id):
+        now = time.monotonic()
+        if now >= self.next_eviction:
+            self.evict_expired(now)
+        session = self.sessions.get(chat_id)
+        if session is None or now - session.touched > self.ttl:
+            session = Session(chat_id)
+            self.sessions[chat_id] = session
+        session.touched = now
+        return session
+
+    def evict_expired(self, now=None):
+        if now is None:
+            now = time.monotonic()
+        expired = [chat_id for chat_id, session in self.sessions.items() if now - session.touched > self.ttl]
+        for chat_id in expired:
+            del self.sessions[chat_id]
+        self.next_eviction = now + self.ttl
+        return len(expired)
+
+    def active(self):
+        now = time.monotonic()
+        return [session for session in self.sessions.values() if now - session.touched <= self.ttl]
@@ -0,0 +1,146 @@
+import os
+import configparser
+
+SETTINGS_FILE = 'files/setting.ini'
+
+RESTART_REQUIRED = (
+    'bot_token', 'api_server', 'mode', 'webhook_url', 'webhook_path', 'webhook_host', 'webhook_port',
+    'webhook_secret', 'reconcile_interval', 'key_pool_size', 'key_pool_refill_interval', 'key_pool_refill_batch',
+    'stats_collector', 'stats_collector_interval', 'stats_collector_capacity', 'dashboard_interval',
+    'ha', 'ha_lock_file', 'ha_listen', 'ha_peer', 'ha_secret', 'api_socket',
+)
+
+current = None
+seen_mtime = None
+
+def required(values, key):
+    value = values.get(key, '').strip()
+    if not value:
+        raise ValueError(f"не задан параметр {key}")
+    return value
+
+def get_int(values, key, default, minimum=0, maximum=None):
+    raw = values.get(key, '').strip()
+    if not raw:
+        return default
+    try:
+        value = int(raw)
+    except ValueError:
+        raise ValueError(f"{key} должен быть целым числом, получено {raw!r}")
+    if value < minimum or (maximum is not None and value > maximum):
+        limits = f"от {minimum}" + (f" до {maximum}" if maximum is not None else "")
+        raise ValueError(f"{key} должен быть {limits}, получено {value}")
+    return value
+
+def get_float(values, key, default, minimum=0.0, maximum=None):
+    raw = values.get(key, '').strip()
+    if not raw:
+        return default
+    try:
+        value = float(raw)
+    except ValueError:
+        raise ValueError(f"{key} должен быть числом, получено {raw!r}")
+    if value < minimum or (maximum is not None and value > maximum):
+        limits = f"от {minimum}" + (f" до {maximum}" if maximum is not None else "")
+        raise ValueError(f"{key} должен быть {limits}, получено {value}")
+    return value
+
+def get_bool(values, key, default=False):
+    raw = values.get(key, '').strip().lower()
+    if not raw:
+        return default
+    if raw not in ('true', 'false'):
+        raise ValueError(f"{key} должен быть true или false, получено {raw!r}")
+    return raw == 'true'
+
+def parse_admin_ids(raw):
+    try:
+        admin_ids = frozenset(int(admin_id) for admin_id in raw.split(',') if admin_id.strip())
+    except ValueError:
+        raise ValueError(f"admin_id должен содержать Telegram ID через запятую, получено {raw!r}")
+    if not admin_ids:
+        raise ValueError("не задан параметр admin_id")
+    return admin_ids
+
+class Settings:
+    def __init__(self, values):
+        self.values = values
+        self.bot_token = required(values, 'bot_token')
+        self.admin_ids = parse_admin_ids(required(values, 'admin_id'))
+        self.wg_config_file = required(values, 'wg_config_file')
+        if not os.path.exists(self.wg_config_file):
+            raise ValueError(f"файл {self.wg_config_file} не найден")
+        self.endpoint = required(values, 'endpoint')
+        self.api_server = values.get('api_server', '').strip()
+        self.mode = values.get('mode', 'polling').strip() or 'polling'
+        if self.mode not in ('polling', 'webhook'):
+            raise ValueError(f"mode должен быть polling или webhook, получено {self.mode!r}")
+        self.webhook_url = values.get('webhook_url', '').strip()
+        self.webhook_path = values.get('webhook_path', '').strip() or '/webhook'
+        self.webhook_host = values.get('webhook_host', '').strip() or '127.0.0.1'
+        self.webhook_port = get_int(values, 'webhook_port', 8080, minimum=1, maximum=65535)
+        self.webhook_secret = values.get('webhook_secret', '').strip()
+        if self.mode == 'webhook' and not self.webhook_url and not self.webhook_secret:
+            raise ValueError("в режиме webhook без webhook_url нужно задать webhook_secret")
+        self.reconcile_interval = get_int(values, 'reconcile_interval', 5)
+        self.reconcile_autofix = get_bool(values, 'reconcile_autofix')
+        self.session_ttl = get_int(values, 'session_ttl', 24, minimum=1)
+        self.self_service = get_bool(values, 'self_service')
+        self.self_service_rate = get_int(values, 'self_service_rate', 5, minimum=1)
+        self.key_pool_size = get_int(values, 'key_pool_size', 10)
+        self.key_pool_refill_interval = get_int(values, 'key_pool_refill_interval', 60, minimum=1)
+        self.key_pool_refill_batch = get_int(values, 'key_pool_refill_batch', 5, minimum=1)
+        self.billing_day = get_int(values, 'billing_day', 1, minimum=1, maximum=28)
+        self.top_users_count = get_int(values, 'top_users_count', 10, minimum=1)
+        self.stats_collector = get_bool(values, 'stats_collector')
+        self.stats_collector_interval = get_int(values, 'stats_collector_interval', 5, minimum=1)
+        self.stats_collector_capacity = get_int(values, 'stats_collector_capacity', 4096, minimum=1)
+        self.archive_after_days = get_int(values, 'archive_after_days', 0)
+        self.dashboard = get_bool(values, 'dashboard')
+        self.dashboard_interval = get_int(values, 'dashboard_interval', 15, minimum=5)
+        self.ha = get_bool(values, 'ha')
+        self.ha_lock_file = values.get('ha_lock_file', '').strip() or 'files/ha.lock'
+        self.ha_listen = values.get('ha_listen', '').strip()
+        if self.ha_listen and not self.ha_listen.rpartition(':')[2].isdigit():
+            raise ValueError(f"ha_listen должен быть в формате адрес:порт, получено {self.ha_listen!r}")
+        self.ha_peer = values.get('ha_peer', '').strip()
+        self.ha_secret = values.get('ha_secret', '').strip()
+        if (self.ha_listen or self.ha_peer) and not self.ha_secret:
+            raise ValueError("для репликации (ha_listen, ha_peer) требуется параметр ha_secret")
+        self.api_socket = values.get('api_socket', '').strip()
+        self.trace_sample_rate = get_float(values, 'trace_sample_rate', 0.0, minimum=0.0, maximum=1.0)
+        amnezia = 'amnezia' in self.wg_config_file.lower()
+        self.wg_cmd = 'awg' if amnezia else 'wg'
+        self.wg_quick_cmd = 'awg-quick' if amnezia else 'wg-quick'
+
+def read_values(path):
+    config = configparser.ConfigParser()
+    try:
+        if not config.read(path):
+            raise ValueError(f"не удалось прочитать {path}")
+    except configparser.Error as e:
+        raise ValueError(str(e))
+    if not config.has_section('setting'):
+        raise ValueError(f"в {path} нет секции [setting]")
+    return {key: config['setting'][key] for key in config['setting']}
+
+def load(path=SETTINGS_FILE):
+    global current, seen_mtime
+    seen_mtime = os.stat(path).st_mtime_ns
+    config = Settings(read_values(path))
+    current = config
+    return config
+
+def get():
+    if current is None:
+        return load()
+    return current
+
+def changed(path=SETTINGS_FILE):
+    try:
+        return os.stat(path).st_mtime_ns != seen_mtime
+    except OSError:
+        return False
+
+def restart_required(old, new):
+    return [key for key in RESTART_REQUIRED if old.values.get(key, '') != new.values.get(key, '')]
@@ -0,0 +1,73 @@
+import time
+import heapq
+import logging
+import subprocess
+import db
+
+logger = logging.getLogger(__name__)
+
+snapshot = {}
+snapshot_time = None
+rates = {}
+shared = None
+
+def build_snapshot(peer_index, live_peers):
+    result = {}
+    for username, peer in peer_index.items():
+        live = live_peers.get(peer['public_key'])
+        if live is None:
+            continue
+        result[username] = {
+            'received_bytes': live['received_bytes'],
+            'sent_bytes': live['sent_bytes'],
+            'latest_handshake': live['latest_handshake'],
+            'endpoint': live['endpoint'],
+        }
+    return result
+
+def compute_rates(previous, current, elapsed):
+    result = {}
+    if not elapsed or elapsed <= 0:
+        return result
+    for username, client in current.items():
+        before = previous.get(username)
+        if before is None:
+            continue
+        received = client['received_bytes'] - before['received_bytes']
+        sent = client['sent_bytes'] - before['sent_bytes']
+        result[username] = {
+            'received_rate': max(received, 0) / elapsed,
+            'sent_rate': max(sent, 0) / elapsed,
+        }
+    return result
+
+def refresh(wg_config_file, wg_cmd):
+    global snapshot, snapshot_time, rates
+    if shared is not None and shared.alive():
+        published = shared.read()
+        if published is not None:
+            snapshot, rates, snapshot_time = published
+            return snapshot
+    interface_name = db.get_interface_name(wg_config_file)
+    try:
+        peer_index = db.get_peer_index(wg_config_file)
+        live_peers = db.get_wg_dump(interface_name, wg_cmd)
+    except (OSError, subprocess.CalledProcessError) as e:
+        logger.error("Failed to read transfer counters of %s: %s", interface_name, e)
+        return snapshot
+    current = build_snapshot(peer_index, live_peers)
+    now = time.time()
+    if snapshot_time is not None:
+        rates = compute_rates(snapshot, current, now - snapshot_time)
+    snapshot = current
+    snapshot_time = now
+    return snapshot
+
+def get(username):
+    return snapshot.get(username)
+
+def top_k(values, k):
+    return heapq.nlargest(k, values, key=lambda item: item[1])
+
+def top_rates(k):
+    return top_k(((username, rate['received_rate'] + rate['sent_rate']) for username, rate in rates.items()), k)
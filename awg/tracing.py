@@ -0,0 +1,149 @@
+import os
+import json
+import time
+import random
+import logging
+import secrets
+import functools
+import contextvars
+import contextlib
+from collections import deque
+from logging.handlers import RotatingFileHandler
+
+TRACE_FILE = 'files/traces.jsonl'
+TRACE_FILE_MAX_BYTES = 10 * 1024 * 1024
+TRACE_FILE_BACKUPS = 3
+SUMMARY_TRACES = 2000
+
+sample_rate = 0.0
+current = contextvars.ContextVar('trace_span', default=None)
+NOOP = contextlib.nullcontext()
+
+exporter = logging.getLogger('awg.traces')
+exporter.propagate = False
+
+class Trace:
+    __slots__ = ('trace_id', 'wall_start', 'spans', 'link')
+
+    def __init__(self, link=None):
+        self.trace_id = secrets.token_hex(8)
+        self.wall_start = time.time()
+        self.spans = []
+        self.link = link
+
+class Span:
+    __slots__ = ('trace', 'name', 'parent', 'attrs', 'start', 'duration', 'error', 'token')
+
+    def __init__(self, trace, name, parent, attrs):
+        self.trace = trace
+        self.name = name
+        self.parent = parent
+        self.attrs = attrs
+        self.error = None
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        self.token = current.set(self)
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.duration = time.perf_counter() - self.start
+        current.reset(self.token)
+        if exc_type is not None:
+            self.error = exc_type.__name__
+        self.trace.spans.append(self)
+        if self.parent is None:
+            export(self)
+        return False
+
+def span(name, **attrs):
+    parent = current.get()
+    if parent is None:
+        return NOOP
+    return Span(parent.trace, name, parent, attrs)
+
+def start_trace(name, **attrs):
+    if sample_rate <= 0 or (sample_rate < 1 and random.random() >= sample_rate):
+        return NOOP
+    parent = current.get()
+    return Span(Trace(link=parent.trace.trace_id if parent else None), name, None, attrs)
+
+def traced(name):
+    def decorator(func):
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            with start_trace(name):
+                return await func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+def configure(path=TRACE_FILE):
+    if exporter.handlers:
+        return
+    if os.path.dirname(path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+    handler = RotatingFileHandler(path, maxBytes=TRACE_FILE_MAX_BYTES, backupCount=TRACE_FILE_BACKUPS, delay=True)
+    handler.setFormatter(logging.Formatter('%(message)s'))
+    exporter.addHandler(handler)
+    exporter.setLevel(logging.INFO)
+
+def export(root):
+    trace = root.trace
+    ids = {id(item): index for index, item in enumerate(trace.spans)}
+    record = {
+        'trace_id': trace.trace_id,
+        'name': root.name,
+        'start': trace.wall_start,
+        'duration_ms': round(root.duration * 1000, 3),
+        'spans': [
+            {
+                'name': item.name,
+                'parent': ids.get(id(item.parent)),
+                'offset_ms': round((item.start - root.start) * 1000, 3),
+                'duration_ms': round(item.duration * 1000, 3),
+                **({'attrs': item.attrs} if item.attrs else {}),
+                **({'error': item.error} if item.error else {}),
+            }
+            for item in trace.spans
+        ],
+    }
+    if trace.link:
+        record['link'] = trace.link
+    exporter.info(json.dumps(record, ensure_ascii=False, default=str))
+
+def load_recent(path=TRACE_FILE, limit=SUMMARY_TRACES):
+    if not os.path.exists(path):
+        return []
+    with open(path, 'r') as f:
+        lines = deque(f, maxlen=limit)
+    traces = []
+    for line in lines:
+        try:
+            traces.append(json.loads(line))
+        except json.JSONDecodeError:
+            continue
+    return traces
+
+def percentile(values, fraction):
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+def summarize(traces, top=10, spans_per_trace=3):
+    lines = [f"Трасс: {len(traces)}"]
+    if not traces:
+        return lines[0]
+    lines += ["", "Самые медленные:"]
+    for trace in sorted(traces, key=lambda item: item['duration_ms'], reverse=True)[:top]:
+        started = time.strftime('%d.%m %H:%M:%S', time.localtime(trace['start']))
+        lines.append(f"{trace['duration_ms']:.0f} мс  {trace['name']}  {started}  {trace['trace_id']}")
+        children = sorted((item for item in trace['spans'] if item['parent'] is not None), key=lambda item: item['duration_ms'], reverse=True)
+        for item in children[:spans_per_trace]:
+            lines.append(f"    {item['duration_ms']:.0f} мс  {item['name']}" + (f" ({item['error']})" if item.get('error') else ''))
+    durations = {}
+    for trace in traces:
+        for item in trace['spans']:
+            durations.setdefault(item['name'], []).append(item['duration_ms'])
+    lines += ["", "По операциям (кол-во, p50, p95, макс., мс):"]
+    for name, values in sorted(durations.items(), key=lambda item: sum(item[1]), reverse=True):
+        values.sort()
+        lines.append(f"{name}: {len(values)}, {percentile(values, 0.5):.1f}, {percentile(values, 0.95):.1f}, {values[-1]:.1f}")
+    return '\n'.join(lines)
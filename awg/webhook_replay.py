@@ -0,0 +1,63 @@
+import sys
+import json
+import time
+import asyncio
+import argparse
+import aiohttp
+
+async def replay(url, secret, updates, concurrency):
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies = []
+    failed = 0
+
+    async def post(session, update):
+        nonlocal failed
+        headers = {'X-Telegram-Bot-Api-Secret-Token': secret} if secret else {}
+        async with semaphore:
+            started = time.perf_counter()
+            try:
+                async with session.post(url, json=update, headers=headers) as resp:
+                    await resp.read()
+                    if resp.status != 200:
+                        failed += 1
+                        print(f"update {update.get('update_id')}: HTTP {resp.status}", file=sys.stderr)
+                        return
+            except aiohttp.ClientError as e:
+                failed += 1
+                print(f"update {update.get('update_id')}: {e}", file=sys.stderr)
+                return
+            latencies.append(time.perf_counter() - started)
+
+    async with aiohttp.ClientSession() as session:
+        await asyncio.gather(*(post(session, update) for update in updates))
+    return latencies, failed
+
+def load_updates(path):
+    f = sys.stdin if path == '-' else open(path, 'r', encoding='utf-8')
+    with f:
+        updates = [json.loads(line) for line in f if line.strip()]
+    for update_id, update in enumerate(updates, 1):
+        update.setdefault('update_id', update_id)
+    return updates
+
+def main():
+    parser = argparse.ArgumentParser(description='POST Telegram updates to the bot webhook endpoint, as Telegram would.')
+    parser.add_argument('updates', help='File with one update JSON object per line, or - for stdin.')
+    parser.add_argument('--url', default='http://127.0.0.1:8080/webhook', help='Webhook endpoint URL.')
+    parser.add_argument('--secret', default='', help='Value for the X-Telegram-Bot-Api-Secret-Token header.')
+    parser.add_argument('-c', '--concurrency', type=int, default=1, help='Number of updates in flight.')
+    args = parser.parse_args()
+
+    updates = load_updates(args.updates)
+    latencies, failed = asyncio.run(replay(args.url, args.secret, updates, args.concurrency))
+    if latencies:
+        latencies.sort()
+        p50 = latencies[len(latencies) // 2] * 1000
+        p99 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))] * 1000
+        print(f"sent: {len(latencies)}, failed: {failed}, p50: {p50:.1f} ms, p99: {p99:.1f} ms")
+    else:
+        print(f"sent: 0, failed: {failed}")
+    sys.exit(1 if failed else 0)
+
+if __name__ == '__main__':
+    main()